@@ -0,0 +1,52 @@
+# Answer a file of questions with the AI Agent Workflow, for bulk runs of thousands of questions.
+#
+# The questions are read from a .jsonl file (one JSON string or {"id": ..., "question": ...} object per line) or a .csv file (a
+# 'question' column and an optional 'id' column) as a stream, and each result is appended to a .jsonl output file as soon as its
+# query finishes (see run_batch in source/batch_runner.py). Each output line is the sql_output_agent_response dictionary (user_query,
+# sql_query, response_text and error) with the question's id. Running the same batch again skips the questions already in the
+# output file, so a crashed or interrupted batch resumes where it stopped. Questions whose result was an error (including timeouts)
+# are skipped too, unless --retry-errors is given.
+#
+# Example:
+#     python batch.py questions.jsonl results.jsonl --max-workers 8 --mode serve
+
+import argparse
+
+from source.batch_runner import run_batch
+from source.hybrid_rag_agents import bootstrap_sql_agents
+
+parser = argparse.ArgumentParser(description='Answer a JSONL or CSV file of questions and stream the results to a JSONL file.')
+parser.add_argument('input', help='The .jsonl or .csv file of questions.')
+parser.add_argument('output', help='The .jsonl file the results are appended to.')
+parser.add_argument('--mode', choices=['build', 'stream', 'serve'], default='serve', help='The bootstrap mode of the agents.')
+parser.add_argument('--max-workers', type=int, default=4, help='The maximum number of questions answered at the same time.')
+parser.add_argument('--max-attempts', type=int, default=3, help='The maximum number of attempts for each question.')
+parser.add_argument('--query-timeout', type=float, default=None, help='The maximum number of seconds a question may run for.')
+parser.add_argument('--num-candidates', type=int, default=1, help='The number of SQL query candidates generated on each retry.')
+parser.add_argument('--execution-mode', choices=['agent', 'direct'], default='agent', help='How the SQL queries are executed.')
+parser.add_argument('--collect-metrics', action='store_true', help="Add each query's metrics to its result.")
+parser.add_argument('--retry-errors', action='store_true', help='Answer the questions whose earlier results were errors again.')
+parser.add_argument('--progress', action='store_true', help='Print the progress of the batch.')
+args = parser.parse_args()
+
+sql_agents = bootstrap_sql_agents(mode=args.mode)
+
+batch_stats = run_batch(input_path=args.input,
+                        output_path=args.output,
+                        input_agent=sql_agents['sql_input_agent'],
+                        output_agent=sql_agents['sql_summary_agent'] if args.execution_mode == 'direct' else sql_agents['sql_output_agent'],
+                        max_number_attempts=args.max_attempts,
+                        max_workers=args.max_workers,
+                        query_timeout=args.query_timeout,
+                        keyword_cache=sql_agents['sql_input_agent_cache'],
+                        fast_path_planner=sql_agents['sql_input_fast_path_planner'],
+                        sql_validator=sql_agents['sql_validator'],
+                        num_candidates=args.num_candidates,
+                        execution_mode=args.execution_mode,
+                        toolkit=sql_agents['sql_toolkit'],
+                        collect_metrics=args.collect_metrics,
+                        entity_resolver=sql_agents['entity_resolver'],
+                        retry_errors=args.retry_errors,
+                        print_progess=args.progress)
+
+print(f"Batch finished: {batch_stats}")
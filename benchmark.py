@@ -0,0 +1,54 @@
+# Benchmark the AI Agent Workflow end to end without calling a model.
+#
+# The sql_input_agent and sql_output_agent are replaced by deterministic fake agents (see source/benchmarking.py) which return
+# canned SQL keywords and summaries after an injected latency, while the prompt building, SQL building, validation of the responses,
+# connection pooling and database execution are the project's real code. The database is either an embedded SQLite file (no server
+# needed) or the Postgres database in the DB_* environment variables.
+#
+# The benchmark reports as JSON:
+#     1. startup: The seconds spent importing the project and processing the CSV data with and without the parquet cache.
+#     2. concurrency: For each max_workers value, the wall time, throughput (queries per second), the count, mean, p50, p95 and max
+#        latency of each stage of the workflow (prompt_build, input_agent, sql_build, db_execution, output_agent and the whole query)
+#        and the total attempts, tokens, database queries and rows returned, collected with a metrics hook (see source/instrumentation.py).
+#
+# Example:
+#     python benchmark.py --database sqlite --concurrency 1 2 4 8 --repeat 5 --output benchmark_results.json
+
+import argparse
+import json
+
+from source.benchmarking import run_benchmark
+from source.data_processing import get_resort_traits_data
+from source.hybrid_rag_agents import dtype_dict
+
+parser = argparse.ArgumentParser(description='Benchmark the SQL agent workflow end to end with fake agents.')
+parser.add_argument('--database', choices=['sqlite', 'postgres', 'duckdb'], default='sqlite', help='The database the queries are run on.')
+parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help='The max_workers values benchmarked.')
+parser.add_argument('--repeat', type=int, default=5, help='The number of times each question is asked at each concurrency level.')
+parser.add_argument('--input-latency', type=float, default=0.05, help='Seconds each fake sql_input_agent run takes.')
+parser.add_argument('--output-latency', type=float, default=0.05, help='Seconds each fake sql_output_agent run takes.')
+parser.add_argument('--jitter', type=float, default=0.0, help='Maximum seconds randomly added to each fake sql_input_agent run.')
+parser.add_argument('--execution-mode', choices=['agent', 'direct'], default='agent', help='The execution mode of query_sql_agents.')
+parser.add_argument('--skip-startup', action='store_true', help="Don't measure the import and data processing startup time.")
+parser.add_argument('--seed', type=int, default=0, help='The seed of the random jitter.')
+parser.add_argument('--output', default=None, help='The JSON file the results are written to. Default is stdout.')
+args = parser.parse_args()
+
+results = run_benchmark(data=get_resort_traits_data(),
+                        dtype_dict=dtype_dict,
+                        database=args.database,
+                        concurrency_levels=args.concurrency,
+                        repeat=args.repeat,
+                        input_latency=args.input_latency,
+                        output_latency=args.output_latency,
+                        jitter=args.jitter,
+                        execution_mode=args.execution_mode,
+                        measure_startup_time=not args.skip_startup,
+                        seed=args.seed)
+
+if args.output is None:
+    print(json.dumps(results, indent=2))
+else:
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Benchmark results written to {args.output}")
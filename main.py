@@ -7,6 +7,19 @@
 #     3. max_number_attempts (int): The maximum number of attempts to run the agents. Default is 3.
 #     4. print_response (bool): Whether to print the queries and responses. Default is False.
 #     5. print_progress (bool): Whether to print the messages outlining the progress of the agents. Default is False.
+#     6. max_workers (int): The maximum number of queries run at the same time. Default is 1.
+#     7. query_timeout (float): The maximum number of seconds a single query may run for. Default is None (no timeout).
+#     8. keyword_cache (sql_keyword_cache): A cache of the sql_input_agent's SQL keywords for previously answered questions. Default is None.
+#     9. fast_path_planner (sql_fast_path_planner): A local planner which builds SQL for common question shapes without an LLM. Default is None.
+#     10. sql_validator (sql_query_validator): Checks each SQL query locally before the sql_output_agent runs it. Default is None.
+#     11. num_candidates (int): The number of SQL query candidates generated at the same time on each retry. Default is 1.
+#     12. execution_mode (str): 'agent' (the output agent runs the SQL with its toolkit) or 'direct' (the SQL is run in Python and
+#         the output agent, use sql_summary_agent, only summarises the rows). Default is 'agent'.
+#     13. toolkit (sql_toolkit): The toolkit used to run the SQL in the 'direct' execution mode. Default is None.
+#     14. collect_metrics (bool): Whether to add a 'metrics' key to each result with the query's stage timings, attempts, tokens,
+#         rows returned and cache hits (see source/instrumentation.py). Default is False.
+#     15. entity_resolver (sql_entity_resolver): Resolves the places and resorts in each question to the values stored in the database
+#         without a vector database search. Default is None.
 #
 # Returns:
 #     1. results(list(dict)): A list of results from the sql_output_agent where each query result is a list element 
@@ -31,19 +44,33 @@
 #   "max_elevation_m": FLOAT,
 #   "lift_count": INTEGER}
 
-from source.hybrid_rag_agents import sql_input_agent, sql_output_agent
+from source.hybrid_rag_agents import bootstrap_sql_agents
 from source.query_agents import query_sql_agents
 
+# Build the agents. Use mode='serve' to attach to an already populated knowledge base and database without reloading them.
+sql_agents = bootstrap_sql_agents(mode='build')
+print(f"Startup times (seconds): {sql_agents['startup_times']}")
+
 practice_queries = ['What is the elevation of breckenridge?',
                     'What is the average number of chairlifts at ski resorts in Canada?',
                     'What ski resort in Italy has the largest elevation range?',
                     'How many ski resorts are in France and the United States?',]
 
 responses = query_sql_agents(queries=practice_queries,
-                             input_agent=sql_input_agent,
-                             output_agent=sql_output_agent,
+                             input_agent=sql_agents['sql_input_agent'],
+                             output_agent=sql_agents['sql_output_agent'],
                              max_number_attempts=3,
+                             keyword_cache=sql_agents['sql_input_agent_cache'],
+                             fast_path_planner=sql_agents['sql_input_fast_path_planner'],
+                             sql_validator=sql_agents['sql_validator'],
+                             entity_resolver=sql_agents['entity_resolver'],
                              print_response=True,
                              print_progess=True)
 
-print(responses)
\ No newline at end of file
+print(responses)
+print(f"Fast path planner: {sql_agents['sql_input_fast_path_planner'].get_stats()}")
+print(f"SQL validator: {sql_agents['sql_validator'].get_stats()}")
+print(f"Entity resolver: {sql_agents['entity_resolver'].get_stats()}")
+print(f"Rollup rewriter: {sql_agents['sql_toolkit'].rollup_rewriter.get_stats()}")
+print(f"Embedding cache: {sql_agents['embedding_cache'].get_stats()}")
+print(f"Index recommendations: {sql_agents['sql_toolkit'].index_advisor.recommend()}")
\ No newline at end of file
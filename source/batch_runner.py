@@ -0,0 +1,204 @@
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+import csv
+import json
+import os
+import time
+
+from agno.agent import Agent
+
+from .caching import sql_keyword_cache
+from .entity_resolution import sql_entity_resolver
+from .fast_path_planner import sql_fast_path_planner
+from .query_agents import iter_queries_concurrently
+from .sql_toolkit import sql_toolkit
+from .sql_validation import sql_query_validator
+
+#keys a question may be stored under in a JSONL or CSV batch file, the first one found is used
+question_keys = ['question', 'user_query', 'query']
+
+def get_question_id(question:str) -> str:
+    """
+    Get the id of a question which has no id in its batch file: a hash of the question, so a rerun recognises it even if the
+    file's order changes.
+
+    Parameters:
+        question (str): The user's natural language question.
+
+    Returns:
+        str: The id of the question.
+    """
+    return sha256(question.strip().encode()).hexdigest()[:16]
+
+def read_batch_questions(path:Path) -> Iterator[Tuple[str, str]]:
+    """
+    Read the questions of a batch file one at a time, so the file is never held in memory.
+
+    A .jsonl file has one question per line, either a JSON string or an object with the question under one of question_keys
+    and an optional 'id'. A .csv file has a header row, the question in one of question_keys columns (otherwise the first column)
+    and an optional 'id' column. Questions without an id are given get_question_id. Blank questions are skipped.
+
+    Parameters:
+        path (Path): Path of the .jsonl or .csv batch file.
+
+    Yields:
+        Tuple[str, str]: The id and the question.
+    """
+    path = Path(path)
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.suffix.lower() == '.csv':
+            reader = csv.DictReader(file)
+            question_key = next((key for key in question_keys if key in (reader.fieldnames or [])), (reader.fieldnames or [None])[0])
+            records = ({'id': row.get('id'), 'question': row.get(question_key)} for row in reader)
+        else:
+            records = (parse_jsonl_question(line) for line in file if line.strip())
+        for record in records:
+            question = (record['question'] or '').strip()
+            if not question:
+                continue
+            yield str(record['id']) if record['id'] not in (None, '') else get_question_id(question), question
+
+def parse_jsonl_question(line:str) -> dict:
+    """Parse a line of a .jsonl batch file into a dictionary with the keys: id, question."""
+    record = json.loads(line)
+    if isinstance(record, str):
+        return {'id': None, 'question': record}
+    question = next((record[key] for key in question_keys if key in record), None)
+    return {'id': record.get('id'), 'question': question}
+
+def read_answered_ids(output_path:Path,retry_errors:bool=False) -> set:
+    """
+    Read the ids of the questions already answered in a batch's output file.
+
+    A result whose query failed or timed out ('error' is True) counts as answered, so a rerun doesn't ask it again unless
+    retry_errors is set. A retried question's new result is appended after the old one. Complete lines which aren't a result
+    (i.e. corrupted or without an 'id') are skipped, and only a last line left incomplete by a crash is removed from the file so
+    the results appended next start on a new line.
+
+    Parameters:
+        output_path (Path): Path of the batch's .jsonl output file.
+        retry_errors (bool): If True, the questions whose every result is an error aren't counted as answered. Default is False.
+
+    Returns:
+        set: The ids of the answered questions.
+    """
+    answered_ids = set()
+    errored_ids = set()
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return answered_ids
+    complete_bytes = 0
+    with open(output_path, 'rb') as file:
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            complete_bytes += len(line)
+            try:
+                result = json.loads(line)
+                question_id = result['id']
+            except (ValueError, KeyError, TypeError):
+                continue
+            if result.get('error', False):
+                errored_ids.add(question_id)
+            else:
+                answered_ids.add(question_id)
+    if complete_bytes < output_path.stat().st_size:
+        with open(output_path, 'r+b') as file:
+            file.truncate(complete_bytes)
+    return answered_ids if retry_errors else answered_ids | errored_ids
+
+def run_batch(input_path:Path,
+              output_path:Path,
+              input_agent:Agent,
+              output_agent:Agent,
+              max_number_attempts:int=3,
+              max_workers:int=4,
+              query_timeout:Optional[float]=None,
+              keyword_cache:Optional[sql_keyword_cache]=None,
+              fast_path_planner:Optional[sql_fast_path_planner]=None,
+              sql_validator:Optional[sql_query_validator]=None,
+              num_candidates:int=1,
+              execution_mode:str='agent',
+              toolkit:Optional[sql_toolkit]=None,
+              collect_metrics:bool=False,
+              entity_resolver:Optional[sql_entity_resolver]=None,
+              retry_errors:bool=False,
+              print_progess:bool=False) -> dict:
+    """
+    Answer every question of a JSONL or CSV batch file and append each result to a JSONL output file as soon as it finishes.
+
+    The questions are streamed from the input file and at most max_workers are in flight (see iter_queries_concurrently), so
+    memory doesn't grow with the size of the batch, only the ids of the answered questions are kept. The output file is the
+    batch's checkpoint: each result is flushed as soon as it is written, and when the batch is run again the questions whose ids
+    are already in the output file are skipped, so a crashed or interrupted batch resumes where it stopped. Questions whose result
+    is an error (including timeouts) are also skipped unless retry_errors is set (see read_answered_ids).
+
+    Each output line is the query's sql_output_agent_response with its 'id' added.
+
+    Parameters:
+        input_path (Path): Path of the .jsonl or .csv batch file (see read_batch_questions).
+        output_path (Path): Path of the .jsonl output file, created if it doesn't exist.
+        max_workers (int): The maximum number of questions answered at the same time. Default is 4.
+        retry_errors (bool): If True, answer the questions whose earlier results were all errors again. Default is False.
+        print_progess (bool): Whether to print the progress of the batch and the agents. Default is False.
+        The other parameters are the same as query_sql_agents'.
+
+    Returns:
+        batch_stats (dict): The statistics of the run with the keys: read, skipped, answered, errors, seconds.
+    """
+    if execution_mode not in ('agent', 'direct'):
+        raise ValueError(f"Invalid execution mode '{execution_mode}', expected 'agent' or 'direct'")
+    if execution_mode == 'direct' and toolkit is None:
+        raise ValueError("A toolkit is required for the 'direct' execution mode")
+
+    started = time.perf_counter()
+    batch_stats = {'read': 0, 'skipped': 0, 'answered': 0, 'errors': 0}
+    #ids of the questions answered by an earlier run or started by this one, so duplicates are only answered once
+    answered_ids = read_answered_ids(output_path, retry_errors=retry_errors)
+    if print_progess and answered_ids: print(f"Resuming batch, {len(answered_ids)} questions already answered")
+    #ids of the questions which are running, by their index in the stream of questions
+    running_ids:dict = {}
+
+    def unanswered_questions() -> Iterator[str]:
+        index = 0
+        for question_id, question in read_batch_questions(input_path):
+            batch_stats['read'] += 1
+            if question_id in answered_ids:
+                batch_stats['skipped'] += 1
+                continue
+            answered_ids.add(question_id)
+            running_ids[index] = question_id
+            index += 1
+            yield question
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'a', encoding='utf-8') as output_file:
+        try:
+            for index, sql_output_agent_response in iter_queries_concurrently(queries=unanswered_questions(),
+                                                                              input_agent=input_agent,
+                                                                              output_agent=output_agent,
+                                                                              max_number_attempts=max_number_attempts,
+                                                                              max_workers=max_workers,
+                                                                              query_timeout=query_timeout,
+                                                                              keyword_cache=keyword_cache,
+                                                                              fast_path_planner=fast_path_planner,
+                                                                              sql_validator=sql_validator,
+                                                                              num_candidates=num_candidates,
+                                                                              execution_mode=execution_mode,
+                                                                              toolkit=toolkit,
+                                                                              collect_metrics=collect_metrics,
+                                                                              entity_resolver=entity_resolver,
+                                                                              print_progess=print_progess):
+                result = {'id': running_ids.pop(index), **sql_output_agent_response}
+                output_file.write(json.dumps(result, default=str) + '\n')
+                output_file.flush()
+                batch_stats['answered'] += 1
+                batch_stats['errors'] += bool(result['error'])
+                if print_progess: print(f"Answered {batch_stats['answered']} questions ({batch_stats['errors']} errors)")
+        finally:
+            output_file.flush()
+            os.fsync(output_file.fileno())
+
+    batch_stats['seconds'] = time.perf_counter() - started
+    return batch_stats
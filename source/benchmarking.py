@@ -0,0 +1,325 @@
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from agno.agent import RunResponse
+from pandas import DataFrame
+from sqlalchemy import create_engine
+
+from .query_agents import query_sql_agents
+from .agent_output_models import sql_input_agent_response_model, sql_output_agent_response_model
+from .sql_toolkit import sql_toolkit
+from .instrumentation import add_metrics_hook, remove_metrics_hook
+from .result_shaping import chars_per_token
+
+#questions asked by the benchmark mapped to the keywords the fake sql_input_agent returns for them, the table name is filled in later
+benchmark_questions = {
+    'How many ski resorts are in Canada?':
+        {'SELECT': 'COUNT(*) AS resort_count', 'WHERE': "country = 'canada'"},
+    'What is the average number of lifts at ski resorts in France?':
+        {'SELECT': 'AVG(lift_count) AS avg_lift_count', 'WHERE': "country = 'france'"},
+    'Which ski resort in Italy has the largest vertical drop?':
+        {'SELECT': 'name, vertical_m', 'WHERE': "country = 'italy'", 'ORDERBY': 'vertical_m DESC', 'LIMIT': '1'},
+    'What is the elevation of Zermatt?':
+        {'SELECT': 'name, min_elevation_m, max_elevation_m', 'WHERE': "name LIKE '%zermatt%'"},
+    'What is the total downhill distance of ski resorts in Austria?':
+        {'SELECT': 'SUM(downhill_distance_km) AS sum_downhill_distance_km', 'WHERE': "country = 'austria'"},
+    'How many ski resorts does each continent have?':
+        {'SELECT': 'continent, COUNT(*) AS resort_count', 'GROUPBY': 'continent', 'ORDERBY': 'resort_count DESC'},
+    'Which 10 ski resorts in the United States have the most lifts?':
+        {'SELECT': 'name, lift_count', 'WHERE': "country = 'unitedstates'", 'ORDERBY': 'lift_count DESC', 'LIMIT': '10'},
+    'List the ski resorts in Europe with nordic skiing.':
+        {'SELECT': 'name, country, nordic_distance_km', 'WHERE': "continent = 'europe' AND nordic_distance_km > 0"},
+}
+
+class metrics_collector:
+    """
+    A metrics hook (see add_metrics_hook in source/instrumentation.py) which keeps the metrics of every query finished while it is
+    registered. It is called by every worker thread.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics:List[dict] = []
+
+    def __call__(self, trace, response:dict, metrics:dict) -> None:
+        """Keep a finished query's metrics."""
+        with self.lock:
+            self.metrics.append(metrics)
+
+    def reset(self) -> None:
+        """Forget every collected metrics dictionary."""
+        with self.lock:
+            self.metrics = []
+
+    def get_summary(self) -> dict:
+        """
+        Summarise the collected metrics.
+
+        Returns:
+            dict: The summary with the keys:
+                - stages: The stage names (and 'query' for the whole query) mapped to the distribution of their time per query (see summarise_durations).
+                - attempts, input_tokens, output_tokens, db_queries, rows_returned: The totals over every query.
+                - cache_hits: The cache names mapped to their total number of hits.
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        stage_durations:dict = {}
+        for query_metrics in metrics:
+            for stage, seconds in query_metrics['stages'].items():
+                stage_durations.setdefault(stage, []).append(seconds)
+        stage_durations['query'] = [query_metrics['total_seconds'] for query_metrics in metrics]
+        cache_hits:dict = {}
+        for query_metrics in metrics:
+            for cache_name, hits in query_metrics['cache_hits'].items():
+                cache_hits[cache_name] = cache_hits.get(cache_name, 0) + hits
+        return {'stages': {stage: summarise_durations(durations) for stage, durations in stage_durations.items()},
+                **{key: sum(query_metrics[key] for query_metrics in metrics)
+                   for key in ['attempts', 'input_tokens', 'output_tokens', 'db_queries', 'rows_returned']},
+                'cache_hits': cache_hits}
+
+def summarise_durations(durations:List[float]) -> dict:
+    """
+    Summarise a list of durations in seconds.
+
+    Parameters:
+        durations (List[float]): The durations in seconds.
+
+    Returns:
+        dict: The count, total_s, mean_ms, p50_ms, p95_ms and max_ms of the durations.
+    """
+    values = np.array(durations) * 1000
+    return {'count': len(durations),
+            'total_s': round(float(values.sum()) / 1000, 6),
+            'mean_ms': round(float(values.mean()), 3) if len(values) else None,
+            'p50_ms': round(float(np.percentile(values, 50)), 3) if len(values) else None,
+            'p95_ms': round(float(np.percentile(values, 95)), 3) if len(values) else None,
+            'max_ms': round(float(values.max()), 3) if len(values) else None}
+
+def get_fake_agent_metrics(message:str, response:str) -> dict:
+    """
+    Build the metrics of a fake agent run in the form of an Agno RunResponse's metrics, estimating the tokens from the message lengths.
+
+    Parameters:
+        message (str): The message given to the agent.
+        response (str): The agent's response.
+
+    Returns:
+        dict: The metrics with the keys input_tokens and output_tokens, each a list with one model call.
+    """
+    return {'input_tokens': [len(message) // chars_per_token + 1], 'output_tokens': [len(response) // chars_per_token + 1]}
+
+class fake_sql_input_agent:
+    """
+    A deterministic stand-in for the sql_input_agent which returns canned keywords after an injected latency, so the workflow
+    can be benchmarked without calling a model.
+    """
+    def __init__(self, canned_keywords:dict, table_name:str, latency:float=0.0, jitter:float=0.0, seed:int=0):
+        """
+        Initializes the fake_sql_input_agent.
+
+        Parameters:
+            canned_keywords (dict): Questions mapped to the keywords returned for them (see benchmark_questions).
+            table_name (str): Name of the table in the database.
+            latency (float): The number of seconds each run takes. Default is 0.
+            jitter (float): The maximum number of seconds randomly added to each run's latency. Default is 0.
+            seed (int): The seed of the random jitter so runs are repeatable. Default is 0.
+        """
+        self.canned_keywords = canned_keywords
+        self.table_name = table_name
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def deep_copy(self) -> 'fake_sql_input_agent':
+        """Copy the agent for a worker thread, like Agent.deep_copy."""
+        return fake_sql_input_agent(canned_keywords=self.canned_keywords, table_name=self.table_name, latency=self.latency,
+                                    jitter=self.jitter, seed=self.random.randint(0, 2**31))
+
+    def run(self, message:str) -> RunResponse:
+        """Return the canned keywords of the question in the sql_input_agent's JSON input."""
+        user_query = json.loads(message)['user_query']
+        keywords = {'SELECT': '*', 'FROM': self.table_name, 'WHERE': '', 'HAVING': '', 'GROUPBY': '', 'ORDERBY': '', 'LIMIT': '10'}
+        if user_query in self.canned_keywords:
+            keywords.update({'LIMIT': '', **self.canned_keywords[user_query]})
+        time.sleep(self.latency + self.random.uniform(0, self.jitter))
+        return RunResponse(content=sql_input_agent_response_model(**keywords),
+                           metrics=get_fake_agent_metrics(message=message, response=json.dumps(keywords)))
+
+class fake_sql_output_agent:
+    """
+    A deterministic stand-in for the sql_output_agent. Like the real agent it runs the SQL query with its sql_toolkit, then it
+    returns a canned summary after an injected latency.
+    """
+    def __init__(self, toolkit:Optional[sql_toolkit], latency:float=0.0):
+        """
+        Initializes the fake_sql_output_agent.
+
+        Parameters:
+            toolkit (sql_toolkit): The toolkit used to run the SQL queries. None for a summary agent which is given the rows.
+            latency (float): The number of seconds each run takes, excluding the database. Default is 0.
+        """
+        self.toolkit = toolkit
+        self.tools = [toolkit] if toolkit is not None else []
+        self.latency = latency
+
+    def deep_copy(self) -> 'fake_sql_output_agent':
+        """Copy the agent for a worker thread, like Agent.deep_copy. The toolkit is shared."""
+        return fake_sql_output_agent(toolkit=self.toolkit, latency=self.latency)
+
+    def run(self, message:str) -> RunResponse:
+        """Run the SQL query with the toolkit (or read the inlined rows) and return a canned summary."""
+        if self.toolkit is not None and not message.startswith('{'):
+            user_query, sql_query = message.split('\n', 1)
+            rows = self.toolkit.query_database(sql_query)
+        else:
+            summary_input = json.loads(message)
+            user_query, sql_query, rows = summary_input['user_query'], summary_input['sql_query'], summary_input['rows']
+        error = not rows or (isinstance(rows, dict) and rows.get('error', False))
+        response_text = f"{len(rows)} rows returned."
+        time.sleep(self.latency)
+        return RunResponse(content=sql_output_agent_response_model(user_query=user_query,
+                                                                   sql_query=sql_query,
+                                                                   response_text=response_text,
+                                                                   error=error),
+                           metrics=get_fake_agent_metrics(message=message + json.dumps(rows, default=str), response=response_text))
+
+def create_benchmark_database(data:DataFrame, table_name:str, database:str='sqlite', directory:Optional[str]=None) -> str:
+    """
+    Load the resort data into the database used by the benchmark.
+
+    Parameters:
+        data (pd.DataFrame): The resort traits data.
+        table_name (str): Name of the benchmark table.
+        database (str): Either 'sqlite' (an embedded database file, no server needed), 'postgres' (the database in the DB_* environment
+                        variables, the benchmark table is created next to the application's table) or 'duckdb' (the toolkit's in-process
+                        copy of the data, nothing is created). Default is 'sqlite'.
+        directory (str): The directory of the SQLite file. Default is a new temporary directory.
+
+    Returns:
+        str: The SQLAlchemy connection string of the database, None for 'duckdb'.
+    """
+    if database == 'duckdb':
+        return None
+    if database == 'sqlite':
+        directory = directory or tempfile.mkdtemp(prefix='sql_agents_benchmark_')
+        connection_string = f"sqlite:///{Path(directory) / 'benchmark.db'}"
+        engine = create_engine(connection_string)
+        data.to_sql(table_name, engine, if_exists='replace', index=False)
+        engine.dispose()
+        return connection_string
+    if database == 'postgres':
+        from .helper_functions import get_db_credentials, get_db_connection_string, load_db_table
+        from .hybrid_rag_agents import dtype_dict
+        db_credentials = get_db_credentials(database_name='DB')
+        if load_db_table(db_credentials=db_credentials, data=data, dtype_dict=dtype_dict, table_name=table_name) is None:
+            raise RuntimeError("Unable to load the benchmark table into postgres")
+        return get_db_connection_string(db_credentials)
+    raise ValueError(f"Invalid benchmark database '{database}', expected 'sqlite', 'postgres' or 'duckdb'")
+
+def measure_startup() -> dict:
+    """
+    Measure the startup cost of the import and data processing pipeline.
+
+    Returns:
+        dict: The startup times in seconds with the keys:
+            - import_seconds: Importing source.hybrid_rag_agents in a new interpreter.
+            - data_processing_seconds: Processing the source CSV files without the parquet cache.
+            - cached_data_seconds: Loading the processed data from the parquet cache.
+    """
+    import_script = "import time; started = time.perf_counter(); import source.hybrid_rag_agents; print(time.perf_counter() - started)"
+    import_run = subprocess.run([sys.executable, '-c', import_script], capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).resolve().parent.parent)
+    from . import data_processing
+    started = time.perf_counter()
+    processed_data = data_processing.process_resort_data()
+    data_processing_seconds = time.perf_counter() - started
+
+    source_hash = data_processing.get_source_data_hash()
+    data_processing.write_processed_data_cache(processed_data=processed_data, source_hash=source_hash)
+    started = time.perf_counter()
+    data_processing.read_processed_data_cache(source_hash=source_hash)
+    cached_data_seconds = time.perf_counter() - started
+
+    return {'import_seconds': round(float(import_run.stdout.strip()), 6),
+            'data_processing_seconds': round(data_processing_seconds, 6),
+            'cached_data_seconds': round(cached_data_seconds, 6)}
+
+def run_benchmark(data:DataFrame, dtype_dict:dict, database:str='sqlite', concurrency_levels:List[int]=(1, 2, 4, 8), repeat:int=5,
+                  input_latency:float=0.05, output_latency:float=0.05, jitter:float=0.0, execution_mode:str='agent',
+                  measure_startup_time:bool=True, seed:int=0) -> dict:
+    """
+    Benchmark query_sql_agents end to end with the fake agents and a local database.
+
+    Every benchmark question is asked repeat times at each concurrency level. The queries' metrics are collected with a metrics hook
+    (see source/instrumentation.py), and the per stage latencies (prompt_build, input_agent, sql_build, db_execution, output_agent
+    and the whole query), token counts and throughput are reported for each level. In the 'agent' execution mode db_execution runs
+    inside output_agent.
+
+    Parameters:
+        data (pd.DataFrame): The resort traits data loaded into the benchmark table.
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+        database (str): Either 'sqlite', 'postgres' or 'duckdb' (see create_benchmark_database). Default is 'sqlite'.
+        concurrency_levels (List[int]): The max_workers values benchmarked. Default is 1, 2, 4 and 8.
+        repeat (int): The number of times each question is asked at each concurrency level. Default is 5.
+        input_latency (float): The number of seconds each fake sql_input_agent run takes. Default is 0.05.
+        output_latency (float): The number of seconds each fake sql_output_agent run takes. Default is 0.05.
+        jitter (float): The maximum number of seconds randomly added to each fake sql_input_agent run. Default is 0.
+        execution_mode (str): The execution mode of query_sql_agents, either 'agent' or 'direct'. Default is 'agent'.
+        measure_startup_time (bool): If True, measure the startup time of the import and data processing pipeline. Default is True.
+        seed (int): The seed of the random jitter. Default is 0.
+
+    Returns:
+        dict: The machine readable benchmark results with the keys: timestamp, environment, config, startup, concurrency.
+    """
+    table_name = 'ski_resorts_benchmark'
+    connection_string = create_benchmark_database(data=data, table_name=table_name, database=database)
+    toolkit = sql_toolkit(db_user='', db_password='', db_host='', db_port='', db_name='', dtype_dict=dtype_dict, table_name=table_name,
+                          data=data, pool_size=max(concurrency_levels), connection_string=connection_string,
+                          backend='duckdb' if database == 'duckdb' else 'sqlalchemy')
+    canned_keywords = {question: {**keywords, 'FROM': table_name} for question, keywords in benchmark_questions.items()}
+    queries = list(canned_keywords) * repeat
+
+    input_agent = fake_sql_input_agent(canned_keywords=canned_keywords, table_name=table_name, latency=input_latency,
+                                       jitter=jitter, seed=seed)
+    output_agent = fake_sql_output_agent(toolkit=toolkit if execution_mode == 'agent' else None, latency=output_latency)
+
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+               'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count()},
+               'config': {'database': database, 'concurrency_levels': list(concurrency_levels), 'repeat': repeat,
+                          'questions': len(canned_keywords), 'input_latency': input_latency, 'output_latency': output_latency,
+                          'jitter': jitter, 'execution_mode': execution_mode, 'seed': seed},
+               'startup': measure_startup() if measure_startup_time else None,
+               'concurrency': []}
+
+    collector = metrics_collector()
+    add_metrics_hook(collector)
+    try:
+        #warm the connection pool so connect time isn't counted in the first level
+        query_sql_agents(queries=queries[:1], input_agent=input_agent, output_agent=output_agent,
+                         execution_mode=execution_mode, toolkit=toolkit)
+        for max_workers in concurrency_levels:
+            collector.reset()
+            started = time.perf_counter()
+            responses = query_sql_agents(queries=queries, input_agent=input_agent, output_agent=output_agent,
+                                         max_workers=max_workers, execution_mode=execution_mode, toolkit=toolkit)
+            wall_seconds = time.perf_counter() - started
+            results['concurrency'].append({'max_workers': max_workers,
+                                           'queries': len(queries),
+                                           'errors': sum(1 for response in responses if response['error']),
+                                           'wall_seconds': round(wall_seconds, 6),
+                                           'queries_per_second': round(len(queries) / wall_seconds, 3),
+                                           **collector.get_summary()})
+    finally:
+        remove_metrics_hook(collector)
+        toolkit.close()
+    return results
@@ -0,0 +1,546 @@
+from collections import OrderedDict
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+import pickle
+import re
+import sqlite3
+import time
+import weakref
+
+from pandas import DataFrame
+from pandas.util import hash_pandas_object
+from agno.embedder.base import Embedder
+
+#data version of each database table, set whenever build_output_sql_agent_database replaces the table
+_table_versions:dict = {}
+#weak references to the listeners, so a cache which is no longer used (i.e. after another bootstrap) can be garbage collected
+_table_version_listeners:list = []
+_table_versions_lock = Lock()
+
+def get_table_version(table_name:str) -> str:
+    """
+    Get the current data version of a database table.
+
+    Parameters:
+        table_name (str): Name of the table in the database.
+
+    Returns:
+        str: The data version of the table or '0' if the table hasn't been loaded by this process.
+    """
+    with _table_versions_lock:
+        return _table_versions.get(table_name, '0')
+
+def set_table_version(table_name:str,version:str) -> None:
+    """
+    Set the data version of a database table and notify the caches listening for changes to that table.
+
+    Parameters:
+        table_name (str): Name of the table in the database.
+        version (str): The new data version of the table.
+    """
+    with _table_versions_lock:
+        changed = _table_versions.get(table_name) != version
+        _table_versions[table_name] = version
+        listeners = get_table_version_listeners()
+    if changed:
+        for listener in listeners:
+            listener(table_name)
+
+def add_table_version_listener(listener:Callable[[str], None]) -> None:
+    """
+    Register a function which is called with the table name whenever the data version of a table changes. Only a weak reference
+    to the listener is kept, so registering a cache's method doesn't keep the cache alive.
+
+    Parameters:
+        listener (Callable[[str], None]): The function to call. It is unregistered when it (or, for a bound method, its object)
+                                          is garbage collected, so the caller must keep a reference to it.
+    """
+    listener_ref = weakref.WeakMethod(listener) if hasattr(listener, '__self__') else weakref.ref(listener)
+    with _table_versions_lock:
+        get_table_version_listeners()
+        _table_version_listeners.append(listener_ref)
+
+def get_table_version_listeners() -> List[Callable[[str], None]]:
+    """Get the registered listeners which are still alive and drop the others. Must be called with _table_versions_lock held."""
+    listeners = [(listener_ref, listener_ref()) for listener_ref in _table_version_listeners]
+    _table_version_listeners[:] = [listener_ref for listener_ref, listener in listeners if listener is not None]
+    return [listener for _, listener in listeners if listener is not None]
+
+def get_data_version(data:DataFrame,dtype_dict:dict) -> str:
+    """
+    Build a data version from the content of a DataFrame and the schema it is loaded with. Reloading identical data with
+    an identical schema gives the same version.
+
+    Parameters:
+        data (pd.DataFrame): The data loaded into the database table.
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+
+    Returns:
+        str: The data version as a hex digest.
+    """
+    version_builder = data_version_builder(dtype_dict=dtype_dict)
+    version_builder.update(data=data)
+    return version_builder.get_version()
+
+class data_version_builder:
+    """
+    Builds a data version from data which is loaded in chunks. Feeding every chunk of a DataFrame gives the same version as
+    get_data_version of the whole DataFrame.
+    """
+    def __init__(self,dtype_dict:dict):
+        """
+        Initializes the data_version_builder.
+
+        Parameters:
+            dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+        """
+        self.dtype_dict = dtype_dict
+        self.digest = sha256()
+
+    def update(self,data:DataFrame) -> None:
+        """Add the rows of a chunk of the data to the version."""
+        self.digest.update(hash_pandas_object(data, index=False).values.tobytes())
+
+    def get_version(self) -> str:
+        """Get the data version of the rows added so far as a hex digest."""
+        digest = self.digest.copy()
+        digest.update(get_schema_fingerprint(self.dtype_dict).encode())
+        return digest.hexdigest()[:16]
+
+def get_schema_fingerprint(dtype_dict:dict) -> str:
+    """
+    Build a fingerprint of a table schema so cached entries can be invalidated when the schema changes.
+
+    Parameters:
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+
+    Returns:
+        str: The schema fingerprint as a hex digest.
+    """
+    schema = ','.join(f"{column}:{getattr(dtype, '__name__', str(dtype))}" for column, dtype in dtype_dict.items())
+    return sha256(schema.encode()).hexdigest()[:16]
+
+def normalize_question(user_query:str) -> str:
+    """
+    Normalize a natural language question so trivially different phrasings share a cache entry. This involves
+    converting to lowercase, removing punctuation and collapsing whitespace.
+
+    Parameters:
+        user_query (str): The user's natural language question.
+
+    Returns:
+        str: The normalized question.
+    """
+    return ' '.join(re.sub(r'[^\w\s]', ' ', user_query.lower()).split())
+
+def normalize_sql(sql_query:str) -> str:
+    """
+    Normalize a SQL query so formatting differences share a cache entry. Text outside string literals is converted to
+    lowercase and its whitespace is collapsed. Trailing semicolons are removed. String literals are left unchanged.
+
+    Parameters:
+        sql_query (str): The SQL query.
+
+    Returns:
+        str: The normalized SQL query.
+    """
+    parts = re.split(r"('(?:[^']|'')*')", sql_query.strip().rstrip(';').strip())
+    normalized_parts = []
+    for index, part in enumerate(parts):
+        #odd indices are the string literals captured by the split pattern
+        normalized_parts.append(part if index % 2 == 1 else ' '.join(part.lower().split()))
+    return ' '.join(part for part in normalized_parts if part != '')
+
+class sql_keyword_cache:
+    """
+    A least recently used cache with a time to live sitting in front of the sql_input_agent.
+
+    It maps a normalized user question to the keyword dictionary (SELECT, FROM, WHERE, ...) the sql_input_agent generated
+    for it. Entries are keyed on the data version of the table and the schema in dtype_dict, so they are invalidated
+    automatically when build_output_sql_agent_database reloads the table or the schema changes. Only keywords whose SQL
+    query ran without an error should be added to the cache.
+    """
+
+    def __init__(self,table_name:str,dtype_dict:dict,max_size:int=1024,ttl_seconds:Optional[float]=3600):
+        """
+        Initializes the sql_keyword_cache.
+
+        Parameters:
+            table_name (str): Name of the table the generated SQL queries run against.
+            dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+            max_size (int): The maximum number of questions kept in the cache. Default is 1024.
+            ttl_seconds (float): The number of seconds an entry stays valid. Default is 3600. None keeps entries until evicted.
+        """
+        self.table_name = table_name
+        self.dtype_dict = dtype_dict
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.entries:OrderedDict = OrderedDict()
+        self.lock = Lock()
+        add_table_version_listener(self.on_table_version_change)
+
+    def get_key(self,user_query:str) -> tuple:
+        """Build the cache key of a user question."""
+        return (normalize_question(user_query), get_table_version(self.table_name), get_schema_fingerprint(self.dtype_dict))
+
+    def get(self,user_query:str) -> Optional[dict]:
+        """
+        Get the cached keywords for a user question.
+
+        Parameters:
+            user_query (str): The user's natural language question.
+
+        Returns:
+            dict: A copy of the cached keyword dictionary or None if the question isn't cached or its entry expired.
+        """
+        key = self.get_key(user_query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl_seconds is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self,user_query:str,keywords:dict) -> None:
+        """
+        Add the keywords of a successfully answered user question to the cache.
+
+        Parameters:
+            user_query (str): The user's natural language question.
+            keywords (dict): The keyword dictionary generated by the sql_input_agent.
+        """
+        key = self.get_key(user_query)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), dict(keywords))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self,user_query:str) -> None:
+        """
+        Remove a user question from the cache, i.e. when its cached SQL query stopped returning a valid answer.
+
+        Parameters:
+            user_query (str): The user's natural language question.
+        """
+        with self.lock:
+            self.entries.pop(self.get_key(user_query), None)
+
+    def clear(self) -> None:
+        """Remove every entry from the cache."""
+        with self.lock:
+            self.entries.clear()
+
+    def on_table_version_change(self,table_name:str) -> None:
+        """Clear the cache when the table its SQL queries run against is reloaded with different data."""
+        if table_name == self.table_name:
+            self.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Get the hit and miss counts of the cache.
+
+        Returns:
+            dict: The cache statistics with the keys: size, hits, misses, hit_rate.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+class sql_result_cache:
+    """
+    A cache of SQL query results keyed on the normalized SQL query and the data version of the queried table.
+
+    The in-memory tier is a least recently used cache bounded by the total number of cached rows and their size in bytes,
+    so a few very large results can't exhaust memory. An optional disk tier stored in a SQLite file keeps results across
+    restarts. Because the table's data version is part of the key, results are never served after the table is reloaded
+    with different data.
+    """
+
+    def __init__(self,table_name:str,max_rows:int=100_000,max_bytes:int=64 * 1024 * 1024,disk_path:Optional[Path]=None):
+        """
+        Initializes the sql_result_cache.
+
+        Parameters:
+            table_name (str): Name of the table the cached SQL queries run against.
+            max_rows (int): The maximum total number of rows held in memory. Default is 100,000.
+            max_bytes (int): The maximum total size in bytes of the results held in memory. Default is 64 MB.
+            disk_path (Path): Path of the SQLite file used as the disk tier. Default is None (memory only).
+        """
+        self.table_name = table_name
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.total_rows = 0
+        self.total_bytes = 0
+        #key mapped to (rows, number of rows, size in bytes)
+        self.entries:OrderedDict = OrderedDict()
+        self.lock = Lock()
+        self.disk_connection:Optional[sqlite3.Connection] = None
+        if disk_path is not None:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self.disk_connection = sqlite3.connect(str(disk_path), check_same_thread=False)
+            self.disk_connection.execute("CREATE TABLE IF NOT EXISTS sql_results "
+                                         "(cache_key TEXT PRIMARY KEY, table_name TEXT, table_version TEXT, rows BLOB)")
+            self.disk_connection.commit()
+        add_table_version_listener(self.on_table_version_change)
+
+    def get_table_version(self) -> str:
+        """Get the current data version of the table the cache belongs to."""
+        return get_table_version(self.table_name)
+
+    def get_key(self,sql_query:str,table_version:Optional[str]=None) -> str:
+        """Build the cache key of a SQL query for a data version of the table (default is the current version)."""
+        table_version = table_version if table_version is not None else self.get_table_version()
+        key = f"{self.table_name}|{table_version}|{normalize_sql(sql_query)}"
+        return sha256(key.encode()).hexdigest()
+
+    def get(self,sql_query:str,table_version:Optional[str]=None) -> Optional[List[dict]]:
+        """
+        Get the cached result of a SQL query.
+
+        Parameters:
+            sql_query (str): The SQL query.
+            table_version (str): The data version of the table read once for the lookup (see get_table_version), and passed to put
+                                 with the query's rows. Default is None (the current version).
+
+        Returns:
+            List[dict]: The cached rows or None if the query isn't cached for the data version of the table.
+        """
+        key = self.get_key(sql_query, table_version)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[0])
+            if self.disk_connection is not None:
+                row = self.disk_connection.execute("SELECT rows FROM sql_results WHERE cache_key = ?", (key,)).fetchone()
+                if row is not None:
+                    rows = pickle.loads(row[0])
+                    self.add_to_memory(key, rows, len(row[0]))
+                    self.disk_hits += 1
+                    return list(rows)
+            self.misses += 1
+            return None
+
+    def put(self,sql_query:str,rows:List[dict],table_version:Optional[str]=None) -> None:
+        """
+        Add the result of a successfully executed SQL query to the cache. Results larger than the cache's bounds aren't cached.
+
+        Parameters:
+            sql_query (str): The SQL query.
+            rows (List[dict]): The rows returned by the query.
+            table_version (str): The data version of the table read before the query ran. The result isn't cached if the table has
+                                 been reloaded since, so a result of the old data is never stored under the new version.
+                                 Default is None (the current version).
+        """
+        table_version = table_version if table_version is not None else self.get_table_version()
+        if table_version != self.get_table_version():
+            return
+        key = self.get_key(sql_query, table_version)
+        serialized_rows = pickle.dumps(rows)
+        if len(rows) > self.max_rows or len(serialized_rows) > self.max_bytes:
+            return
+        with self.lock:
+            self.add_to_memory(key, rows, len(serialized_rows))
+            if self.disk_connection is not None:
+                self.disk_connection.execute("INSERT OR REPLACE INTO sql_results VALUES (?, ?, ?, ?)",
+                                             (key, self.table_name, table_version, serialized_rows))
+                self.disk_connection.commit()
+
+    def add_to_memory(self,key:str,rows:List[dict],size_bytes:int) -> None:
+        """Add rows to the in-memory tier and evict the least recently used entries until it is within its bounds."""
+        if key in self.entries:
+            self.remove_from_memory(key)
+        self.entries[key] = (list(rows), len(rows), size_bytes)
+        self.total_rows += len(rows)
+        self.total_bytes += size_bytes
+        while self.entries and (self.total_rows > self.max_rows or self.total_bytes > self.max_bytes):
+            self.remove_from_memory(next(iter(self.entries)))
+
+    def remove_from_memory(self,key:str) -> None:
+        """Remove an entry from the in-memory tier."""
+        _, number_of_rows, size_bytes = self.entries.pop(key)
+        self.total_rows -= number_of_rows
+        self.total_bytes -= size_bytes
+
+    def clear(self) -> None:
+        """Remove every entry from the in-memory tier."""
+        with self.lock:
+            self.entries.clear()
+            self.total_rows = 0
+            self.total_bytes = 0
+
+    def on_table_version_change(self,table_name:str) -> None:
+        """Drop results of an older data version when the table the cache belongs to is reloaded."""
+        if table_name != self.table_name:
+            return
+        self.clear()
+        if self.disk_connection is not None:
+            with self.lock:
+                self.disk_connection.execute("DELETE FROM sql_results WHERE table_name = ? AND table_version != ?",
+                                             (table_name, get_table_version(table_name)))
+                self.disk_connection.commit()
+
+    def get_stats(self) -> dict:
+        """
+        Get the usage statistics of the cache.
+
+        Returns:
+            dict: The cache statistics with the keys: entries, rows, bytes, hits, disk_hits, misses, hit_rate.
+        """
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'entries': len(self.entries),
+                    'rows': self.total_rows,
+                    'bytes': self.total_bytes,
+                    'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0}
+
+class cached_embedder(Embedder):
+    """
+    An embedder which caches the embeddings of another embedder, keyed on the embedder's model id, its dimensions and a hash of
+    the text, so a document or question is only sent to the embedding API once.
+
+    The in-memory tier is a least recently used cache bounded by max_entries. An optional disk tier stored in a SQLite file keeps
+    the embeddings across restarts, so rebuilding the knowledge base doesn't embed unchanged documents again.
+    """
+
+    def __init__(self,embedder:Embedder,max_entries:int=10_000,disk_path:Optional[Path]=None):
+        """
+        Initializes the cached_embedder.
+
+        Parameters:
+            embedder (Embedder): The Agno embedder whose embeddings are cached (i.e. OpenAIEmbedder).
+            max_entries (int): The maximum number of embeddings held in memory. Default is 10,000.
+            disk_path (Path): Path of the SQLite file used as the disk tier. Default is None (memory only).
+        """
+        super().__init__(dimensions=embedder.dimensions)
+        self.embedder = embedder
+        self.model_id = str(getattr(embedder, 'id', type(embedder).__name__))
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        #key mapped to the embedding
+        self.entries:OrderedDict = OrderedDict()
+        self.lock = Lock()
+        self.disk_connection:Optional[sqlite3.Connection] = None
+        if disk_path is not None:
+            Path(disk_path).parent.mkdir(parents=True, exist_ok=True)
+            self.disk_connection = sqlite3.connect(str(disk_path), check_same_thread=False)
+            self.disk_connection.execute("CREATE TABLE IF NOT EXISTS embeddings (cache_key TEXT PRIMARY KEY, model_id TEXT, embedding BLOB)")
+            self.disk_connection.commit()
+
+    def __deepcopy__(self, memo):
+        """Return the embedder itself when a knowledge base or agent is copied, so every copy shares the cache."""
+        return self
+
+    def get_key(self,text:str) -> str:
+        """Build the cache key of a text."""
+        return f"{self.model_id}|{self.dimensions}|{sha256(text.encode()).hexdigest()}"
+
+    def get_cached_embedding(self,key:str) -> Optional[List[float]]:
+        """Get an embedding from the memory or disk tier, None if it isn't cached."""
+        with self.lock:
+            embedding = self.entries.get(key)
+            if embedding is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return list(embedding)
+            if self.disk_connection is not None:
+                row = self.disk_connection.execute("SELECT embedding FROM embeddings WHERE cache_key = ?", (key,)).fetchone()
+                if row is not None:
+                    embedding = pickle.loads(row[0])
+                    self.add_to_memory(key, embedding)
+                    self.disk_hits += 1
+                    return list(embedding)
+            self.misses += 1
+            return None
+
+    def put(self,key:str,embedding:List[float]) -> None:
+        """Add an embedding to the cache."""
+        with self.lock:
+            self.add_to_memory(key, embedding)
+            if self.disk_connection is not None:
+                self.disk_connection.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                                             (key, self.model_id, pickle.dumps(list(embedding))))
+                self.disk_connection.commit()
+
+    def add_to_memory(self,key:str,embedding:List[float]) -> None:
+        """Add an embedding to the in-memory tier and evict the least recently used embeddings until it is within max_entries."""
+        self.entries[key] = list(embedding)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_embedding(self,text:str) -> List[float]:
+        """
+        Get the embedding of a text from the cache, or from the embedder if it isn't cached.
+
+        Parameters:
+            text (str): The text to embed.
+
+        Returns:
+            List[float]: The embedding.
+        """
+        return self.get_embedding_and_usage(text)[0]
+
+    def get_embedding_and_usage(self,text:str) -> Tuple[List[float], Optional[Dict]]:
+        """
+        Get the embedding of a text and the embedding API usage. Cached embeddings have no usage.
+
+        Parameters:
+            text (str): The text to embed.
+
+        Returns:
+            Tuple[List[float], Optional[Dict]]: The embedding and the usage of the embedding API call (None if it was cached).
+        """
+        key = self.get_key(text)
+        embedding = self.get_cached_embedding(key)
+        if embedding is not None:
+            return embedding, None
+        #the embedder is called outside the lock so other texts can be looked up while it waits for the API
+        embedding, usage = self.embedder.get_embedding_and_usage(text)
+        if embedding:
+            self.put(key, embedding)
+        return embedding, usage
+
+    def clear(self) -> None:
+        """Remove every embedding from the in-memory tier."""
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Get the usage statistics of the cache.
+
+        Returns:
+            dict: The cache statistics with the keys: entries, hits, disk_hits, misses, hit_rate.
+        """
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'entries': len(self.entries),
+                    'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0}
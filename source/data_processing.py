@@ -1,53 +1,207 @@
 from pathlib import Path
+from typing import Iterator
+from hashlib import sha256
+from threading import Lock
 import pandas as pd
 from .helper_functions import read_data, clean_string_values, clean_bool_values,NaN_to_zero
 
-resort_path = Path(r'data\ski_areas.csv')
-country_continent_path = Path(r'data\country_continent.csv')
+resort_path = Path('data') / 'ski_areas.csv'
+country_continent_path = Path('data') / 'country_continent.csv'
+
+#cleaned data is cached as parquet files keyed by a hash of the source files
+processed_data_cache_dir = Path('data') / 'cache'
+#increment when the cleaning steps change so cached files built by older code aren't used
+processing_version = '1'
 
 resort_use_cols = ['name','country','status','has_downhill','has_nordic','downhill_distance_km',
             'nordic_distance_km','vertical_m','min_elevation_m','max_elevation_m',
             'lift_count']
+resort_float_cols = ['downhill_distance_km', 'nordic_distance_km', 'vertical_m', 'min_elevation_m', 'max_elevation_m']
+
+#processed data is built on first access rather than when the module is imported
+_processed_data:dict = None
+_processed_data_lock = Lock()
+
+def process_resort_data() -> dict:
+    """
+    Read and clean the ski resort and country to continent data.
+
+    The ski resort CSV file is read once and the traits data is filtered with a single combined mask before it is joined
+    with the continent data, so the frame is only copied once.
+
+    Returns:
+        processed_data (dict): The processed DataFrames with the keys: resort_traits_data, resort_website_data, country_continent_data.
+    """
+    country_continent_data = read_country_continent_data()
+
+    #read resort traits and website data in one pass
+    resort_data = read_data(resort_path,resort_use_cols + ['websites'])
+    resort_website_data = resort_data[['name','websites']].copy()
+    resort_traits_data = resort_data.drop(columns=['websites'])
+
+    resort_traits_data = clean_resort_traits_data(resort_traits_data=resort_traits_data,country_continent_data=country_continent_data)
+
+    return {'resort_traits_data': resort_traits_data,
+            'resort_website_data': resort_website_data,
+            'country_continent_data': country_continent_data}
+
+def read_country_continent_data() -> pd.DataFrame:
+    """
+    Read and clean the country to continent data.
+
+    Returns:
+        country_continent_data (pd.DataFrame): The cleaned country to continent data with the columns: continent, country.
+    """
+    country_continent_data = pd.read_csv(filepath_or_buffer = country_continent_path,usecols = ['Country','Continent'])
+    country_continent_data.columns = ['continent','country']
+    return clean_string_values(data = country_continent_data,columns = ['country','continent'])
+
+def clean_resort_traits_data(resort_traits_data:pd.DataFrame,country_continent_data:pd.DataFrame) -> pd.DataFrame:
+    """
+    Clean and filter raw ski resort traits data and join the continent of each resort's country. The rows are independent so
+    this can be applied to the whole file or to each chunk of it.
+
+    Parameters:
+        resort_traits_data (pd.DataFrame): The raw ski resort traits data with the resort_use_cols columns.
+        country_continent_data (pd.DataFrame): The cleaned country to continent data.
+
+    Returns:
+        resort_traits_data (pd.DataFrame): The cleaned ski resort traits data.
+    """
+    #clean string type columna in resort_traits_data
+    resort_traits_data = clean_string_values(data = resort_traits_data,columns = ['country','name'])
+    resort_traits_data = clean_bool_values(data = resort_traits_data,columns = ['has_downhill','has_nordic'])
+    resort_traits_data['lift_count'] = resort_traits_data['lift_count'].astype('Int64')
+
+    #filtering data
+    #remove ski resorts that are not operational
+    is_operational_mask = resort_traits_data['status'] == 'operating'
+    #remove ski resorts that do not have downhill skiing
+    has_downhill_mask = resort_traits_data['has_downhill'] == 1
+    #remove ski resorts that don't have ski lifts
+    has_valid_ski_lift_entry_mask = pd.notna(resort_traits_data['lift_count'])
+    has_non_zero_ski_lift_count_mask = resort_traits_data['lift_count'] > 0
+    #remove ski resorts that don't have a valid name
+    has_valid_name_mask = resort_traits_data['name'] != ''
+    resort_traits_data = resort_traits_data[is_operational_mask & has_downhill_mask & has_valid_ski_lift_entry_mask
+                                            & has_non_zero_ski_lift_count_mask & has_valid_name_mask]
+
+    resort_traits_data = pd.merge(resort_traits_data, country_continent_data,on='country', how='inner')
+
+    #convert cells with NaN in numerical columns to 0
+    resort_traits_data = NaN_to_zero(data=resort_traits_data, columns=resort_float_cols)
+
+    resort_traits_data.reset_index(drop=True,inplace=True)
+    return resort_traits_data
+
+def stream_resort_traits_data(chunk_size:int = 50_000,read_stats:dict = None) -> Iterator[pd.DataFrame]:
+    """
+    Read, clean and filter the ski resort traits data in chunks so memory use stays bounded however large the source file is.
+    Only the traits columns are read, wide columns such as geometry and websites are skipped.
+
+    Parameters:
+        chunk_size (int): The number of source rows read per chunk. Default is 50,000.
+        read_stats (dict): If given, the keys rows_read and chunks are updated as the source file is read.
+
+    Yields:
+        resort_traits_data (pd.DataFrame): The cleaned ski resort traits data of one chunk of the source file.
+    """
+    country_continent_data = read_country_continent_data()
+    if read_stats is not None:
+        read_stats.update({'rows_read': 0, 'chunks': 0})
+    #chunks without missing values would be read as int64, so the numeric columns are read as float like the whole file is
+    float_dtypes = {column: 'float64' for column in resort_float_cols}
+    for chunk in pd.read_csv(filepath_or_buffer = resort_path,usecols = resort_use_cols,dtype = float_dtypes,chunksize = chunk_size):
+        if read_stats is not None:
+            read_stats['rows_read'] += len(chunk)
+            read_stats['chunks'] += 1
+        yield clean_resort_traits_data(resort_traits_data=chunk,country_continent_data=country_continent_data)
+
+def get_source_data_hash() -> str:
+    """
+    Hash the source CSV files and the processing version. The hash changes when either source file or the cleaning steps change.
+
+    Returns:
+        str: The hex digest of the source files.
+    """
+    digest = sha256(processing_version.encode())
+    for path in [resort_path, country_continent_path]:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
 
-#read and set columns for country_continent data
-country_continent_data = pd.read_csv(filepath_or_buffer = country_continent_path,usecols = ['Country','Continent'])
-country_continent_data.columns = ['continent','country']
+def read_processed_data_cache(source_hash:str) -> dict:
+    """
+    Read the processed DataFrames cached for a version of the source files.
 
-#read resort website data 
-resort_website_data = pd.read_csv(filepath_or_buffer = resort_path,usecols = ['name','websites'])
+    Parameters:
+        source_hash (str): The hash of the source files returned by get_source_data_hash.
 
-#read resort traits data
-resort_traits_data = read_data(resort_path,resort_use_cols)
+    Returns:
+        processed_data (dict): The processed DataFrames or None if they aren't cached for this version of the source files.
+    """
+    cache_paths = {name: processed_data_cache_dir / f'{name}_{source_hash}.parquet'
+                   for name in ['resort_traits_data', 'resort_website_data', 'country_continent_data']}
+    if not all(path.exists() for path in cache_paths.values()):
+        return None
+    try:
+        return {name: pd.read_parquet(path) for name, path in cache_paths.items()}
+    except Exception as e:
+        print(f"Error reading processed data cache: {e}")
+        return None
 
-#clean string type columna in resort_traits_data
-resort_traits_data = clean_string_values(data = resort_traits_data,columns = ['country','name'])
-resort_traits_data = clean_bool_values(data = resort_traits_data,columns = ['has_downhill','has_nordic'])
-resort_traits_data['lift_count'] = resort_traits_data['lift_count'].astype('Int64')
+def write_processed_data_cache(processed_data:dict,source_hash:str) -> None:
+    """
+    Cache the processed DataFrames as parquet files and remove the files cached for older versions of the source files.
 
-#clean strings in country_continent data
-country_continent_data = clean_string_values(data = country_continent_data,columns = ['country','continent'])
-resort_traits_data = pd.merge(resort_traits_data, country_continent_data,on='country', how='inner')
+    Parameters:
+        processed_data (dict): The processed DataFrames returned by process_resort_data.
+        source_hash (str): The hash of the source files returned by get_source_data_hash.
+    """
+    try:
+        processed_data_cache_dir.mkdir(parents=True, exist_ok=True)
+        for name, data in processed_data.items():
+            for old_path in processed_data_cache_dir.glob(f'{name}_*.parquet'):
+                old_path.unlink()
+            data.to_parquet(processed_data_cache_dir / f'{name}_{source_hash}.parquet', index=False)
+    except Exception as e:
+        print(f"Error writing processed data cache: {e}")
 
-#filtering data 
-#remove ski resorts that are not operational
-is_operational_mask = resort_traits_data['status'] == 'operating'
-resort_traits_data = resort_traits_data[is_operational_mask]
+def get_processed_data(use_cache:bool = True) -> dict:
+    """
+    Get the processed ski resort data, processing it on first use. Later calls return the same DataFrames.
 
-#remove ski resorts that do not have downhill skiing
-has_downhill_mask = resort_traits_data['has_downhill'] == 1
-resort_traits_data = resort_traits_data[has_downhill_mask]
+    The processed data is cached as parquet files keyed by a hash of the source files, so later starts load the cleaned
+    data instead of parsing and cleaning the CSV files again.
 
-#remove ski resorts that don't have ski lifts
-has_valid_ski_lift_entry_mask = pd.notna(resort_traits_data['lift_count'])
-has_non_zero_ski_lift_count_mask = resort_traits_data['lift_count'] > 0
-resort_traits_data = resort_traits_data[has_valid_ski_lift_entry_mask & has_non_zero_ski_lift_count_mask]
+    Parameters:
+        use_cache (bool): If True, read and write the parquet cache. Default is True.
 
-#remove ski resorts that don't have a valid name
-has_valid_name_mask = resort_traits_data['name'] != ''
-resort_traits_data = resort_traits_data[has_valid_name_mask]
+    Returns:
+        processed_data (dict): The processed DataFrames with the keys: resort_traits_data, resort_website_data, country_continent_data.
+    """
+    global _processed_data
+    with _processed_data_lock:
+        if _processed_data is None:
+            source_hash = get_source_data_hash()
+            if use_cache:
+                _processed_data = read_processed_data_cache(source_hash=source_hash)
+            if _processed_data is None:
+                _processed_data = process_resort_data()
+                if use_cache:
+                    write_processed_data_cache(processed_data=_processed_data,source_hash=source_hash)
+        return _processed_data
 
-#convert cells with NaN in numerical columns to 0 
-resort_traits_data = NaN_to_zero(data=resort_traits_data, columns=['downhill_distance_km', 'nordic_distance_km', 'vertical_m', 'min_elevation_m', 'max_elevation_m'])
+def get_resort_traits_data() -> pd.DataFrame:
+    """
+    Get the cleaned ski resort traits data which is loaded into the sql_output_agent's database.
 
-resort_traits_data.reset_index(drop=True,inplace=True)
+    Returns:
+        resort_traits_data (pd.DataFrame): The cleaned ski resort traits data.
+    """
+    return get_processed_data()['resort_traits_data']
 
+def __getattr__(name:str):
+    """Build the processed DataFrames the first time one of them is accessed as a module attribute."""
+    if name in ('resort_traits_data', 'resort_website_data', 'country_continent_data'):
+        return get_processed_data()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
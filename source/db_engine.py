@@ -0,0 +1,166 @@
+from contextlib import contextmanager
+from threading import Lock
+from typing import Iterator
+import atexit
+import time
+
+from sqlalchemy import create_engine, event, Engine, Connection
+
+#process-wide registry of pooled engines keyed by connection string and pool configuration
+_pooled_engines:dict = {}
+_pooled_engines_lock = Lock()
+#usage statistics of each pooled engine
+_engine_pool_stats:dict = {}
+
+class db_pool_stats:
+    """
+    Counters describing how a pooled database engine is being used.
+
+    It includes:
+    - connections_created: The number of new DBAPI connections opened by the pool.
+    - total_connect_time_s: The total time spent opening new DBAPI connections (TCP + auth handshake).
+    - checkouts: The number of times a connection was checked out of the pool.
+    - waits: The number of checkouts requested while every pooled and overflow connection was in use.
+    - total_checkout_time_s: The total time spent waiting for the pool to hand out a connection.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.connections_created = 0
+        self.total_connect_time_s = 0.0
+        self.checkouts = 0
+        self.waits = 0
+        self.total_checkout_time_s = 0.0
+
+    def record_connect(self, seconds:float) -> None:
+        """Record a new DBAPI connection and the time taken to open it."""
+        with self.lock:
+            self.connections_created += 1
+            self.total_connect_time_s += seconds
+
+    def record_checkout(self, seconds:float, waited:bool) -> None:
+        """Record a connection checkout, the time taken to acquire it and whether the pool was saturated."""
+        with self.lock:
+            self.checkouts += 1
+            self.total_checkout_time_s += seconds
+            if waited: self.waits += 1
+
+def get_pooled_engine(connection_string:str,
+                      pool_size:int=5,
+                      max_overflow:int=10,
+                      pool_pre_ping:bool=True,
+                      pool_recycle:int=1800,
+                      pool_timeout:int=30) -> Engine:
+    """
+    Get the process-wide SQLAlchemy engine for a connection string, creating it on first use.
+
+    The engine is shared across calls and threads so each SQL execution borrows an open connection from the pool
+    instead of paying for a new TCP and authentication handshake.
+
+    Parameters:
+        connection_string (str): The SQLAlchemy connection string of the database.
+        pool_size (int): The number of connections kept open in the pool. Default is 5.
+        max_overflow (int): The number of connections allowed above pool_size when the pool is exhausted. Default is 10.
+        pool_pre_ping (bool): If True, test each connection for liveness when it is checked out. Default is True.
+        pool_recycle (int): The number of seconds after which a connection is replaced. Default is 1800.
+        pool_timeout (int): The number of seconds to wait for a connection before giving up. Default is 30.
+
+    Returns:
+        engine (Engine): The pooled SQLAlchemy engine.
+    """
+    key = (connection_string, pool_size, max_overflow, pool_pre_ping, pool_recycle, pool_timeout)
+    with _pooled_engines_lock:
+        if key not in _pooled_engines:
+            engine = create_engine(connection_string,
+                                   pool_size=pool_size,
+                                   max_overflow=max_overflow,
+                                   pool_pre_ping=pool_pre_ping,
+                                   pool_recycle=pool_recycle,
+                                   pool_timeout=pool_timeout)
+            _engine_pool_stats[engine] = db_pool_stats()
+            _add_pool_listeners(engine)
+            _pooled_engines[key] = engine
+        return _pooled_engines[key]
+
+def _add_pool_listeners(engine:Engine) -> None:
+    """Attach the event listeners used to time new DBAPI connections."""
+    stats:db_pool_stats = _engine_pool_stats[engine]
+
+    @event.listens_for(engine, 'do_connect')
+    def start_connect_timer(dialect, connection_record, cargs, cparams):
+        connection_record.info['connect_started'] = time.perf_counter()
+
+    @event.listens_for(engine.pool, 'connect')
+    def stop_connect_timer(dbapi_connection, connection_record):
+        started = connection_record.info.pop('connect_started', None)
+        if started is not None:
+            stats.record_connect(time.perf_counter() - started)
+
+@contextmanager
+def checkout_connection(engine:Engine) -> Iterator[Connection]:
+    """
+    Check a connection out of a pooled engine and record how long the checkout took.
+
+    Parameters:
+        engine (Engine): A pooled engine returned by get_pooled_engine.
+
+    Yields:
+        connection (Connection): A connection which is returned to the pool when the context exits.
+    """
+    stats:db_pool_stats = _engine_pool_stats.get(engine)
+    pool = engine.pool
+    #the pool is saturated when every pooled and overflow connection is checked out
+    max_overflow = getattr(pool, '_max_overflow', -1)
+    saturated = max_overflow >= 0 and pool.checkedout() >= pool.size() + max_overflow
+    started = time.perf_counter()
+    with engine.connect() as connection:
+        if stats is not None: stats.record_checkout(time.perf_counter() - started, saturated)
+        yield connection
+
+def get_pool_stats(engine:Engine) -> dict:
+    """
+    Get a snapshot of the usage statistics of a pooled engine so the pool can be sized.
+
+    Parameters:
+        engine (Engine): A pooled engine returned by get_pooled_engine.
+
+    Returns:
+        pool_stats (dict): The pool statistics with the keys: pool_size, checked_out, overflow, checked_in, connections_created,
+                           avg_connect_time_s, checkouts, waits, avg_checkout_time_s.
+    """
+    stats:db_pool_stats = _engine_pool_stats[engine]
+    pool = engine.pool
+    with stats.lock:
+        return {'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'overflow': pool.overflow(),
+                'checked_in': pool.checkedin(),
+                'connections_created': stats.connections_created,
+                'avg_connect_time_s': stats.total_connect_time_s / stats.connections_created if stats.connections_created else 0.0,
+                'checkouts': stats.checkouts,
+                'waits': stats.waits,
+                'avg_checkout_time_s': stats.total_checkout_time_s / stats.checkouts if stats.checkouts else 0.0}
+
+def dispose_pooled_engine(engine:Engine) -> None:
+    """
+    Close every connection held by a pooled engine and remove it from the registry.
+
+    Parameters:
+        engine (Engine): A pooled engine returned by get_pooled_engine.
+    """
+    with _pooled_engines_lock:
+        for key, pooled_engine in list(_pooled_engines.items()):
+            if pooled_engine is engine:
+                del _pooled_engines[key]
+        _engine_pool_stats.pop(engine, None)
+    engine.dispose()
+
+def dispose_all_pooled_engines() -> None:
+    """Close every pooled engine in the process. This runs automatically when the interpreter exits."""
+    with _pooled_engines_lock:
+        engines = list(_pooled_engines.values())
+        _pooled_engines.clear()
+        _engine_pool_stats.clear()
+    for engine in engines:
+        engine.dispose()
+
+atexit.register(dispose_all_pooled_engines)
@@ -0,0 +1,132 @@
+from threading import Lock, Timer
+from typing import List, Optional
+
+from pandas import DataFrame
+
+class duckdb_engine:
+    """
+    An embedded, in-process DuckDB database holding a copy of a DataFrame as a table, so the sql_toolkit can run the generated SQL
+    queries without a network round trip to Postgres (see the 'duckdb' backend of sql_toolkit).
+
+    The DataFrame is copied into DuckDB's columnar storage once, on the first query, and every query runs on its own cursor of the
+    same in-memory database so queries from different threads run at the same time. The queries can only read the table: once it
+    is loaded, access to files and URLs (i.e. read_csv('/etc/hostname') or an httpfs URL) is disabled and the configuration is
+    locked so a query can't enable it again, and with read_only only SELECT statements are run.
+
+    Requires the duckdb package.
+    """
+
+    def __init__(self,data:DataFrame,table_name:str,threads:Optional[int]=None):
+        """
+        Initializes the duckdb_engine.
+
+        Parameters:
+            data (pd.DataFrame): The data queried as the table.
+            table_name (str): Name of the table the data is queried as.
+            threads (int): The number of threads DuckDB uses for each query. Default is None (DuckDB's default, the number of cores).
+        """
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("The duckdb_engine requires the duckdb package") from e
+        self.duckdb = duckdb
+        self.data = data
+        self.table_name = table_name
+        self.threads = threads
+        self.connection = None
+        self.lock = Lock()
+
+    def get_connection(self):
+        """Get the in-memory database, loading the data into the table on first use."""
+        with self.lock:
+            if self.connection is None:
+                connection = self.duckdb.connect(':memory:')
+                if self.threads is not None:
+                    connection.execute(f"SET threads = {int(self.threads)}")
+                #copy the DataFrame into a native table so queries scan DuckDB's columnar storage rather than the DataFrame
+                connection.register('source_data', self.data)
+                connection.execute(f'CREATE TABLE "{self.table_name}" AS SELECT * FROM source_data')
+                connection.unregister('source_data')
+                #the generated SQL must only query the table, not read local files or URLs through table functions
+                connection.execute("SET enable_external_access = false")
+                connection.execute("SET lock_configuration = true")
+                self.connection = connection
+            return self.connection
+
+    def is_read_only(self,query:str) -> bool:
+        """
+        Check that a SQL query only contains SELECT statements.
+
+        Parameters:
+            query (str): The SQL query.
+
+        Returns:
+            bool: True if every statement of the query is a SELECT statement.
+        """
+        #a connection can only be used by one thread at a time, so the query is parsed on its own cursor
+        cursor = self.get_connection().cursor()
+        try:
+            statements = cursor.extract_statements(query)
+        finally:
+            cursor.close()
+        return all(statement.type == self.duckdb.StatementType.SELECT for statement in statements)
+
+    def execute(self,query:str,fetch_size:int=1000,max_rows:Optional[int]=None,timeout:Optional[float]=None) -> List[dict]:
+        """
+        Run a SQL query and fetch its rows fetch_size at a time.
+
+        Parameters:
+            query (str): The SQL query.
+            fetch_size (int): The number of rows fetched at a time. Default is 1,000.
+            max_rows (int): The number of rows after which fetching stops, so the caller can tell the query returned more than
+                            max_rows rows. Default is None (fetch every row).
+            timeout (float): The number of seconds after which the query is interrupted. Default is None (no timeout).
+
+        Returns:
+            List[dict]: The rows of the query as a list of dictionaries, at most max_rows + 1 of them.
+
+        Raises:
+            duckdb.InterruptException: If the query ran for longer than timeout.
+            duckdb.Error: If DuckDB can't run the query.
+        """
+        cursor = self.get_connection().cursor()
+        timer = Timer(timeout, cursor.interrupt) if timeout is not None else None
+        try:
+            if timer is not None:
+                timer.start()
+            cursor.execute(query)
+            columns = [column[0] for column in cursor.description or []]
+            rows_as_dicts = []
+            while max_rows is None or len(rows_as_dicts) <= max_rows:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                rows_as_dicts.extend(dict(zip(columns, row)) for row in rows)
+            return rows_as_dicts
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cursor.close()
+
+    def explain(self,query:str) -> None:
+        """
+        Plan a SQL query with EXPLAIN without running it.
+
+        Parameters:
+            query (str): The SQL query.
+
+        Raises:
+            duckdb.Error: If DuckDB can't plan the query.
+        """
+        cursor = self.get_connection().cursor()
+        try:
+            cursor.execute(f"EXPLAIN {query.strip().rstrip(';')}")
+        finally:
+            cursor.close()
+
+    def close(self) -> None:
+        """Close the in-memory database. The data is loaded again if another query is run."""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
@@ -0,0 +1,257 @@
+from threading import Lock
+from typing import Dict, List, Optional
+import re
+
+from pandas import DataFrame
+
+from .helper_functions import clean_string_value
+from .fast_path_planner import place_aliases
+
+#common ways users refer to places mapped to the cleaned values stored in the database, on top of the fast path planner's aliases
+entity_aliases = {**place_aliases,
+                  'nz': 'newzealand', 'holland': 'netherlands', 'swiss': 'switzerland', 'czechia': 'czechrepublic',
+                  'bosnia': 'bosniaandherzegovina', 'southkorea': 'korea', 'northernamerica': 'northamerica',
+                  'latinamerica': 'southamerica', 'australasia': 'oceania'}
+
+#words which never start or end a mention, they can appear inside one (i.e. 'bosnia and herzegovina')
+stop_words = {'a', 'an', 'the', 'what', 'whats', 'which', 'who', 'where', 'how', 'many', 'much', 'is', 'are', 'was', 'were', 'be',
+              'do', 'does', 'did', 'has', 'have', 'had', 'in', 'at', 'of', 'for', 'on', 'to', 'from', 'by', 'with', 'and', 'or',
+              'not', 'all', 'any', 'each', 'every', 'there', 'their', 'its', 'it', 'that', 'this', 'these', 'those', 'me', 'my',
+              'i', 'you', 'your', 'we', 'our', 'us', 'tell', 'show', 'list', 'give', 'find', 'than', 'more', 'most', 'less',
+              'least', 'largest', 'biggest', 'smallest', 'highest', 'lowest', 'longest', 'shortest', 'top', 'number', 'count',
+              'total', 'average', 'mean', 'sum', 'maximum', 'minimum', 'max', 'min', 'ski', 'skiing', 'resort', 'resorts',
+              'area', 'areas', 'lift', 'lifts', 'chairlift', 'chairlifts', 'elevation', 'vertical', 'drop', 'range', 'distance',
+              'downhill', 'nordic', 'cross', 'country', 'countries', 'continent', 'continents', 'km', 'm', 'metres', 'meters',
+              'name', 'names', 'run', 'runs', 'slope', 'slopes', 'terrain', 'altitude', 'located'}
+
+#common words which are never read as the start of a resort name on their own (i.e. 'open' in 'Is Whistler open?')
+partial_stop_words = {'open', 'opened', 'closed', 'over', 'under', 'above', 'below', 'near', 'between', 'about', 'around', 'within',
+                      'city', 'town', 'lake', 'river', 'valley', 'mountain', 'mountains', 'peak', 'peaks', 'hill', 'hills', 'park',
+                      'snow', 'snowy', 'best', 'good', 'great', 'high', 'long', 'short', 'tall', 'tallest', 'deep', 'north', 'south',
+                      'east', 'west', 'northern', 'southern', 'eastern', 'western', 'central', 'upper', 'lower', 'state', 'states',
+                      'year', 'years', 'season', 'winter', 'summer', 'snowboard', 'snowboarding', 'only', 'also', 'then', 'when',
+                      'feet', 'metre', 'meter', 'miles', 'height', 'place', 'places', 'world'}
+
+#only resolved when written in upper case in the question, so words such as 'us' aren't read as places
+short_alias_length = 2
+
+class sql_entity_resolver:
+    """
+    An in-memory index of the values of the database table's string columns (country, continent and resort name) which resolves
+    the places and resorts mentioned in a user's question to the values stored in the database, without a vector database search.
+
+    The question is split into word n-grams, longest first, and each n-gram is cleaned the same way clean_string_values cleans the
+    database columns. An n-gram is resolved by:
+    - An exact match with a stored value (i.e. 'United States' -> unitedstates).
+    - An alias (i.e. 'UK' -> unitedkingdom).
+    Then the words which are left are resolved to candidates by:
+    - For resort names, being the start of at most max_name_matches names (i.e. 'Copper' -> coppermountain). Common words such as
+      'open' or 'over' are never partial names.
+    - For mentions of one or two words, a close match within a small edit distance found through a character trigram index
+      (i.e. 'Swizerland' -> switzerland).
+    The words of a resolved n-gram aren't used by other n-grams, so a word which is part of a place is never read as a partial name.
+    """
+
+    def __init__(self,data:DataFrame,columns:List[str]=('country','continent','name'),aliases:Optional[dict]=None,
+                 max_ngram_words:int=4,max_name_matches:int=5):
+        """
+        Initializes the sql_entity_resolver.
+
+        Parameters:
+            data (pd.DataFrame): The data loaded into the database table, its string columns have been cleaned by clean_string_values.
+            columns (List[str]): The columns whose values are resolved. Default is country, continent and name.
+            aliases (dict): Cleaned phrases mapped to the cleaned value they refer to. Default is entity_aliases.
+            max_ngram_words (int): The maximum number of words in a mention. Default is 4.
+            max_name_matches (int): The maximum number of resort names a partial name may match. Default is 5.
+        """
+        self.columns = [column for column in columns if column in data]
+        self.max_ngram_words = max_ngram_words
+        self.max_name_matches = max_name_matches
+        #cleaned value mapped to the columns it is stored in
+        self.values:Dict[str, List[str]] = {}
+        for column in self.columns:
+            for value in data[column].dropna().unique().tolist():
+                if value:
+                    self.values.setdefault(value, []).append(column)
+        self.aliases = {alias: value for alias, value in (aliases if aliases is not None else entity_aliases).items() if value in self.values}
+        #character trigram mapped to the values containing it
+        self.trigram_index:Dict[str, set] = {}
+        for value in self.values:
+            for trigram in get_trigrams(value):
+                self.trigram_index.setdefault(trigram, set()).add(value)
+        self.lock = Lock()
+        self.questions = 0
+        self.resolved = 0
+        self.match_counts:dict = {}
+
+    def resolve(self,user_query:str) -> dict:
+        """
+        Resolve the places and resorts mentioned in a question to the values stored in the database.
+
+        Parameters:
+            user_query (str): The user's natural language question.
+
+        Returns:
+            dict: The column names mapped to the list of values mentioned in the question (i.e. {'country': ['canada']}). Partial
+                  and fuzzy matches are only candidates, they are under the 'candidates' key as column names mapped to values
+                  (i.e. {'country': ['canada'], 'candidates': {'name': ['whistlerblackcomb']}}). Columns without a mention are left
+                  out, so a question which mentions nothing returns an empty dictionary.
+        """
+        words = re.sub(r'[^\w\s]', ' ', user_query).split()
+        #stop words can't start or end a mention, unless they are a short alias written in upper case (i.e. 'US')
+        is_stop_word = [(word.lower() in stop_words and not (word.isupper() and word.lower() in self.aliases)) or word.isdigit()
+                        for word in words]
+        #words which are already part of a resolved mention
+        used = [False] * len(words)
+        entities:dict = {}
+        match_types:list = []
+        #exact values and aliases are resolved first so their words can't be read as partial or fuzzy names
+        for partial in (False, True):
+            for length in range(min(self.max_ngram_words, len(words)), 0, -1):
+                for start in range(len(words) - length + 1):
+                    end = start + length - 1
+                    if is_stop_word[start] or is_stop_word[end] or any(used[start:end + 1]):
+                        continue
+                    #a partial name can't start inside a longer capitalised name (i.e. 'Lake City' in 'Salt Lake City')
+                    if partial and start > 0 and words[start - 1][:1].isupper() and not is_stop_word[start - 1] and not used[start - 1]:
+                        continue
+                    mention = words[start:start + length]
+                    values, match_type = self.resolve_mention(mention, partial=partial)
+                    if not values:
+                        continue
+                    matched = entities.setdefault('candidates', {}) if partial else entities
+                    for value in values:
+                        for column in self.values[value]:
+                            if value not in matched.setdefault(column, []):
+                                matched[column].append(value)
+                    match_types.append(match_type)
+                    used[start:end + 1] = [True] * length
+
+        with self.lock:
+            self.questions += 1
+            if entities:
+                self.resolved += 1
+            for match_type in match_types:
+                self.match_counts[match_type] = self.match_counts.get(match_type, 0) + 1
+        return entities
+
+    def resolve_mention(self,mention:List[str],partial:bool=False) -> tuple:
+        """
+        Resolve the words of a possible mention to stored values.
+
+        Parameters:
+            mention (List[str]): The words of the n-gram as written in the question.
+            partial (bool): If False, only look for an exact value or an alias. If True, only look for partial names and fuzzy matches.
+                            Default is False.
+
+        Returns:
+            tuple: The list of matched values (empty if the mention doesn't resolve) and the type of match (exact, alias, partial_name or fuzzy).
+        """
+        phrase = clean_string_value(''.join(mention))
+        if not partial:
+            if phrase in self.values:
+                return [phrase], 'exact'
+            if phrase in self.aliases and (len(phrase) > short_alias_length or ''.join(mention).isupper()):
+                return [self.aliases[phrase]], 'alias'
+            return [], None
+        if len(phrase) < 4 or phrase in partial_stop_words:
+            return [], None
+
+        #the values containing every trigram of the phrase are the only ones which can start with the phrase
+        candidates = None
+        for trigram in get_trigrams(phrase):
+            candidates = self.trigram_index.get(trigram, set()) if candidates is None else candidates & self.trigram_index.get(trigram, set())
+            if not candidates:
+                break
+        if candidates and 'name' in self.columns:
+            #a mention matches the start of a name, not the middle of a word inside it (i.e. 'over' isn't part of 'bogonroverchallet')
+            names = sorted(value for value in candidates if value.startswith(phrase) and 'name' in self.values[value])
+            if 0 < len(names) <= self.max_name_matches:
+                return names, 'partial_name'
+
+        #typos are only looked for in short mentions, longer n-grams are mostly several words of the question
+        if len(phrase) < 5 or len(mention) > 2:
+            return [], None
+        return self.resolve_fuzzy(phrase), 'fuzzy'
+
+    def resolve_fuzzy(self,phrase:str) -> List[str]:
+        """
+        Find the stored values within a small edit distance of a phrase (1 edit for phrases shorter than 9 characters, otherwise 2).
+
+        Parameters:
+            phrase (str): The cleaned phrase.
+
+        Returns:
+            List[str]: The closest values, empty if no value is close enough.
+        """
+        max_distance = 1 if len(phrase) < 9 else 2
+        trigrams = get_trigrams(phrase)
+        #a value within max_distance edits shares all but 3 trigrams per edit with the phrase
+        min_shared = max(len(trigrams) - 3 * max_distance, 1)
+        shared:dict = {}
+        for trigram in trigrams:
+            for value in self.trigram_index.get(trigram, ()):
+                shared[value] = shared.get(value, 0) + 1
+
+        best_distance = max_distance + 1
+        matches:list = []
+        for value, count in shared.items():
+            if count < min_shared or abs(len(value) - len(phrase)) > max_distance:
+                continue
+            distance = edit_distance(phrase, value, max_distance)
+            if distance < best_distance:
+                best_distance, matches = distance, [value]
+            elif distance == best_distance:
+                matches.append(value)
+        return sorted(matches) if best_distance <= max_distance else []
+
+    def get_stats(self) -> dict:
+        """
+        Get the share of questions with at least one resolved mention.
+
+        Returns:
+            dict: The resolver statistics with the keys: questions, resolved, resolve_rate, match_counts.
+        """
+        with self.lock:
+            return {'questions': self.questions,
+                    'resolved': self.resolved,
+                    'resolve_rate': self.resolved / self.questions if self.questions else 0.0,
+                    'match_counts': dict(self.match_counts)}
+
+def get_trigrams(value:str) -> set:
+    """
+    Get the character trigrams of a value. Values shorter than 3 characters are their own trigram.
+
+    Parameters:
+        value (str): The cleaned value.
+
+    Returns:
+        set: The trigrams of the value.
+    """
+    if len(value) < 3:
+        return {value}
+    return {value[index:index + 3] for index in range(len(value) - 2)}
+
+def edit_distance(first:str,second:str,max_distance:int) -> int:
+    """
+    Compute the Levenshtein distance between two strings, stopping early once it exceeds max_distance.
+
+    Parameters:
+        first (str): The first string.
+        second (str): The second string.
+        max_distance (int): The largest distance of interest.
+
+    Returns:
+        int: The edit distance, or max_distance + 1 if it is larger than max_distance.
+    """
+    previous_row = list(range(len(second) + 1))
+    for row_index, first_char in enumerate(first, start=1):
+        current_row = [row_index]
+        for column_index, second_char in enumerate(second, start=1):
+            current_row.append(min(previous_row[column_index] + 1,
+                                   current_row[column_index - 1] + 1,
+                                   previous_row[column_index - 1] + (first_char != second_char)))
+        if min(current_row) > max_distance:
+            return max_distance + 1
+        previous_row = current_row
+    return min(previous_row[-1], max_distance + 1)
@@ -0,0 +1,227 @@
+from threading import Lock
+from typing import Optional
+import re
+
+from pandas import DataFrame
+from sqlalchemy import FLOAT, INTEGER
+
+from .caching import normalize_question
+from .helper_functions import clean_string_value
+
+#phrases used in questions mapped to the numeric columns they refer to, a bare 'elevation' could mean the minimum or maximum
+#elevation so it isn't a synonym of either
+column_synonyms = {
+    'lift_count': ['number of chairlifts','number of ski lifts','number of lifts','lift count','chairlifts','chairlift',
+                   'ski lifts','ski lift','lifts','lift'],
+    'vertical_m': ['elevation range','vertical drop','vertical range','vertical'],
+    'downhill_distance_km': ['downhill distance','downhill runs','downhill terrain','downhill km','piste length','downhill'],
+    'nordic_distance_km': ['cross country distance','nordic distance','cross country','nordic'],
+    'max_elevation_m': ['maximum elevation','highest elevation','summit elevation','peak elevation','top elevation',
+                        'max elevation'],
+    'min_elevation_m': ['minimum elevation','lowest elevation','base elevation','min elevation'],
+}
+
+#columns returned when a question asks for an attribute of a single resort, the superlative templates use column_synonyms
+lookup_column_synonyms = {'elevation': ['elevation','altitude'], **column_synonyms}
+lookup_columns = {'elevation': ['min_elevation_m', 'max_elevation_m']}
+
+#common ways users refer to places mapped to the cleaned values stored in the database
+place_aliases = {'usa': 'unitedstates', 'us': 'unitedstates', 'america': 'unitedstates', 'uk': 'unitedkingdom',
+                 'britain': 'unitedkingdom', 'greatbritain': 'unitedkingdom', 'england': 'unitedkingdom',
+                 'scotland': 'unitedkingdom', 'wales': 'unitedkingdom'}
+
+aggregate_functions = {'average': 'AVG', 'mean': 'AVG', 'avg': 'AVG', 'total': 'SUM', 'sum of': 'SUM', 'maximum': 'MAX',
+                       'max': 'MAX', 'highest': 'MAX', 'minimum': 'MIN', 'min': 'MIN', 'lowest': 'MIN'}
+
+superlative_directions = {'largest': 'DESC', 'highest': 'DESC', 'biggest': 'DESC', 'greatest': 'DESC', 'most': 'DESC',
+                          'longest': 'DESC', 'tallest': 'DESC', 'smallest': 'ASC', 'lowest': 'ASC', 'fewest': 'ASC',
+                          'least': 'ASC', 'shortest': 'ASC'}
+
+resort_words = r'(?:ski )?(?:resorts?|areas?)'
+place_suffix = rf' (?:(?:at|of|for|across|among) )?(?:(?:all|the) )*(?:{resort_words} )?(?:located )?in (?P<place>.+)$'
+
+#templates matched against the normalized question, each template name is reported in the planner's statistics
+question_templates = [
+    ('count', re.compile(rf'^(?:how many|what is the number of|what is the count of|count the|count|number of) (?:the )?'
+                         rf'{resort_words} (?:are )?(?:there )?in (?P<place>.+?)(?: are there)?$')),
+    ('aggregate', re.compile(rf'^(?:what is |whats |what are )?(?:the )?(?P<aggregate>{"|".join(aggregate_functions)}) '
+                             rf'(?P<column>.+?){place_suffix}')),
+    ('total', re.compile(rf'^how many (?P<column>.+?) (?:are )?(?:there )?in (?P<place>.+?)(?: are there)?$')),
+    ('superlative', re.compile(rf'^(?:which|what) {resort_words} in (?P<place>.+?) (?:has|have) the '
+                               rf'(?P<direction>{"|".join(superlative_directions)}) (?P<column>.+)$')),
+    ('lookup', re.compile(r'^(?:what is|whats|what are|how high is) the (?P<column>.+?) (?:of|at|for) (?P<name>.+)$')),
+    ('lookup', re.compile(r'^how many (?P<column>.+?) does (?P<name>.+?) have$')),
+]
+
+class sql_fast_path_planner:
+    """
+    A local, rule based planner which answers common question shapes without calling the sql_input_agent.
+
+    It matches the user's question against a few templates:
+    - count: The number of resorts in a country or continent.
+    - aggregate: The average, total, maximum or minimum of a numeric column in a country or continent.
+    - total: The total of a numeric column in a country or continent (i.e. 'how many lifts are in canada').
+    - superlative: The resort in a country or continent with the largest or smallest value of a numeric column.
+    - lookup: An attribute of a single resort found by its exact name.
+
+    The columns, countries, continents and resort names are taken from dtype_dict and the data loaded into the database.
+    If the question doesn't match a template, or a place, column or resort name can't be resolved, the planner returns
+    None and the question falls through to the sql_input_agent.
+    """
+
+    def __init__(self,data:DataFrame,dtype_dict:dict,table_name:str):
+        """
+        Initializes the sql_fast_path_planner.
+
+        Parameters:
+            data (pd.DataFrame): The data loaded into the database table.
+            dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+            table_name (str): Name of the table in the database.
+        """
+        self.table_name = table_name
+        self.numeric_columns = [column for column, dtype in dtype_dict.items() if dtype in (FLOAT, INTEGER)]
+        self.countries = set(data['country'].unique().tolist()) if 'country' in data else set()
+        self.continents = set(data['continent'].unique().tolist()) if 'continent' in data else set()
+        self.names = set(data['name'].unique().tolist()) if 'name' in data else set()
+        self.lock = Lock()
+        self.questions = 0
+        self.hits = 0
+        self.template_hits:dict = {}
+
+    def plan(self,user_query:str) -> Optional[dict]:
+        """
+        Build the sql_input_agent keywords for a question without calling an LLM.
+
+        Parameters:
+            user_query (str): The user's natural language question.
+
+        Returns:
+            dict: The keyword dictionary in the form of the sql_input_agent_response_model (SELECT, FROM, WHERE, HAVING,
+                  GROUPBY, ORDERBY, LIMIT) or None if the question can't be planned confidently.
+        """
+        question = normalize_question(user_query)
+        keywords = None
+        for template_name, template in question_templates:
+            match = template.match(question)
+            if match is None:
+                continue
+            keywords = getattr(self, f'plan_{template_name}')(match)
+            if keywords is not None:
+                break
+
+        with self.lock:
+            self.questions += 1
+            if keywords is not None:
+                self.hits += 1
+                self.template_hits[template_name] = self.template_hits.get(template_name, 0) + 1
+        return keywords
+
+    def plan_count(self,match:re.Match) -> Optional[dict]:
+        """Plan the number of resorts in a place."""
+        place = self.resolve_place(match.group('place'))
+        if place is None:
+            return None
+        return self.build_keywords(SELECT='COUNT(*) AS resort_count', WHERE=place)
+
+    def plan_aggregate(self,match:re.Match) -> Optional[dict]:
+        """Plan an aggregate of a numeric column in a place."""
+        column = self.resolve_column(match.group('column'))
+        place = self.resolve_place(match.group('place'))
+        if column is None or place is None:
+            return None
+        function = aggregate_functions[match.group('aggregate')]
+        return self.build_keywords(SELECT=f'{function}({column}) AS {function.lower()}_{column}', WHERE=place)
+
+    def plan_total(self,match:re.Match) -> Optional[dict]:
+        """Plan the total of a numeric column in a place."""
+        column = self.resolve_column(match.group('column'))
+        place = self.resolve_place(match.group('place'))
+        if column is None or place is None:
+            return None
+        return self.build_keywords(SELECT=f'SUM({column}) AS sum_{column}', WHERE=place)
+
+    def plan_superlative(self,match:re.Match) -> Optional[dict]:
+        """Plan the resort in a place with the largest or smallest value of a numeric column."""
+        column = self.resolve_column(match.group('column'))
+        place = self.resolve_place(match.group('place'))
+        if column is None or place is None:
+            return None
+        direction = superlative_directions[match.group('direction')]
+        return self.build_keywords(SELECT=f'name, {column}', WHERE=place, ORDERBY=f'{column} {direction}', LIMIT='1')
+
+    def plan_lookup(self,match:re.Match) -> Optional[dict]:
+        """Plan an attribute lookup of a single resort by its name."""
+        columns = self.resolve_lookup_columns(match.group('column'))
+        name = self.resolve_name(match.group('name'))
+        if columns is None or name is None:
+            return None
+        return self.build_keywords(SELECT=', '.join(['name'] + columns), WHERE=f"name = '{name}'")
+
+    def resolve_column(self,phrase:str) -> Optional[str]:
+        """Resolve a phrase from the question to a numeric column, the phrase must match a synonym exactly."""
+        for column, synonyms in column_synonyms.items():
+            if column in self.numeric_columns and phrase in synonyms:
+                return column
+        return None
+
+    def resolve_lookup_columns(self,phrase:str) -> Optional[list]:
+        """Resolve a phrase from an attribute lookup question to the columns returned for it."""
+        for key, synonyms in lookup_column_synonyms.items():
+            if phrase in synonyms:
+                columns = lookup_columns.get(key, [key])
+                if all(column in self.numeric_columns for column in columns):
+                    return columns
+        return None
+
+    def resolve_place(self,phrase:str) -> Optional[str]:
+        """
+        Resolve a phrase from the question to a WHERE expression on the country or continent column. Phrases naming
+        more than one place return None.
+        """
+        if ' and ' in f' {phrase} ' or ' or ' in f' {phrase} ':
+            return None
+        phrase = re.sub(r'^the ', '', phrase)
+        value = clean_string_value(phrase)
+        value = place_aliases.get(value, value)
+        if value in self.countries:
+            return f"country = '{value}'"
+        if value in self.continents:
+            return f"continent = '{value}'"
+        return None
+
+    def resolve_name(self,phrase:str) -> Optional[str]:
+        """
+        Resolve a phrase from the question to the cleaned resort name it refers to. The phrase must be a resort's full name,
+        partial names (i.e. 'the alps' in 'what is the elevation of the alps') fall through to the sql_input_agent.
+        """
+        phrase = re.sub(r'^the ', '', phrase)
+        phrase = re.sub(r' (?:ski )?(?:resort|area)$', '', phrase)
+        value = clean_string_value(phrase)
+        if len(value) < 3 or value in self.countries or value in self.continents:
+            return None
+        if value not in self.names:
+            return None
+        return value
+
+    def build_keywords(self,SELECT:str,WHERE:str='',ORDERBY:str='',LIMIT:str='') -> dict:
+        """Build a keyword dictionary in the form of the sql_input_agent_response_model."""
+        return {'SELECT': SELECT,
+                'FROM': self.table_name,
+                'WHERE': WHERE,
+                'HAVING': '',
+                'GROUPBY': '',
+                'ORDERBY': ORDERBY,
+                'LIMIT': LIMIT}
+
+    def get_stats(self) -> dict:
+        """
+        Get the share of questions answered by the planner.
+
+        Returns:
+            dict: The planner statistics with the keys: questions, hits, hit_rate, template_hits.
+        """
+        with self.lock:
+            return {'questions': self.questions,
+                    'hits': self.hits,
+                    'hit_rate': self.hits / self.questions if self.questions else 0.0,
+                    'template_hits': dict(self.template_hits)}
@@ -1,8 +1,20 @@
 from pathlib import Path
-from pandas import read_csv,DataFrame
-from sqlalchemy import create_engine
+from pandas import read_csv,read_sql_table,DataFrame
+from pandas.io.sql import get_schema
+from sqlalchemy import create_engine, Engine
+from typing import Iterable, List
+import io
 import os
+import sys
+import time
+try:
+    import resource
+except ImportError:
+    #the resource module isn't available on windows
+    resource = None
 from agno.document.base import Document
+from .rollups import refresh_rollup_tables
+from .indexing import create_table_indexes, rename_table_indexes
 import re
 import string
 
@@ -36,15 +48,10 @@ def clean_bool_values(data:DataFrame,columns:list) -> DataFrame:
         pd.DataFrame: The cleaned dataframe.
     """
     for col in columns:
-        #set yes values to True
-        yes_mask = data[col].str.lower() == 'yes'
-        data.loc[yes_mask, col] = True
-        #set no values to False
-        no_mask = data[col].str.lower() == 'no'
-        data.loc[no_mask, col] = False
+        #map yes values to True and no values to False in one pass, other values are kept
+        bool_values = data[col].str.lower().map({'yes': True, 'no': False})
         #set NaN values to False
-        nan_mask = data[col].isna()
-        data.loc[nan_mask, col] = False
+        data[col] = bool_values.where(bool_values.notna(), data[col]).fillna(False)
     return data
 
 def clean_string_values(data: DataFrame, columns: list) -> DataFrame:
@@ -57,6 +64,8 @@ def clean_string_values(data: DataFrame, columns: list) -> DataFrame:
     - Removing spaces from the string.
     - Removing all punctuation symbols from the string.
 
+    The steps are fused into one lowercase pass and one regular expression pass over Arrow backed strings.
+
     Parameters:
         data (pd.DataFrame): The dataframe to be cleaned.
         columns (list): The list of columns to be cleaned.
@@ -64,19 +73,32 @@ def clean_string_values(data: DataFrame, columns: list) -> DataFrame:
     Returns:
         pd.DataFrame: The cleaned dataframe.
     """
-    # Create a regular expression pattern to match any punctuation character.
-    punctuation_pattern = re.compile(f"[{re.escape(string.punctuation)}]")
+    # Create a regular expression pattern to match leading and trailing whitespace (the characters str.strip removes),
+    # spaces and any punctuation character.
+    whitespace = r"[\s\x0b\x1c-\x1f\x85\p{Z}]"
+    removal_pattern = rf"^{whitespace}+|{whitespace}+$|[ {re.escape(string.punctuation)}]"
 
     for col in columns:
         # Ensure the column is of string type to apply string methods
-        data[col] = data[col].astype(str)
-        data[col] = data[col].str.strip()
-        data[col] = data[col].str.lower()
-        data[col] = data[col].str.replace(' ', '')
-        # Add punctuation removal
-        data[col] = data[col].str.replace(punctuation_pattern, '', regex=True)
+        values = data[col].astype(str).astype('string[pyarrow]')
+        data[col] = values.str.lower().str.replace(removal_pattern, '', regex=True).astype(object)
     return data
 
+def clean_string_value(value:str) -> str:
+    """
+    Clean a single string the same way clean_string_values cleans the string columns loaded into the database, so text
+    taken from a user's question can be compared with the values stored in the database.
+
+    Parameters:
+        value (str): The string to be cleaned.
+
+    Returns:
+        str: The cleaned string.
+    """
+    punctuation_pattern = re.compile(f"[{re.escape(string.punctuation)}]")
+    value = str(value).strip().lower().replace(' ', '')
+    return punctuation_pattern.sub('', value)
+
 def get_db_credentials(database_name)-> dict:
     """
     Get the database credentials from environment variables.
@@ -106,21 +128,329 @@ def get_db_credentials(database_name)-> dict:
         print(f"Error getting database credentials: {e}")
         return None
     
-def load_db_table(db_credentials:dict,data:DataFrame,dtype_dict:dict,table_name:str) -> None:
+def get_db_connection_string(db_credentials:dict) -> str:
+    """
+    Build the SQLAlchemy connection string of a Postgres database.
+
+    Parameters:
+        db_credentials (dict): Dictionary containing the database credentials.
+
+    Returns:
+        str: The SQLAlchemy connection string.
+    """
+    return f"postgresql+psycopg2://{db_credentials['user']}:{db_credentials['password']}@{db_credentials['host']}:{db_credentials['port']}/{db_credentials['database']}"
+
+def read_db_table(db_credentials:dict,table_name:str) -> DataFrame:
+    """
+    Read a table from the database into a pandas dataframe.
+
+    Parameters:
+        db_credentials (dict): Dictionary containing the database credentials.
+        table_name (str): Name of the table in the database.
+
+    Returns:
+        pd.DataFrame: The table's data or None if the table couldn't be read.
+    """
+    try:
+        engine = create_engine(get_db_connection_string(db_credentials))
+        try:
+            return read_sql_table(table_name=table_name, con=engine)
+        finally:
+            engine.dispose()
+    except Exception as e:
+        print(f"Error reading table {table_name}: {e}")
+        return None
+
+def load_db_table(db_credentials:dict,data:DataFrame,dtype_dict:dict,table_name:str,mode:str='swap',key_columns:List[str]=None,
+                  rollup_columns:List[str]=None,index_columns:List[str]=None,trigram_columns:List[str]=None) -> dict:
     """
     Update the database with the new data.
 
+    The data is streamed into a staging table with Postgres COPY and then applied to the table in a single transaction, so
+    the table is never missing or empty while it is reloaded. There are two modes:
+    - swap: The staging table replaces the table. Queries running during the swap wait for the rename instead of failing.
+    - delta: Only the rows which differ from the current table, matched on key_columns, are inserted, updated or deleted.
+             If the table doesn't exist yet the data is loaded with a swap.
+    The table's rollup tables (see source/rollups.py) are rebuilt in the same transaction, so they always match the table.
+    In the swap mode the indexes are built and the statistics gathered (ANALYZE) on the staging table before the swap, so the
+    table is never queried without them and the swap's locks aren't held while they are built.
+
     Parameters:
         db_credentials (dict): Dictionary containing the database credentials.
         data (pd.DataFrame): Data to be used for updating the database.
         dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+        table_name (str): Name of the table to be updated in the database.
+        mode (str): The load mode, either 'swap' or 'delta'. Default is 'swap'.
+        key_columns (List[str]): The columns which uniquely identify a row. Required for the delta mode.
+        rollup_columns (List[str]): The columns a rollup table of the numeric columns' aggregates is built for. Default is None (no rollups).
+        index_columns (List[str]): The columns given a B-tree index (i.e. columns filtered with = or IN). Default is None.
+        trigram_columns (List[str]): The columns given a pg_trgm trigram index (i.e. columns filtered with LIKE '%...%'). Default is None.
+
+    Returns:
+        load_stats (dict): Statistics of the load with the keys: mode, rows, copy_seconds, rows_per_second, swap_downtime_seconds,
+                           inserted, updated, deleted, rollups (the rollup table names mapped to their rows), indexes (the
+                           (column, method) of each index). None if the load failed.
+    """
+    try:
+        if mode not in ('swap', 'delta'):
+            raise ValueError(f"Invalid load mode '{mode}', expected 'swap' or 'delta'")
+        if mode == 'delta':
+            if not key_columns:
+                raise ValueError("key_columns are required for the delta load mode")
+            if data.duplicated(subset=key_columns).any():
+                raise ValueError(f"key_columns {key_columns} don't uniquely identify the rows of the data")
+
+        engine =  create_engine(get_db_connection_string(db_credentials))
+        staging_table_name = f"{table_name}_staging"
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if mode == 'delta' and not db_table_exists(cursor=cursor,table_name=table_name):
+                mode = 'swap'
+
+            #stream the data into a staging table
+            copy_start = time.perf_counter()
+            create_staging_table(cursor=cursor,engine=engine,data=data,dtype_dict=dtype_dict,staging_table_name=staging_table_name)
+            rows = copy_dataframe_to_table(cursor=cursor,data=data,table_name=staging_table_name)
+            if mode == 'swap':
+                indexes = create_table_indexes(cursor=cursor,table_name=staging_table_name,btree_columns=index_columns or [],
+                                               trigram_columns=trigram_columns or [])
+                cursor.execute(f'ANALYZE "{staging_table_name}"')
+            connection.commit()
+            copy_seconds = time.perf_counter() - copy_start
+
+            #apply the staging table to the table in a single transaction
+            swap_start = time.perf_counter()
+            if mode == 'swap':
+                changes = swap_tables(cursor=cursor,staging_table_name=staging_table_name,table_name=table_name)
+                rename_table_indexes(cursor=cursor,indexes=indexes,from_table_name=staging_table_name,to_table_name=table_name)
+            else:
+                changes = apply_table_delta(cursor=cursor,staging_table_name=staging_table_name,table_name=table_name,
+                                            columns=list(data.columns),key_columns=key_columns)
+                #the table keeps its indexes, only missing ones are created
+                indexes = create_table_indexes(cursor=cursor,table_name=table_name,btree_columns=index_columns or [],
+                                               trigram_columns=trigram_columns or [])
+                cursor.execute(f'ANALYZE "{table_name}"')
+            changes['indexes'] = indexes
+            changes['rollups'] = refresh_rollup_tables(cursor=cursor,table_name=table_name,dtype_dict=dtype_dict,
+                                                       group_columns=rollup_columns or [])
+            connection.commit()
+            swap_downtime_seconds = time.perf_counter() - swap_start
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+            engine.dispose()
+
+        return {'mode': mode,
+                'rows': rows,
+                'copy_seconds': copy_seconds,
+                'rows_per_second': rows / copy_seconds if copy_seconds > 0 else 0.0,
+                'swap_downtime_seconds': swap_downtime_seconds,
+                **changes}
+    except Exception as e:
+        print(f"Error executing query: {e}")
+        return None
+
+def stream_db_table(db_credentials:dict,chunks:Iterable[DataFrame],dtype_dict:dict,table_name:str,rollup_columns:List[str]=None,
+                    index_columns:List[str]=None,trigram_columns:List[str]=None) -> dict:
+    """
+    Replace a database table with data which arrives in chunks.
+
+    Each chunk is copied into a staging table with Postgres COPY as soon as it arrives, so only one chunk is held in memory at a
+    time. When every chunk has been copied the staging table replaces the table, and its rollup tables are rebuilt, in a single
+    transaction, as in load_db_table's swap mode. The indexes are built on the staging table before the swap.
+
+    Parameters:
+        db_credentials (dict): Dictionary containing the database credentials.
+        chunks (Iterable[pd.DataFrame]): The chunks of data to load. Every chunk must have the same columns.
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+        table_name (str): Name of the table to be replaced in the database.
+        rollup_columns (List[str]): The columns a rollup table of the numeric columns' aggregates is built for. Default is None (no rollups).
+        index_columns (List[str]): The columns given a B-tree index. Default is None.
+        trigram_columns (List[str]): The columns given a pg_trgm trigram index. Default is None.
+
+    Returns:
+        load_stats (dict): Statistics of the load with the keys: mode, rows, chunks, copy_seconds, rows_per_second, swap_downtime_seconds,
+                           peak_rss_mb, inserted, updated, deleted, rollups, indexes. None if the load failed.
     """
     try:
-        connection_string = f"postgresql+psycopg2://{db_credentials['user']}:{db_credentials['password']}@{db_credentials['host']}:{db_credentials['port']}/{db_credentials['database']}"
-        engine =  create_engine(connection_string)
-        data.to_sql(name=table_name, con=engine, if_exists='replace', index=False, dtype= dtype_dict)
+        engine =  create_engine(get_db_connection_string(db_credentials))
+        staging_table_name = f"{table_name}_staging"
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+
+            #stream each chunk into a staging table, the staging table is created from the first chunk
+            copy_start = time.perf_counter()
+            rows = 0
+            chunk_count = 0
+            for chunk in chunks:
+                if chunk_count == 0:
+                    create_staging_table(cursor=cursor,engine=engine,data=chunk,dtype_dict=dtype_dict,staging_table_name=staging_table_name)
+                rows += copy_dataframe_to_table(cursor=cursor,data=chunk,table_name=staging_table_name)
+                chunk_count += 1
+            if chunk_count == 0:
+                raise ValueError("No data to load")
+            indexes = create_table_indexes(cursor=cursor,table_name=staging_table_name,btree_columns=index_columns or [],
+                                           trigram_columns=trigram_columns or [])
+            cursor.execute(f'ANALYZE "{staging_table_name}"')
+            connection.commit()
+            copy_seconds = time.perf_counter() - copy_start
+
+            #replace the table with the staging table in a single transaction
+            swap_start = time.perf_counter()
+            changes = swap_tables(cursor=cursor,staging_table_name=staging_table_name,table_name=table_name)
+            rename_table_indexes(cursor=cursor,indexes=indexes,from_table_name=staging_table_name,to_table_name=table_name)
+            changes['indexes'] = indexes
+            changes['rollups'] = refresh_rollup_tables(cursor=cursor,table_name=table_name,dtype_dict=dtype_dict,
+                                                       group_columns=rollup_columns or [])
+            connection.commit()
+            swap_downtime_seconds = time.perf_counter() - swap_start
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+            engine.dispose()
+
+        return {'mode': 'swap',
+                'rows': rows,
+                'chunks': chunk_count,
+                'copy_seconds': copy_seconds,
+                'rows_per_second': rows / copy_seconds if copy_seconds > 0 else 0.0,
+                'swap_downtime_seconds': swap_downtime_seconds,
+                'peak_rss_mb': get_peak_rss_mb(),
+                **changes}
     except Exception as e:
         print(f"Error executing query: {e}")
+        return None
+
+def get_peak_rss_mb() -> float:
+    """
+    Get the peak resident set size of the current process.
+
+    Returns:
+        float: The peak resident set size in megabytes or None if it can't be measured on this platform.
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on macOS and in kilobytes on linux
+    if sys.platform == 'darwin':
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+def db_table_exists(cursor,table_name:str) -> bool:
+    """
+    Check if a table exists in the database.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        table_name (str): Name of the table in the database.
+
+    Returns:
+        bool: True if the table exists, False otherwise.
+    """
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f'"{table_name}"',))
+    return cursor.fetchone()[0]
+
+def create_staging_table(cursor,engine:Engine,data:DataFrame,dtype_dict:dict,staging_table_name:str) -> None:
+    """
+    Create an empty staging table with the schema pandas would use to store the data.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        engine (Engine): The SQLAlchemy engine of the database, used to build the table's schema.
+        data (pd.DataFrame): The data which will be copied into the staging table.
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+        staging_table_name (str): Name of the staging table.
+    """
+    cursor.execute(f'DROP TABLE IF EXISTS "{staging_table_name}"')
+    cursor.execute(get_schema(frame=data, name=staging_table_name, con=engine, dtype=dtype_dict))
+
+def copy_dataframe_to_table(cursor,data:DataFrame,table_name:str,chunk_size:int=50_000) -> int:
+    """
+    Stream a DataFrame into a table with Postgres COPY. The data is serialised as CSV in chunks so the whole frame is never
+    held in memory as text.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        data (pd.DataFrame): The data to copy. Its columns must exist in the table.
+        table_name (str): Name of the table the data is copied into.
+        chunk_size (int): The number of rows serialised per COPY call. Default is 50,000.
+
+    Returns:
+        int: The number of rows copied.
+    """
+    columns = ', '.join(f'"{column}"' for column in data.columns)
+    copy_statement = f"""COPY "{table_name}" ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"""
+    for start in range(0, len(data), chunk_size):
+        buffer = io.StringIO()
+        data.iloc[start:start + chunk_size].to_csv(buffer, index=False, header=False, na_rep='\\N')
+        buffer.seek(0)
+        cursor.copy_expert(copy_statement, buffer)
+    return len(data)
+
+def swap_tables(cursor,staging_table_name:str,table_name:str) -> dict:
+    """
+    Replace a table with its staging table. This must run inside a transaction so queries never see the table missing.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        staging_table_name (str): Name of the staging table.
+        table_name (str): Name of the table to replace.
+
+    Returns:
+        dict: The changes made with the keys: inserted, updated, deleted.
+    """
+    cursor.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    cursor.execute(f'ALTER TABLE "{staging_table_name}" RENAME TO "{table_name}"')
+    cursor.execute(f'SELECT COUNT(*) FROM "{table_name}"')
+    return {'inserted': cursor.fetchone()[0], 'updated': 0, 'deleted': 0}
+
+def apply_table_delta(cursor,staging_table_name:str,table_name:str,columns:List[str],key_columns:List[str]) -> dict:
+    """
+    Apply only the differences between a staging table and a table, then drop the staging table. This must run inside a
+    transaction so queries never see a partially applied delta.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        staging_table_name (str): Name of the staging table.
+        table_name (str): Name of the table to update.
+        columns (List[str]): The columns of the data.
+        key_columns (List[str]): The columns which uniquely identify a row.
+
+    Returns:
+        dict: The changes made with the keys: inserted, updated, deleted.
+    """
+    key_match = ' AND '.join(f'target."{column}" = staging."{column}"' for column in key_columns)
+    value_columns = [column for column in columns if column not in key_columns]
+    quoted_columns = ', '.join(f'"{column}"' for column in columns)
+
+    #delete rows which are no longer in the data
+    cursor.execute(f'DELETE FROM "{table_name}" AS target WHERE NOT EXISTS '
+                   f'(SELECT 1 FROM "{staging_table_name}" AS staging WHERE {key_match})')
+    deleted = cursor.rowcount
+
+    #update rows whose values changed
+    updated = 0
+    if value_columns:
+        assignments = ', '.join(f'"{column}" = staging."{column}"' for column in value_columns)
+        target_values = ', '.join(f'target."{column}"' for column in value_columns)
+        staging_values = ', '.join(f'staging."{column}"' for column in value_columns)
+        cursor.execute(f'UPDATE "{table_name}" AS target SET {assignments} FROM "{staging_table_name}" AS staging '
+                       f'WHERE {key_match} AND ROW({target_values}) IS DISTINCT FROM ROW({staging_values})')
+        updated = cursor.rowcount
+
+    #insert rows which are new
+    cursor.execute(f'INSERT INTO "{table_name}" ({quoted_columns}) SELECT {quoted_columns} FROM "{staging_table_name}" AS staging '
+                   f'WHERE NOT EXISTS (SELECT 1 FROM "{table_name}" AS target WHERE {key_match})')
+    inserted = cursor.rowcount
+
+    cursor.execute(f'DROP TABLE "{staging_table_name}"')
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted}
 
 def build_sql_query(keyword_dict:dict) -> str:
     """
@@ -148,75 +478,93 @@ def build_sql_query(keyword_dict:dict) -> str:
 
     return sql_query
 
-def to_documents(dict: dict) -> list:
+def NaN_to_zero(data:DataFrame,columns:list) -> DataFrame:
+    """
+    Convert NaN values in specified columns of a DataFrame to zero.
+
+    Parameters:
+        data (pd.DataFrame): The DataFrame to be processed.
+        columns (list): The list of columns in which NaN values should be replaced with zero.
+
+    Returns:
+        pd.DataFrame: The DataFrame with NaN values replaced by zero in the specified columns.
+    """
+    for col in columns:
+        data[col] = data[col].fillna(0)
+    return data
+
+def to_value_documents(column:str,values:list,bucket_size:int = 1) -> list:
     """
-    Converts a dictionary of into a list of Agno Document objects. The key is used as the name of the document,
-    and the values are the contents of the document.
+    Converts the unique values of a column into small Agno Document objects, one per value or per bucket of bucket_size values,
+    so a search returns only the values relevant to a question instead of the column's full list. Each document's meta_data holds
+    its column so it can be searched on its own (see get_input_sql_agent_retriever).
 
     Parameters:
-        unique_values_dict (dict): A dictionary where keys are column names and values are lists of unique values.
+        column (str): The name of the column.
+        values (list): The unique values of the column.
+        bucket_size (int): The number of values in each document. Default is 1.
 
     Returns:
-        list: A list of Document objects, each containing the unique values for a specific column.
+        list: A list of Document objects, each containing one or a bucket of the column's values.
     """
     documents = []
-    for key, values in dict.items():
-        content = f"Unique values for {key}: {', '.join(map(str, values))}"
-        documents.append(Document(name=key + ' column',content=content, ))
+    for start in range(0, len(values), max(bucket_size, 1)):
+        bucket = values[start:start + max(bucket_size, 1)]
+        documents.append(Document(name=column + ' values',
+                                  content=f"Value of {column}: {', '.join(map(str, bucket))}",
+                                  meta_data={'column': column}))
     return documents
 
-def NaN_to_zero(data:DataFrame,columns:list) -> DataFrame:
+def get_schema_document(dtype_dict:dict) -> Document:
     """
-    Convert NaN values in specified columns of a DataFrame to zero.
+    Build the document containing the schema of the database table as a list of column names.
 
     Parameters:
-        data (pd.DataFrame): The DataFrame to be processed.
-        columns (list): The list of columns in which NaN values should be replaced with zero.
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
 
     Returns:
-        pd.DataFrame: The DataFrame with NaN values replaced by zero in the specified columns.
+        Document: The schema document.
     """
-    for col in columns:
-        data[col] = data[col].fillna(0)
-    return data
+    return Document(
+        name="schema",
+        content= ", ".join(list(dtype_dict.keys())),
+        meta_data={
+            "description": "This document contains the schema of the ski resorts database as a list of column names.",
+        }
+    )
 
-def get_input_sql_agent_documents(data:DataFrame,columns:list,dtype_dict:dict,debug_mode:bool = False) -> list:
+def get_input_sql_agent_documents(data:DataFrame,columns:list,dtype_dict:dict,debug_mode:bool = False,bucket_size:int = 1) -> list:
     """
     Build a list of documents for the sql_input_agent knowledge base.
 
     The purpose of the knowledge base is to provide the sql_input_agent with the necessary information to generate SQL queries.
     Specifically, it helps the agent add syntactically correct SQL expressions to the query it generates. For example, with this
     knowledge base the agent knows that in the column, 'country' the 'United States' is referred to as 'united states' in the database.
+
+    The unique values are stored as one small document per value (or per bucket of values) rather than one document per column, so
+    columns with thousands of values (i.e. name) can be added and a search only adds the relevant values to the agent's prompt.
     
     Parameters:
         data (pd.DataFrame): The DataFrame containing the data in the sql_input_agent's knowledge base.
         columns (list): The list of columns in the data parameter which will have it's unique values stored in the knowledge base.
         dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
         debug_mode (bool): If True, print debug information.
+        bucket_size (int): The number of unique values in each document. Default is 1.
 
     Returns:
         documents(list): A list of Document objects containing the schema and unique values from the DataFrame.
     """
     #build document for agno schema
     if debug_mode: print('building schema document for sql_input_agent knowledge base')
-    schema_doc = Document(
-        name="schema",
-        content= ", ".join(list(dtype_dict.keys())),
-        meta_data={
-            "description": "This document contains the schema of the ski resorts database as a list of column names.",
-        }
-    )
+    schema_doc = get_schema_document(dtype_dict=dtype_dict)
 
     #building documents containing unique values in database
     if debug_mode: print('building list of documents for sql_input_agent knowledge base')
 
-    #storing the unique values of each column in the data to a dictionary
-    unique_values_dict = {}
+    #converting the unique values of each column to a list of small documents
+    documents:list = []
     for column in columns:
-        unique_values_dict[column] = data[column].unique().tolist()
-
-    #converting the unique values of each column stored in a dictionary to a list of documents
-    documents:list = to_documents(dict=unique_values_dict)
+        documents += to_value_documents(column=column, values=data[column].dropna().unique().tolist(), bucket_size=bucket_size)
 
     #adding schema docs to documents list 
     documents.append(schema_doc)
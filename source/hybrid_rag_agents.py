@@ -1,11 +1,24 @@
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
 from.agent_output_models import sql_input_agent_response_model, sql_output_agent_response_model
-from .sql_toolkit import sql_toolkit
+from .sql_toolkit import sql_toolkit as sql_toolkit_class
 from sqlalchemy import VARCHAR, FLOAT, INTEGER
-from .input_knowledgebase import build_input_sql_agent_knowledge_base
-from .output_database import build_output_sql_agent_database
-from .data_processing import resort_traits_data
+from agno.knowledge.document import DocumentKnowledgeBase
+from pandas import DataFrame, concat
+from threading import Lock
+from typing import Callable, Iterable, Iterator, List, Optional
+import os
+import time
+from .input_knowledgebase import build_input_sql_agent_knowledge_base, connect_input_sql_agent_knowledge_base, get_input_sql_agent_embedder, get_input_sql_agent_retriever
+from .output_database import build_output_sql_agent_database, connect_output_sql_agent_database, stream_output_sql_agent_database
+from .data_processing import get_resort_traits_data, stream_resort_traits_data
+from .helper_functions import read_db_table
+from .caching import sql_keyword_cache, sql_result_cache, set_table_version, get_data_version
+from .fast_path_planner import sql_fast_path_planner
+from .sql_validation import sql_query_validator
+from .entity_resolution import sql_entity_resolver
+from .rollups import sql_rollup_rewriter
+from .indexing import sql_index_advisor
 
 dtype_dict={"name": VARCHAR,
             "country": VARCHAR,
@@ -17,41 +30,53 @@ dtype_dict={"name": VARCHAR,
             "max_elevation_m": FLOAT,
             "lift_count": INTEGER}
 
-#vctdb credentials is a dictionary with the keys: user, password, host, port, database
-knowledge_base, vctdb_credentials = build_input_sql_agent_knowledge_base(new_data=resort_traits_data,
-                                                                        dtype_dict=dtype_dict,
-                                                                        database_name="VCTDB",
-                                                                        columns=['country','continent'],
-                                                                        debug_mode=False)
-
-#db credentials is a dictionary with the keys: user, password, host, port, database
 db_table_name = 'ski_resorts'
-db_credentials = build_output_sql_agent_database(dtype_dict=dtype_dict, 
-                                                  database_name="DB",
-                                                  table_name= db_table_name,
-                                                  new_data=resort_traits_data, 
-                                                  debug_mode=False)
-
-#defining the sql_input_agent
-sql_input_agent = Agent(
-    model=OpenAIChat(id="gpt-4o"),
-    response_model=sql_input_agent_response_model,
-    knowledge=knowledge_base,
-    add_references=True,        #always pull information from vector database and add to user query
-    markdown=True,
-    debug_mode=False,
-    goal= """
+
+#the columns the rollup tables of the numeric columns' aggregates are grouped by, rebuilt whenever the table is reloaded
+rollup_group_columns = ['country', 'continent']
+
+#the columns given a B-tree index (equality filters) and a trigram index (the name LIKE '%...%' filters) when the table is loaded
+index_columns = ['country', 'continent']
+trigram_index_columns = ['name']
+
+#the columns whose unique values are stored in the knowledge base, one document per value, and the number of each column's
+#values most relevant to a question which are added to the sql_input_agent's prompt
+knowledge_base_columns = ['country', 'continent', 'name']
+knowledge_base_top_k = 5
+
+#where the sql_toolkit runs the SQL queries, 'sqlalchemy' (the Postgres database) or 'duckdb' (an in-process copy of the data)
+sql_toolkit_backend = os.getenv('SQL_TOOLKIT_BACKEND', 'sqlalchemy')
+
+#bootstrap modes: 'build' reloads the data, knowledge base and database table, 'stream' reloads them while reading the source
+#data in chunks, 'serve' attaches to an already populated knowledge base and database without reloading anything
+bootstrap_modes = ['build', 'stream', 'serve']
+
+#agents built by get_sql_agents, they are created on first use rather than when the module is imported
+_sql_agents:dict = None
+_sql_agents_lock = Lock()
+
+sql_input_agent_goal= """
         To generate a SQL query for a postgres database containing the traits and chatacteristics of ski resorts. 
-    """,
-    instructions=[
+    """
+
+sql_input_agent_instructions=[
         """
         You are an AI agent that generates SQL queries for a postgres database containing the traits and characteristics of ski resorts.
         Your response should extract information to answer the question in the user's query.
         """,
         """
-        You will receive your input as a JSON string. This JSON will contain two fields:
+        You will receive your input as a JSON string. This JSON will contain three fields:
           - 'user_query': The user's original request in natural language.
           - 'sql_queries': A list of previous SQL queries that have been attempted and failed. If this list is empty, it's the first attempt.
+          - 'sql_errors': The reason each previous SQL query failed, in the same order as 'sql_queries'.
+        """,
+        """
+        If 'sql_errors' names an unknown column, table or a syntax error, fix that specific problem in your new sql query.
+        """,
+        """
+        The input may also contain a 'candidate' field such as '2 of 3'. This means several sql queries are being generated for the same
+        question at the same time. Make your sql query a different, reasonable interpretation of the question from the other candidates
+        (i.e. use a different column, matching condition or aggregation) so at least one of them answers it.
         """,
         """
         Generate your sql query based off the question in the 'user_query' key of the input dictionary and recognise that the 'sql_queries' key
@@ -72,6 +97,14 @@ sql_input_agent = Agent(
         the 'UK' should be referenced as 'united kingdom' in the SQL query.
         """,
         """
+        The input may also contain an 'entities' field which maps column names to the values stored in the database for the countries,
+        continents and ski resort names mentioned in the user's query (i.e. {'country': ['unitedkingdom']}). Use these exact values in your
+        sql query instead of searching your knowledge base. Only search your knowledge base for a place or resort missing from 'entities'.
+        'entities' may also contain a 'candidates' key which maps column names to values that only partially or approximately match the
+        user's query (i.e. {'candidates': {'name': ['coppermountain', 'coppervale']}}). These are not exact values: only use a candidate
+        if it is the place or resort the user means, and ignore candidates which don't fit the question.
+        """,
+        """
         Columns with data types VARCHAR have been preprocessed. This involved removing all spaces from the string, converting the 
         string to lowercase, removing all punctuation characters.
         """,
@@ -80,27 +113,13 @@ sql_input_agent = Agent(
         user may input 'Copper' but the database stores 'Copper Mountain'. Search if the users ski resort name is a substring of the name 
         in the database.
         """
-    ]
-)
-
-#instantiate the hybrid rag agent with the sql_toolkit
-sql_output_agent = Agent(
-    model=OpenAIChat(id="gpt-4o"),
-    show_tool_calls=False,
-    response_model=sql_output_agent_response_model,
-    tools= [sql_toolkit(
-        db_user= db_credentials['user'],
-        db_password= db_credentials['password'],
-        db_host= db_credentials['host'],
-        db_port= db_credentials['port'],
-        db_name= db_credentials['database'],
-        dtype_dict=dtype_dict,
-        table_name=db_table_name)],
-    debug_mode=False,
-    goal= """
+]
+
+sql_output_agent_goal= """
         To use the sql_toolkit to run SQL queries on a postgres database and then summarise the results in a human-readable format. 
-    """,
-    instructions=["""
+    """
+
+sql_output_agent_instructions=["""
         You are an AI agent that runs the inputted sql_query with your sql_toolkit to retrieve data from a postgres database.
         You then summarise the results in a human-readable format. 
         """,
@@ -123,8 +142,391 @@ sql_output_agent = Agent(
         """
         If after using your sql_toolkit you don't get all the information required to fully and completely anser the user's query,
         you must set 'response_text' key to a string that explains the error and what information is missing.
-        """],
-    markdown=True)
+        """,
+        """
+        If your sql_toolkit returns a dictionary with 'truncated' set to True, the result had too many rows to return. Use its 'row_count',
+        per column 'summary' statistics and the rows in 'sample' to answer, and say in 'response_text' that only part of the rows were shown.
+        """,
+        """
+        If your sql_toolkit returns a dictionary with 'error' set to True, the query was aborted (i.e. it timed out or returned too many rows).
+        You must set the 'error' key to True and set 'response_text' to the 'message' from your sql_toolkit.
+        """,
+        """
+        If your input also has a 'rows' key, the sql_query has already been run and 'rows' is its result in the same form your sql_toolkit
+        returns. Summarise those rows and don't run the sql_query again.
+        """]
+
+sql_summary_agent_goal= """
+        To summarise the rows returned by a SQL query on a postgres database in a human-readable format. 
+    """
+
+sql_summary_agent_instructions=["""
+        You are an AI agent that summarises the results of a SQL query, which has already been run on a postgres database, in a human-readable
+        format. You don't run any queries yourself.
+        """,
+        """
+        Your input is a JSON string. The keys to this JSON are:
+        - user_query(str): The user's question which the sql query answers.
+        - sql_query(str): The SQL query which was run.
+        - rows(list): The rows returned by the SQL query, each row is a dictionary mapping column names to values. If the query returned
+          too many rows, 'rows' is instead a dictionary with 'truncated' set to True, the 'row_count', per column 'summary' statistics
+          and the first rows in 'sample'. Use these to answer and say that only part of the rows were shown.
+        """,
+        """
+        Your response must use the sql_output response model. This means you are returning the following:
+        - user_query: The user's question you were inputted.
+        - sql_query: The SQL query you were inputted.
+        - response_text: A human-readable summary of the rows which answers the user's question. 
+        - error: A boolean indicating if the rows don't answer the user's question.
+        """,
+        """
+        If the rows don't contain all the information required to fully and completely answer the user's query, you must set the 'error'
+        key to True and set the 'response_text' key to a string that explains what information is missing.
+        """]
+
+def build_sql_input_agent(knowledge_base:DocumentKnowledgeBase,add_references:bool = True,retriever:Callable = None) -> Agent:
+    """
+    Build the sql_input_agent which generates the keywords of a SQL query from the user's question.
+
+    Parameters:
+        knowledge_base (DocumentKnowledgeBase): The knowledge base containing the schema and unique values of the database table.
+        add_references (bool): If True, the knowledge base is searched on every run and the results are added to the user's query. If False,
+                               the schema is added to the instructions and the agent only searches the knowledge base when it needs to,
+                               which is used with a sql_entity_resolver. Default is True.
+        retriever (Callable): The function searching the knowledge base instead of the agent's default search (see
+                              get_input_sql_agent_retriever). Default is None.
+
+    Returns:
+        sql_input_agent (Agno.Agent): The sql_input_agent.
+    """
+    instructions = sql_input_agent_instructions
+    if not add_references:
+        instructions = instructions + [f"The database table {db_table_name} has the columns: {', '.join(dtype_dict)}."]
+    return Agent(
+        model=OpenAIChat(id="gpt-4o"),
+        response_model=sql_input_agent_response_model,
+        knowledge=knowledge_base,
+        retriever=retriever,
+        add_references=add_references,        #always pull information from vector database and add to user query
+        markdown=True,
+        debug_mode=False,
+        goal=sql_input_agent_goal,
+        instructions=instructions
+    )
+
+def build_sql_output_agent(db_credentials:Optional[dict],data:DataFrame = None,backend:str = 'sqlalchemy') -> Agent:
+    """
+    Build the sql_output_agent which runs SQL queries with the sql_toolkit and summarises the results.
+
+    Parameters:
+        db_credentials (dict): Database credentials used to connect to the database. The keys are: user, password, host, port, database.
+                               None with the 'duckdb' backend, which doesn't use a database.
+        data (pd.DataFrame): The data loaded into the database table, required by the 'duckdb' backend. Default is None.
+        backend (str): Where the sql_toolkit runs the SQL queries, either 'sqlalchemy' or 'duckdb' (see sql_toolkit). Default is 'sqlalchemy'.
+
+    Returns:
+        sql_output_agent (Agno.Agent): The sql_output_agent.
+    """
+    if db_credentials is None:
+        if backend != 'duckdb':
+            raise ValueError("db_credentials are required unless the backend is 'duckdb'")
+        db_credentials = {'user': '', 'password': '', 'host': '', 'port': '', 'database': ''}
+    #instantiate the hybrid rag agent with the sql_toolkit
+    return Agent(
+        model=OpenAIChat(id="gpt-4o"),
+        show_tool_calls=False,
+        response_model=sql_output_agent_response_model,
+        tools= [sql_toolkit_class(
+            db_user= db_credentials['user'],
+            db_password= db_credentials['password'],
+            db_host= db_credentials['host'],
+            db_port= db_credentials['port'],
+            db_name= db_credentials['database'],
+            dtype_dict=dtype_dict,
+            table_name=db_table_name,
+            data=data,
+            backend=backend,
+            result_cache=sql_result_cache(table_name=db_table_name),
+            rollup_rewriter=sql_rollup_rewriter(table_name=db_table_name, dtype_dict=dtype_dict, group_columns=rollup_group_columns),
+            index_advisor=sql_index_advisor(table_name=db_table_name, dtype_dict=dtype_dict,
+                                            indexed=[(column, 'btree') for column in index_columns] +
+                                                    [(column, 'trigram') for column in trigram_index_columns]))],
+        debug_mode=False,
+        goal=sql_output_agent_goal,
+        instructions=sql_output_agent_instructions,
+        markdown=True)
+
+def build_sql_summary_agent() -> Agent:
+    """
+    Build the sql_summary_agent which summarises rows that were returned by a SQL query run directly with the sql_toolkit. It is used
+    instead of the sql_output_agent in the 'direct' execution mode of query_sql_agents and has no tools, so it answers in a single model call.
+
+    Returns:
+        sql_summary_agent (Agno.Agent): The sql_summary_agent.
+    """
+    return Agent(
+        model=OpenAIChat(id="gpt-4o"),
+        response_model=sql_output_agent_response_model,
+        debug_mode=False,
+        goal=sql_summary_agent_goal,
+        instructions=sql_summary_agent_instructions,
+        markdown=True)
+
+def read_loaded_data(db_credentials:dict) -> DataFrame:
+    """
+    Read the cleaned resort data back from the database table the stream and serve modes load or attach to.
+
+    Parameters:
+        db_credentials (dict): Database credentials used to connect to the database. The keys are: user, password, host, port, database.
+
+    Returns:
+        pd.DataFrame: The resort data in the database table.
+
+    Raises:
+        RuntimeError: If the database table can't be read.
+    """
+    resort_traits_data = read_db_table(db_credentials=db_credentials,table_name=db_table_name) if db_credentials is not None else None
+    if resort_traits_data is None:
+        raise RuntimeError(f"Unable to read the resort data from the database table '{db_table_name}', check that the database is "
+                           f"running and the table has been loaded (i.e. with the 'build' mode)")
+    return resort_traits_data
+
+def collect_distinct_values(chunks:Iterable[DataFrame],columns:List[str],collected:dict) -> Iterator[DataFrame]:
+    """
+    Pass the chunks of the data through unchanged while collecting the table's columns and the distinct values of columns, so the
+    knowledge base, fast path planner, validator and entity resolver can be built without reading the loaded table back.
+
+    Parameters:
+        chunks (Iterable[pd.DataFrame]): The chunks of the data loaded into the database table.
+        columns (List[str]): The columns whose distinct values are collected.
+        collected (dict): Updated as the chunks pass through with the keys:
+            - columns: The columns of the chunks.
+            - data: A DataFrame of the distinct combinations of columns seen so far.
+
+    Yields:
+        pd.DataFrame: Each chunk of the data.
+    """
+    collected.update({'columns': [], 'data': DataFrame(columns=columns)})
+    for chunk in chunks:
+        if not collected['columns']:
+            collected['columns'] = list(chunk.columns)
+        #only the distinct values are kept so memory grows with the number of countries, continents and names, not of rows
+        collected['data'] = concat([collected['data'], chunk[columns]], ignore_index=True).drop_duplicates(ignore_index=True)
+        yield chunk
+
+def bootstrap_sql_agents(mode:str = 'build',debug_mode:bool = False,chunk_size:int = 50_000,use_entity_resolver:bool = True,
+                         backend:str = None) -> dict:
+    """
+    Build the sql_input_agent, the sql_output_agent and the components used alongside them.
+
+    There are three modes:
+    - build: Process the source CSV data, synchronise the knowledge base and reload the database table.
+    - stream: Read, clean and load the source CSV data into the database table in chunks so memory use is bounded by chunk_size
+              rather than the size of the source file. The whole table is never held in memory: the knowledge base, planner, validator
+              and entity resolver are built from the table's columns and the distinct countries, continents and names collected from
+              the chunks as they are loaded (see collect_distinct_values), which grow with the number of resorts, not of source rows.
+    - serve: Attach to an already populated knowledge base and database table without reloading anything. The resort data used by
+             the fast path planner is read back from the database table instead of being reprocessed from the CSV files.
+
+    With the 'duckdb' backend the sql_toolkit queries an in-process copy of the processed data, so the database table is never
+    loaded or read and no database server is needed for it: every mode uses the processed data (see get_resort_traits_data) and
+    the stream mode behaves like the build mode. The knowledge base still needs its vector database.
+
+    Parameters:
+        mode (str): The bootstrap mode, either 'build', 'stream' or 'serve'. Default is 'build'.
+        debug_mode (bool): If True, print debug information.
+        chunk_size (int): The number of source rows read per chunk in the stream mode. Default is 50,000.
+        use_entity_resolver (bool): If True, build an entity_resolver from the resort data and build the sql_input_agent without adding
+                                    knowledge base references to every run. Pass entity_resolver to query_sql_agents so the places and
+                                    resorts in each question are resolved locally instead. Default is True.
+        backend (str): Where the sql_toolkit runs the SQL queries, either 'sqlalchemy' or 'duckdb'. Default is None (sql_toolkit_backend,
+                       set by the SQL_TOOLKIT_BACKEND environment variable).
+
+    Returns:
+        sql_agents (dict): The bootstrapped components with the keys:
+            - sql_input_agent: The agent responsible for building the SQL queries.
+            - sql_output_agent: The agent responsible for executing the SQL queries and processing the output.
+            - sql_input_agent_cache: The cache of the sql_input_agent's keywords.
+            - sql_input_fast_path_planner: The local planner used instead of the sql_input_agent for common question shapes.
+            - sql_validator: Checks each SQL query (identifiers and EXPLAIN) before it is given to the sql_output_agent.
+            - sql_summary_agent: The agent which only summarises rows, used with sql_toolkit in the 'direct' execution mode.
+            - sql_toolkit: The sql_output_agent's toolkit, used to run SQL queries directly in the 'direct' execution mode. Its
+                           rollup_rewriter answers aggregate queries by country or continent from the rollup tables and its
+                           index_advisor recommends indexes for the shapes of the queries run.
+            - entity_resolver: Resolves the places and resorts mentioned in each question to the values in the database, None if
+                               use_entity_resolver is False.
+            - knowledge_base: The sql_input_agent's knowledge base.
+            - embedding_cache: The knowledge base's cached_embedder, its get_stats method reports the embedding cache's hits and misses.
+            - db_credentials: The credentials of the sql_output_agent's database, None with the 'duckdb' backend.
+            - vctdb_credentials: The credentials of the sql_input_agent's vector database.
+            - startup_times: The number of seconds spent in each bootstrap phase.
+            - load_stats: The statistics of the streamed load including rows_read and peak_rss_mb, None unless the mode is 'stream'.
+    """
+    if mode not in bootstrap_modes:
+        raise ValueError(f"Invalid bootstrap mode '{mode}', expected one of {bootstrap_modes}")
+    backend = backend or sql_toolkit_backend
+    #the duckdb backend queries a copy of the processed data, so there is no database table to load, stream into or read
+    use_database = backend != 'duckdb'
+    db_credentials = None
+    startup_times = {}
+    load_stats = None
+    #the columns of the database table, set by the stream mode where resort_traits_data only has the distinct values of some columns
+    table_columns = None
+    #the knowledge base's embedder, which caches the embeddings of its documents and of the questions searched for
+    embedding_cache = get_input_sql_agent_embedder()
+
+    if mode == 'build' or (mode == 'stream' and not use_database):
+        #process the source data
+        if debug_mode: print('processing resort data')
+        phase_start = time.perf_counter()
+        resort_traits_data = get_resort_traits_data()
+        startup_times['data_processing'] = time.perf_counter() - phase_start
+
+        #vctdb credentials is a dictionary with the keys: user, password, host, port, database
+        phase_start = time.perf_counter()
+        knowledge_base, vctdb_credentials = build_input_sql_agent_knowledge_base(new_data=resort_traits_data,
+                                                                                dtype_dict=dtype_dict,
+                                                                                database_name="VCTDB",
+                                                                                columns=knowledge_base_columns,
+                                                                                debug_mode=debug_mode,
+                                                                                embedder=embedding_cache)
+        startup_times['knowledge_base'] = time.perf_counter() - phase_start
+
+        #db credentials is a dictionary with the keys: user, password, host, port, database
+        phase_start = time.perf_counter()
+        if use_database:
+            db_credentials = build_output_sql_agent_database(dtype_dict=dtype_dict, 
+                                                              database_name="DB",
+                                                              table_name= db_table_name,
+                                                              new_data=resort_traits_data, 
+                                                              debug_mode=debug_mode,
+                                                              rollup_columns=rollup_group_columns,
+                                                              index_columns=index_columns,
+                                                              trigram_columns=trigram_index_columns)
+        else:
+            set_table_version(table_name=db_table_name,version=get_data_version(data=resort_traits_data,dtype_dict=dtype_dict))
+        startup_times['output_database'] = time.perf_counter() - phase_start
+    elif mode == 'stream':
+        #stream the source data into the database table, reading, cleaning and loading one chunk at a time
+        if debug_mode: print('streaming resort data into database table')
+        phase_start = time.perf_counter()
+        read_stats = {}
+        collected = {}
+        chunks = collect_distinct_values(chunks=stream_resort_traits_data(chunk_size=chunk_size,read_stats=read_stats),
+                                         columns=knowledge_base_columns,collected=collected)
+        db_credentials, load_stats = stream_output_sql_agent_database(dtype_dict=dtype_dict,
+                                                                      database_name="DB",
+                                                                      table_name=db_table_name,
+                                                                      chunks=chunks,
+                                                                      debug_mode=debug_mode,
+                                                                      rollup_columns=rollup_group_columns,
+                                                                      index_columns=index_columns,
+                                                                      trigram_columns=trigram_index_columns)
+        if load_stats is not None:
+            load_stats.update(read_stats)
+        startup_times['output_database'] = time.perf_counter() - phase_start
+
+        #the components built from the data only need its columns and distinct values, which were collected while it was loaded.
+        #if the load failed the table wasn't replaced, so the data already in it is read back
+        phase_start = time.perf_counter()
+        if load_stats is not None:
+            resort_traits_data, table_columns = collected['data'], collected['columns']
+        else:
+            resort_traits_data = read_loaded_data(db_credentials=db_credentials)
+        startup_times['data_processing'] = time.perf_counter() - phase_start
+
+        phase_start = time.perf_counter()
+        knowledge_base, vctdb_credentials = build_input_sql_agent_knowledge_base(new_data=resort_traits_data,
+                                                                                dtype_dict=dtype_dict,
+                                                                                database_name="VCTDB",
+                                                                                columns=knowledge_base_columns,
+                                                                                debug_mode=debug_mode,
+                                                                                embedder=embedding_cache)
+        startup_times['knowledge_base'] = time.perf_counter() - phase_start
+    else:
+        phase_start = time.perf_counter()
+        knowledge_base, vctdb_credentials = connect_input_sql_agent_knowledge_base(database_name="VCTDB",debug_mode=debug_mode,
+                                                                                   embedder=embedding_cache)
+        startup_times['knowledge_base'] = time.perf_counter() - phase_start
+
+        if use_database:
+            phase_start = time.perf_counter()
+            db_credentials = connect_output_sql_agent_database(database_name="DB",table_name=db_table_name,debug_mode=debug_mode)
+            startup_times['output_database'] = time.perf_counter() - phase_start
+
+            #read the already cleaned data back from the database table
+            if debug_mode: print('reading resort data from database table')
+            phase_start = time.perf_counter()
+            resort_traits_data = read_loaded_data(db_credentials=db_credentials)
+            startup_times['data_processing'] = time.perf_counter() - phase_start
+        else:
+            #the processed data is loaded from its parquet cache when the source files haven't changed
+            if debug_mode: print('processing resort data')
+            phase_start = time.perf_counter()
+            resort_traits_data = get_resort_traits_data()
+            set_table_version(table_name=db_table_name,version=get_data_version(data=resort_traits_data,dtype_dict=dtype_dict))
+            startup_times['data_processing'] = time.perf_counter() - phase_start
+
+    if table_columns is None:
+        table_columns = list(resort_traits_data.columns)
+
+    #build the agents and the components used alongside them
+    if debug_mode: print('building sql agents')
+    phase_start = time.perf_counter()
+    sql_output_agent = build_sql_output_agent(db_credentials=db_credentials,data=resort_traits_data,backend=backend)
+    sql_output_toolkit = sql_output_agent.tools[0]
+    sql_agents = {
+        'sql_input_agent': build_sql_input_agent(knowledge_base=knowledge_base,add_references=not use_entity_resolver,
+                                                 retriever=get_input_sql_agent_retriever(knowledge_base=knowledge_base,
+                                                                                         columns=knowledge_base_columns,
+                                                                                         dtype_dict=dtype_dict,
+                                                                                         top_k=knowledge_base_top_k)),
+        'sql_output_agent': sql_output_agent,
+        #cache of the sql_input_agent's keywords for previously answered questions
+        'sql_input_agent_cache': sql_keyword_cache(table_name=db_table_name, dtype_dict=dtype_dict),
+        #local planner which answers common question shapes without calling the sql_input_agent
+        'sql_input_fast_path_planner': sql_fast_path_planner(data=resort_traits_data, dtype_dict=dtype_dict, table_name=db_table_name),
+        #local check of each sql query so invalid queries are retried without calling the sql_output_agent
+        'sql_validator': sql_query_validator(dtype_dict=dtype_dict, table_name=db_table_name, columns=table_columns,
+                                             toolkit=sql_output_toolkit, use_explain=True),
+        'sql_summary_agent': build_sql_summary_agent(),
+        'sql_toolkit': sql_output_toolkit,
+        #in-memory index of the countries, continents and resort names used instead of a vector search on every run
+        'entity_resolver': sql_entity_resolver(data=resort_traits_data) if use_entity_resolver else None,
+        'knowledge_base': knowledge_base,
+        'embedding_cache': embedding_cache,
+        'db_credentials': db_credentials,
+        'vctdb_credentials': vctdb_credentials,
+    }
+    startup_times['agents'] = time.perf_counter() - phase_start
+    startup_times['total'] = sum(startup_times.values())
+    sql_agents['startup_times'] = startup_times
+    sql_agents['load_stats'] = load_stats
+    if debug_mode: print(f'startup times (seconds): {startup_times}')
+
+    return sql_agents
+
+def get_sql_agents(mode:str = None,debug_mode:bool = False) -> dict:
+    """
+    Get the process-wide sql agents, bootstrapping them on first use. Later calls return the same agents.
 
+    Parameters:
+        mode (str): The bootstrap mode, either 'build', 'stream' or 'serve'. Default is the SQL_AGENTS_MODE environment variable or 'build'.
+        debug_mode (bool): If True, print debug information.
 
+    Returns:
+        sql_agents (dict): The bootstrapped components, see bootstrap_sql_agents.
+    """
+    global _sql_agents
+    with _sql_agents_lock:
+        if _sql_agents is None:
+            _sql_agents = bootstrap_sql_agents(mode=mode or os.getenv('SQL_AGENTS_MODE', 'build'),debug_mode=debug_mode)
+        return _sql_agents
 
+def __getattr__(name:str):
+    """Bootstrap the sql agents the first time one of them is accessed as a module attribute (i.e. from hybrid_rag_agents import sql_input_agent)."""
+    if name in ('sql_input_agent', 'sql_output_agent', 'sql_input_agent_cache', 'sql_input_fast_path_planner', 'sql_validator',
+                'sql_summary_agent', 'sql_toolkit', 'entity_resolver', 'knowledge_base', 'embedding_cache', 'db_credentials',
+                'vctdb_credentials'):
+        return get_sql_agents()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,215 @@
+from threading import Lock
+from typing import List, Optional
+import re
+
+from sqlalchemy import create_engine, text
+
+from .rollups import clause_pattern
+from .sql_validation import string_literal_pattern
+
+def get_index_name(table_name:str,column:str,method:str) -> str:
+    """Get the name of a table's index on a column (i.e. ski_resorts_country_idx or ski_resorts_name_trgm_idx)."""
+    return f"{table_name}_{column}_trgm_idx" if method == 'trigram' else f"{table_name}_{column}_idx"
+
+def build_index_statement(table_name:str,column:str,method:str,concurrently:bool=False) -> str:
+    """
+    Build the CREATE INDEX statement of an index on a column.
+
+    Parameters:
+        table_name (str): Name of the table.
+        column (str): The indexed column.
+        method (str): The index method, either 'btree' or 'trigram'.
+        concurrently (bool): If True, build the index without blocking writes to the table. Default is False.
+
+    Returns:
+        str: The CREATE INDEX statement.
+    """
+    index_expression = f'USING gin ("{column}" gin_trgm_ops)' if method == 'trigram' else f'("{column}")'
+    return (f'CREATE INDEX {"CONCURRENTLY " if concurrently else ""}IF NOT EXISTS "{get_index_name(table_name, column, method)}" '
+            f'ON "{table_name}" {index_expression}')
+
+def create_table_indexes(cursor,table_name:str,btree_columns:List[str],trigram_columns:List[str]) -> List[tuple]:
+    """
+    Create the B-tree and trigram indexes of a table. Trigram indexes need the pg_trgm extension, if it can't be created they are
+    skipped and the error is printed.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        table_name (str): Name of the table.
+        btree_columns (List[str]): The columns given a B-tree index.
+        trigram_columns (List[str]): The columns given a trigram index.
+
+    Returns:
+        List[tuple]: The (column, method) of each index created.
+    """
+    indexes = [(column, 'btree') for column in btree_columns]
+    if trigram_columns:
+        #a failed CREATE EXTENSION would abort the transaction, so it is run in a savepoint
+        cursor.execute('SAVEPOINT create_pg_trgm')
+        try:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            cursor.execute('RELEASE SAVEPOINT create_pg_trgm')
+            indexes += [(column, 'trigram') for column in trigram_columns]
+        except Exception as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT create_pg_trgm')
+            print(f"Error creating pg_trgm extension, trigram indexes skipped: {str(e).strip().splitlines()[0]}")
+    for column, method in indexes:
+        cursor.execute(build_index_statement(table_name=table_name, column=column, method=method))
+    return indexes
+
+def rename_table_indexes(cursor,indexes:List[tuple],from_table_name:str,to_table_name:str) -> None:
+    """
+    Rename the indexes created by create_table_indexes on a staging table after it has replaced the table, so the next load's
+    staging table can reuse the names.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        indexes (List[tuple]): The (column, method) of each index.
+        from_table_name (str): Name of the staging table the indexes were created on.
+        to_table_name (str): Name of the table the staging table was renamed to.
+    """
+    for column, method in indexes:
+        cursor.execute(f'ALTER INDEX "{get_index_name(from_table_name, column, method)}" '
+                       f'RENAME TO "{get_index_name(to_table_name, column, method)}"')
+
+class sql_index_advisor:
+    """
+    Records the shape of the SQL queries run on the table by the sql_toolkit (which columns they filter with equality, ranges or
+    LIKE patterns and which they sort for a LIMIT) and the time they took, then recommends, and optionally creates, the indexes
+    which would serve the most frequent and slowest shapes.
+
+    Columns are recommended:
+    - A B-tree index: when filtered with =, IN, <, <=, >, >= or BETWEEN, or sorted by ORDER BY with a LIMIT.
+    - A trigram index: when filtered with LIKE or ILIKE (i.e. name LIKE '%copper%').
+    """
+
+    def __init__(self,table_name:str,dtype_dict:dict,indexed:Optional[List[tuple]]=None):
+        """
+        Initializes the sql_index_advisor.
+
+        Parameters:
+            table_name (str): Name of the table.
+            dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+            indexed (List[tuple]): The (column, method) of the indexes the table already has, which aren't recommended. Default is None.
+        """
+        self.table_name = table_name
+        self.columns = list(dtype_dict)
+        self.indexed = set(indexed or [])
+        column_names = '|'.join(re.escape(column) for column in sorted(self.columns, key=len, reverse=True))
+        self.btree_filter_pattern = re.compile(rf'(?<![\w.])"?({column_names})(?!\w)"?\s*(?:=|<=|>=|<(?!>)|>|\bIN\b|\bBETWEEN\b)', re.IGNORECASE)
+        self.trigram_filter_pattern = re.compile(rf'(?<![\w.])"?({column_names})(?!\w)"?\s+(?:NOT\s+)?I?LIKE\b', re.IGNORECASE)
+        self.sort_pattern = re.compile(rf'"?({column_names})(?!\w)', re.IGNORECASE)
+        self.column_case = {column.lower(): column for column in self.columns}
+        self.lock = Lock()
+        self.queries = 0
+        #(column, method) mapped to the number of queries with the shape and the seconds they took
+        self.shape_counts:dict = {}
+        self.shape_seconds:dict = {}
+
+    def get_query_shape(self,sql_query:str) -> set:
+        """
+        Get the columns of a query which an index could serve.
+
+        Parameters:
+            sql_query (str): The SQL query.
+
+        Returns:
+            set: The (column, method) pairs of the query.
+        """
+        match = clause_pattern.match(sql_query)
+        if match is None:
+            return set()
+        clauses = match.groupdict()
+        shape = set()
+        if clauses['WHERE']:
+            #string literals can't contain column names or operators
+            where_clause = string_literal_pattern.sub("''", clauses['WHERE'])
+            shape |= {(self.column_case[column.lower()], 'btree') for column in self.btree_filter_pattern.findall(where_clause)}
+            shape |= {(self.column_case[column.lower()], 'trigram') for column in self.trigram_filter_pattern.findall(where_clause)}
+        if clauses['ORDERBY'] and clauses['LIMIT'] and not clauses['GROUPBY']:
+            first_sort_column = self.sort_pattern.match(clauses['ORDERBY'].strip())
+            if first_sort_column is not None:
+                shape.add((self.column_case[first_sort_column.group(1).lower()], 'btree'))
+        return shape
+
+    def record(self,sql_query:str,seconds:float) -> None:
+        """
+        Record a query run on the table.
+
+        Parameters:
+            sql_query (str): The SQL query.
+            seconds (float): The number of seconds the query took.
+        """
+        shape = self.get_query_shape(sql_query)
+        with self.lock:
+            self.queries += 1
+            for key in shape:
+                self.shape_counts[key] = self.shape_counts.get(key, 0) + 1
+                self.shape_seconds[key] = self.shape_seconds.get(key, 0.0) + seconds
+
+    def recommend(self,min_queries:int=5) -> List[dict]:
+        """
+        Recommend indexes for the query shapes seen at least min_queries times which the table has no index for.
+
+        Parameters:
+            min_queries (int): The minimum number of queries with a shape before an index is recommended. Default is 5.
+
+        Returns:
+            List[dict]: The recommendations, slowest shape first, with the keys: column, method, queries, total_seconds, statement.
+        """
+        with self.lock:
+            shapes = [(key, count, self.shape_seconds[key]) for key, count in self.shape_counts.items()
+                      if count >= min_queries and key not in self.indexed]
+        return [{'column': column,
+                 'method': method,
+                 'queries': count,
+                 'total_seconds': round(seconds, 6),
+                 'statement': build_index_statement(table_name=self.table_name, column=column, method=method, concurrently=True)}
+                for (column, method), count, seconds in sorted(shapes, key=lambda shape: shape[2], reverse=True)]
+
+    def create_recommended_indexes(self,connection_string:str,min_queries:int=5) -> List[str]:
+        """
+        Create the recommended indexes with CREATE INDEX CONCURRENTLY, so queries keep running while they are built. The indexes
+        last until the table is next replaced, add their columns to the load's index columns to keep them.
+
+        Parameters:
+            connection_string (str): The SQLAlchemy connection string of the database (see get_db_connection_string).
+            min_queries (int): The minimum number of queries with a shape before an index is created. Default is 5.
+
+        Returns:
+            List[str]: The names of the indexes created.
+        """
+        created = []
+        try:
+            engine = create_engine(connection_string)
+            #CREATE INDEX CONCURRENTLY can't run inside a transaction
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+                for recommendation in self.recommend(min_queries=min_queries):
+                    try:
+                        if recommendation['method'] == 'trigram':
+                            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                        connection.execute(text(recommendation['statement']))
+                    except Exception as e:
+                        print(f"Error creating index on {recommendation['column']}: {str(getattr(e, 'orig', e)).strip().splitlines()[0]}")
+                        continue
+                    with self.lock:
+                        self.indexed.add((recommendation['column'], recommendation['method']))
+                    created.append(get_index_name(self.table_name, recommendation['column'], recommendation['method']))
+                if created:
+                    connection.execute(text(f'ANALYZE "{self.table_name}"'))
+            engine.dispose()
+        except Exception as e:
+            print(f"Error creating recommended indexes: {e}")
+        return created
+
+    def get_stats(self) -> dict:
+        """
+        Get the query shapes recorded by the advisor.
+
+        Returns:
+            dict: The advisor statistics with the keys: queries, shapes (i.e. 'name:trigram' mapped to its number of queries), recommendations.
+        """
+        with self.lock:
+            shapes = {f'{column}:{method}': count for (column, method), count in self.shape_counts.items()}
+            queries = self.queries
+        return {'queries': queries, 'shapes': shapes, 'recommendations': len(self.recommend())}
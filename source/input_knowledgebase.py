@@ -1,10 +1,34 @@
-from .helper_functions import get_db_credentials, get_input_sql_agent_documents
+from .helper_functions import get_db_credentials, get_input_sql_agent_documents, get_schema_document
 from agno.knowledge.document import DocumentKnowledgeBase
 from agno.vectordb.pgvector import PgVector
-from typing import Tuple, List
+from agno.document.base import Document
+from agno.embedder.base import Embedder
+from agno.embedder.openai import OpenAIEmbedder
+from typing import Callable, Tuple, List, Optional
 from pandas import DataFrame
+from pathlib import Path
+from hashlib import md5
+import json
+from sqlalchemy import select, delete
+from .caching import cached_embedder
 
-def build_input_sql_agent_knowledge_base(new_data:DataFrame,dtype_dict:dict,database_name:str,columns:List[str],debug_mode:bool = False) -> Tuple[DocumentKnowledgeBase, dict]:
+#embeddings of the knowledge base documents and questions are cached on disk so they are only requested from the API once
+embedding_cache_path = Path('data') / 'cache' / 'embeddings.sqlite'
+
+def get_input_sql_agent_embedder(disk_path:Path = embedding_cache_path) -> cached_embedder:
+    """
+    Build the embedder of the sql_input_agent's knowledge base: PgVector's default OpenAI embedder behind a cached_embedder.
+
+    Parameters:
+        disk_path (Path): Path of the SQLite file the embeddings are cached in. Default is data/cache/embeddings.sqlite. None caches in memory only.
+
+    Returns:
+        cached_embedder: The embedder.
+    """
+    return cached_embedder(embedder=OpenAIEmbedder(), disk_path=disk_path)
+
+def build_input_sql_agent_knowledge_base(new_data:DataFrame,dtype_dict:dict,database_name:str,columns:List[str],debug_mode:bool = False,
+                                         embedder:Embedder = None,bucket_size:int = 1) -> Tuple[DocumentKnowledgeBase, dict]:
     """
     This function builds the knowledge base for the sql_input_agent.
     The purpose of the knowledge base is to provide the sql_input_agent with the necessary information to generate SQL queries.
@@ -12,15 +36,21 @@ def build_input_sql_agent_knowledge_base(new_data:DataFrame,dtype_dict:dict,data
     knowledge base the agent knows that in the column, 'country' the 'United States' is referred to as 'united states' in the database.
 
     It uses the data which will be loaded into the sql_output_agent's database and creates two types of documents which are:
-        1. Documents containing the unique values for each column in the columns parameter. 
+        1. Small documents containing one unique value (or a bucket of bucket_size values) of each column in the columns parameter,
+           with the column in their meta_data so each column can be searched for its top-k values (see get_input_sql_agent_retriever).
         2. A document containing the schema of the database table.
 
+    The vector database is synchronised incrementally (see sync_knowledge_base) so only new or changed documents are embedded, and
+    the embedder's cache means documents embedded before (i.e. before the vector database was recreated) aren't sent to the API again.
+
     Parameters:
         new_data (DataFrame): DataFrame containing the data to be used for building the knowledge base.
         dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
         database_name (str): Database name in .env file. This value is the prefix for the environment variable (i.e. abcd_USER).
         columns (List[str]): List of columns whose unique values will be used to create documents for the knowledge base.
         debug_mode (bool): If True, print debug information.
+        embedder (Embedder): The embedder of the documents and questions. Default is None (get_input_sql_agent_embedder).
+        bucket_size (int): The number of unique values in each document. Default is 1.
 
     Returns:
         knowledge_base (DocumentKnowledgeBase): The knowledge base for the sql_input_agent.
@@ -36,23 +66,154 @@ def build_input_sql_agent_knowledge_base(new_data:DataFrame,dtype_dict:dict,data
     documents:list = get_input_sql_agent_documents(data = new_data,
                                                    columns=columns,
                                                    dtype_dict=dtype_dict,
-                                                   debug_mode=debug_mode)
+                                                   debug_mode=debug_mode,
+                                                   bucket_size=bucket_size)
 
     #initialising pgvector knowledge base
     if debug_mode: print('initialising pgvector knowledge base for sql_input_agent')
     knowledge_base = DocumentKnowledgeBase(
         documents=documents,
-        vector_db=PgVector(
-            table_name="unique_values",
-            db_url = f"postgresql://{vctdb_credentials['user']}:{vctdb_credentials['password']}@{vctdb_credentials['host']}:{vctdb_credentials['port']}/{vctdb_credentials['database']}",
-        )
+        vector_db=get_input_sql_agent_vector_db(vctdb_credentials=vctdb_credentials,embedder=embedder)
     )
-    #load databse
-    knowledge_base.load(recreate=True)
+    #load only new or changed documents into the database
+    sync_knowledge_base(knowledge_base=knowledge_base, documents=documents, debug_mode=debug_mode)
 
     return knowledge_base, vctdb_credentials
 
+def connect_input_sql_agent_knowledge_base(database_name:str,debug_mode:bool = False,embedder:Embedder = None) -> Tuple[DocumentKnowledgeBase, dict]:
+    """
+    Attach to the sql_input_agent's existing knowledge base without building documents or loading the vector database.
+    This is used when the vector database has already been populated by build_input_sql_agent_knowledge_base.
+
+    Parameters:
+        database_name (str): Database name in .env file. This value is the prefix for the environment variable (i.e. abcd_USER).
+        debug_mode (bool): If True, print debug information.
+        embedder (Embedder): The embedder of the questions. Default is None (get_input_sql_agent_embedder).
+
+    Returns:
+        knowledge_base (DocumentKnowledgeBase): The knowledge base for the sql_input_agent.
+        vctdb_credentials (dict): Database credentials used to connect to the vector database. 
+                                  The keys are: user, password, host, port, database.
+    """
+    if debug_mode: print('getting database credentials')
+    vctdb_credentials:dict = get_db_credentials(database_name=database_name)
+
+    if debug_mode: print('attaching to existing pgvector knowledge base for sql_input_agent')
+    knowledge_base = DocumentKnowledgeBase(documents=[], vector_db=get_input_sql_agent_vector_db(vctdb_credentials=vctdb_credentials,
+                                                                                                 embedder=embedder))
+
+    return knowledge_base, vctdb_credentials
+
+def get_input_sql_agent_vector_db(vctdb_credentials:dict,embedder:Embedder = None) -> PgVector:
+    """
+    Build the PgVector database which stores the sql_input_agent's knowledge base.
+
+    Parameters:
+        vctdb_credentials (dict): Database credentials used to connect to the vector database.
+        embedder (Embedder): The embedder of the documents and questions. Default is None (get_input_sql_agent_embedder).
+
+    Returns:
+        PgVector: The vector database.
+    """
+    return PgVector(
+        table_name="unique_values",
+        db_url = f"postgresql://{vctdb_credentials['user']}:{vctdb_credentials['password']}@{vctdb_credentials['host']}:{vctdb_credentials['port']}/{vctdb_credentials['database']}",
+        embedder=embedder if embedder is not None else get_input_sql_agent_embedder(),
+    )
+
+def get_input_sql_agent_retriever(knowledge_base:DocumentKnowledgeBase,columns:List[str],dtype_dict:dict,top_k:int = 5) -> Callable:
+    """
+    Build the retriever of the sql_input_agent, which replaces a single search of the whole knowledge base with a search of each
+    column's value documents for its top_k values most relevant to the question. The references added to the agent's prompt are the
+    schema and at most top_k values per column, so their size stays the same however many unique values the columns have.
+
+    The question is embedded once, the embedder's cache serves it to the search of every other column.
+
+    Parameters:
+        knowledge_base (DocumentKnowledgeBase): The knowledge base built by build_input_sql_agent_knowledge_base.
+        columns (List[str]): The columns whose values are searched.
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types, used for the schema document.
+        top_k (int): The number of values returned for each column. Default is 5.
+
+    Returns:
+        Callable: The retriever, used as the agent's retriever (i.e. Agent(retriever=...)).
+    """
+    schema_document = get_schema_document(dtype_dict=dtype_dict).to_dict()
+
+    def retriever(query:str,num_documents:Optional[int] = None,**kwargs) -> Optional[List[dict]]:
+        documents = [schema_document]
+        for column in columns:
+            try:
+                documents += [document.to_dict() for document in knowledge_base.search(query=query,
+                                                                                        num_documents=num_documents or top_k,
+                                                                                        filters={'column': column})]
+            except Exception as e:
+                print(f"Error searching the {column} values of the knowledge base: {e}")
+        return documents
+
+    return retriever
+
+def get_document_hash(document:Document) -> str:
+    """
+    Hash the content of a document the same way PgVector does when it stores the document's content_hash.
+
+    Parameters:
+        document (Document): The document to hash.
+
+    Returns:
+        str: The md5 hex digest of the document's content.
+    """
+    return md5(document.content.replace("\x00", "\ufffd").encode()).hexdigest()
+
+def sync_knowledge_base(knowledge_base:DocumentKnowledgeBase,documents:List[Document],debug_mode:bool = False) -> dict:
+    """
+    Synchronise the knowledge base's vector database with a list of documents without recreating it.
+
+    The content hash of each document is compared against the content hashes stored alongside the vectors. Only documents
+    whose hash isn't stored are embedded and inserted, and stored vectors whose hash no longer matches a document are deleted.
+    When the documents haven't changed no embeddings are requested.
+
+    Parameters:
+        knowledge_base (DocumentKnowledgeBase): The knowledge base backed by a PgVector database.
+        documents (List[Document]): The documents the knowledge base should contain.
+        debug_mode (bool): If True, print debug information.
+
+    Returns:
+        sync_stats (dict): The number of documents inserted, deleted and unchanged with the keys: inserted, deleted, unchanged.
+    """
+    vector_db:PgVector = knowledge_base.vector_db
+
+    #create the vector table if this is the first load
+    vector_db.create()
+
+    #hashes of the documents the knowledge base should contain
+    documents_by_hash = {get_document_hash(document): document for document in documents}
+
+    #hashes of the documents already embedded in the vector database
+    with vector_db.Session() as session:
+        stored_hashes = set(session.execute(select(vector_db.table.c.content_hash)).scalars().all())
 
+    new_documents = [document for content_hash, document in documents_by_hash.items() if content_hash not in stored_hashes]
+    stale_hashes = stored_hashes - set(documents_by_hash.keys())
 
+    #delete vectors of documents which no longer exist or whose content changed
+    if stale_hashes:
+        if debug_mode: print(f'deleting {len(stale_hashes)} stale documents from sql_input_agent knowledge base')
+        with vector_db.Session() as session:
+            session.execute(delete(vector_db.table).where(vector_db.table.c.content_hash.in_(stale_hashes)))
+            session.commit()
 
+    #embed and insert only new or changed documents, in batches of documents with the same meta_data
+    if new_documents:
+        if debug_mode: print(f'embedding {len(new_documents)} new documents for sql_input_agent knowledge base')
+        batches = {}
+        for document in new_documents:
+            batches.setdefault(json.dumps(document.meta_data, sort_keys=True), []).append(document)
+        for batch in batches.values():
+            vector_db.insert(documents=batch, filters=batch[0].meta_data)
 
+    sync_stats = {'inserted': len(new_documents),
+                  'deleted': len(stale_hashes),
+                  'unchanged': len(documents_by_hash) - len(new_documents)}
+    if debug_mode: print(f'sql_input_agent knowledge base synchronised: {sync_stats}')
+    return sync_stats
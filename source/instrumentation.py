@@ -0,0 +1,289 @@
+from contextlib import nullcontext
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, List, Optional
+import time
+
+#the trace of the query running in the current thread (or in the thread which started the current worker thread)
+_current_trace:ContextVar = ContextVar('query_trace', default=None)
+
+#callbacks called with the metrics of every finished query
+_metrics_hooks:List[Callable] = []
+_metrics_hooks_lock = Lock()
+
+#returned by measure_stage when no query is traced, so disabled instrumentation only costs a context variable lookup
+_no_measurement = nullcontext()
+
+class query_trace:
+    """
+    Collects the metrics of one user query as it runs through the workflow: the wall time of each stage, the number of attempts,
+    the tokens used by the agents, the rows returned and time spent by the database and the cache hits.
+
+    A trace is shared by every thread working on the query (i.e. the speculative candidates) so it is updated under a lock.
+    """
+    def __init__(self, user_query:str):
+        """
+        Initializes the query_trace.
+
+        Parameters:
+            user_query (str): The user's natural language question.
+        """
+        self.user_query = user_query
+        self.lock = Lock()
+        self.started = time.perf_counter()
+        #offset used to convert perf_counter times to epoch nanoseconds for exporters
+        self.epoch_offset_ns = time.time_ns() - int(self.started * 1e9)
+        self.finished:Optional[float] = None
+        #every measured stage as (stage, start, end) in perf_counter seconds
+        self.spans:List[tuple] = []
+        self.attempts = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.db_queries = 0
+        self.rows_returned = 0
+        self.cache_hits:dict = {}
+
+    def add_span(self, stage:str, started:float, ended:float) -> None:
+        """Record one run of a stage."""
+        with self.lock:
+            self.spans.append((stage, started, ended))
+
+    def add_attempt(self) -> None:
+        """Count an attempt of the workflow (a speculative attempt counts once however many candidates it generates)."""
+        with self.lock:
+            self.attempts += 1
+
+    def add_agent_metrics(self, metrics:Optional[dict]) -> None:
+        """
+        Add the tokens used by an agent run.
+
+        Parameters:
+            metrics (dict): The metrics of an Agno RunResponse, which map input_tokens and output_tokens to the tokens of each model call.
+        """
+        if not metrics:
+            return
+        with self.lock:
+            self.input_tokens += sum(metrics.get('input_tokens') or [])
+            self.output_tokens += sum(metrics.get('output_tokens') or [])
+
+    def add_db_query(self, rows_returned:int) -> None:
+        """Count a query run on the database and the number of rows it returned."""
+        with self.lock:
+            self.db_queries += 1
+            self.rows_returned += rows_returned
+
+    def add_cache_hit(self, cache_name:str) -> None:
+        """Count a hit of one of the workflow's caches (keyword_cache, fast_path_planner, result_cache or rollup)."""
+        with self.lock:
+            self.cache_hits[cache_name] = self.cache_hits.get(cache_name, 0) + 1
+
+    def finish(self) -> None:
+        """Mark the query as finished."""
+        self.finished = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        """
+        Get the metrics of the query.
+
+        Returns:
+            dict: The metrics with the keys:
+                - total_seconds: The wall time of the query.
+                - attempts: The number of attempts of the workflow.
+                - stages: The stage names (entity_resolution, prompt_build, input_agent, sql_build, validation, db_execution and output_agent) mapped to the
+                          total seconds spent in them. In the 'agent' execution mode db_execution runs inside output_agent and speculative
+                          candidates run in parallel, so the stages can add up to more than total_seconds.
+                - input_tokens: The prompt tokens used by the agents.
+                - output_tokens: The completion tokens used by the agents.
+                - db_queries: The number of SQL queries which ran without an error (including result cache hits).
+                - rows_returned: The number of rows returned by the SQL queries.
+                - cache_hits: The cache names mapped to their number of hits.
+        """
+        with self.lock:
+            finished = self.finished if self.finished is not None else time.perf_counter()
+            stages:dict = {}
+            for stage, started, ended in self.spans:
+                stages[stage] = stages.get(stage, 0) + ended - started
+            return {'total_seconds': round(finished - self.started, 6),
+                    'attempts': self.attempts,
+                    'stages': {stage: round(seconds, 6) for stage, seconds in stages.items()},
+                    'input_tokens': self.input_tokens,
+                    'output_tokens': self.output_tokens,
+                    'db_queries': self.db_queries,
+                    'rows_returned': self.rows_returned,
+                    'cache_hits': dict(self.cache_hits)}
+
+class _stage_measurement:
+    """Context manager which records the wall time of a block as a stage of a trace."""
+    __slots__ = ('trace', 'stage', 'started')
+
+    def __init__(self, trace:query_trace, stage:str):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.trace.add_span(self.stage, self.started, time.perf_counter())
+        return False
+
+def get_current_trace() -> Optional[query_trace]:
+    """
+    Get the trace of the query running in the current thread.
+
+    Returns:
+        query_trace: The trace or None if the query isn't traced.
+    """
+    return _current_trace.get()
+
+def measure_stage(stage:str):
+    """
+    Measure the wall time of a block as a stage of the current query's trace. When the query isn't traced nothing is recorded.
+
+    Parameters:
+        stage (str): The name of the stage (i.e. input_agent).
+
+    Returns:
+        A context manager which times the block.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _no_measurement
+    return _stage_measurement(trace, stage)
+
+def record_attempt() -> None:
+    """Count an attempt of the workflow in the current query's trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_attempt()
+
+def record_cache_hit(cache_name:str) -> None:
+    """Count a cache hit in the current query's trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_cache_hit(cache_name)
+
+def record_agent_metrics(agent_response) -> None:
+    """Add the tokens used by an agent run (an Agno RunResponse) to the current query's trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_agent_metrics(getattr(agent_response, 'metrics', None))
+
+def record_db_query(rows_returned:int) -> None:
+    """Count a SQL query and the rows it returned in the current query's trace."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_db_query(rows_returned)
+
+def is_tracing_enabled(collect_metrics:bool=False) -> bool:
+    """
+    Check if queries should be traced: either the caller asked for the metrics or a metrics hook is registered.
+
+    Parameters:
+        collect_metrics (bool): If True, the caller adds the metrics to the results. Default is False.
+
+    Returns:
+        bool: True if queries should be traced.
+    """
+    return collect_metrics or bool(_metrics_hooks)
+
+def start_trace(user_query:str):
+    """
+    Start tracing a query in the current thread.
+
+    Parameters:
+        user_query (str): The user's natural language question.
+
+    Returns:
+        tuple: The query_trace and the token used by end_trace to restore the previous trace.
+    """
+    trace = query_trace(user_query)
+    return trace, _current_trace.set(trace)
+
+def end_trace(trace:query_trace, token, response:dict) -> dict:
+    """
+    Finish tracing a query and call every metrics hook with its metrics.
+
+    Parameters:
+        trace (query_trace): The trace returned by start_trace.
+        token: The token returned by start_trace.
+        response (dict): The query's sql_output_agent_response.
+
+    Returns:
+        dict: The metrics of the query (see query_trace.to_dict).
+    """
+    trace.finish()
+    _current_trace.reset(token)
+    metrics = trace.to_dict()
+    with _metrics_hooks_lock:
+        hooks = list(_metrics_hooks)
+    for hook in hooks:
+        try:
+            hook(trace, response, metrics)
+        except Exception as e:
+            print(f"Error in metrics hook: {e}")
+    return metrics
+
+def add_metrics_hook(hook:Callable) -> None:
+    """
+    Register a callback called when each query finishes. While a hook is registered every query is traced.
+
+    Parameters:
+        hook (Callable): Called with the query_trace, the sql_output_agent_response dictionary and the query's metrics dictionary
+                         (see query_trace.to_dict). It is called from the thread which ran the query and its errors are printed and ignored.
+    """
+    with _metrics_hooks_lock:
+        _metrics_hooks.append(hook)
+
+def remove_metrics_hook(hook:Callable) -> None:
+    """
+    Unregister a callback registered with add_metrics_hook.
+
+    Parameters:
+        hook (Callable): The callback to remove.
+    """
+    with _metrics_hooks_lock:
+        if hook in _metrics_hooks:
+            _metrics_hooks.remove(hook)
+
+class opentelemetry_exporter:
+    """
+    A metrics hook which exports each query as an OpenTelemetry span with a child span for each measured stage. The query's metrics
+    are added to the query span as attributes.
+
+    Requires the opentelemetry-api package (and an SDK with an exporter configured to send the spans anywhere).
+    """
+    def __init__(self, tracer=None, span_name:str='sql_agent_query'):
+        """
+        Initializes the opentelemetry_exporter.
+
+        Parameters:
+            tracer (opentelemetry.trace.Tracer): The tracer used to create the spans. Default is None (the global tracer provider's tracer).
+            span_name (str): The name of each query's span. Default is 'sql_agent_query'.
+        """
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError as e:
+            raise ImportError("The opentelemetry_exporter requires the opentelemetry-api package") from e
+        self.otel_trace = otel_trace
+        self.tracer = tracer if tracer is not None else otel_trace.get_tracer(__name__)
+        self.span_name = span_name
+
+    def __call__(self, trace:query_trace, response:dict, metrics:dict) -> None:
+        """Export a finished query's trace as spans."""
+        to_epoch_ns = lambda seconds: trace.epoch_offset_ns + int(seconds * 1e9)
+        query_span = self.tracer.start_span(self.span_name, start_time=to_epoch_ns(trace.started))
+        query_span.set_attributes({'sql_agents.user_query': trace.user_query,
+                                   'sql_agents.sql_query': response.get('sql_query', ''),
+                                   'sql_agents.error': bool(response.get('error', False)),
+                                   'sql_agents.attempts': metrics['attempts'],
+                                   'sql_agents.input_tokens': metrics['input_tokens'],
+                                   'sql_agents.output_tokens': metrics['output_tokens'],
+                                   'sql_agents.db_queries': metrics['db_queries'],
+                                   'sql_agents.rows_returned': metrics['rows_returned'],
+                                   **{f'sql_agents.cache_hits.{name}': hits for name, hits in metrics['cache_hits'].items()}})
+        context = self.otel_trace.set_span_in_context(query_span)
+        for stage, started, ended in trace.spans:
+            self.tracer.start_span(stage, context=context, start_time=to_epoch_ns(started)).end(end_time=to_epoch_ns(ended))
+        query_span.end(end_time=to_epoch_ns(trace.finished))
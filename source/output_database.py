@@ -1,20 +1,35 @@
 
 from pandas import DataFrame
-from .helper_functions import get_db_credentials, load_db_table
+from typing import Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import create_engine, text
+from .helper_functions import get_db_credentials, load_db_table, stream_db_table, get_db_connection_string
+from .caching import set_table_version, get_data_version, data_version_builder
 
-def build_output_sql_agent_database(dtype_dict:dict, database_name:str,table_name:str,new_data:DataFrame,debug_mode:bool=False) -> dict:
+def build_output_sql_agent_database(dtype_dict:dict, database_name:str,table_name:str,new_data:DataFrame,debug_mode:bool=False,
+                                    load_mode:str='swap',key_columns:List[str]=None,rollup_columns:List[str]=None,
+                                    index_columns:List[str]=None,trigram_columns:List[str]=None) -> dict:
     """
     Update the database with the new data.
-    This function automatically drops exsisting tables in the database and creates a new table with the new data.
+    This function automatically replaces exsisting tables in the database with a new table containing the new data, or with
+    load_mode='delta' applies only the rows which changed. The table is never missing or empty while it is reloaded.
     It uses the provided dtype_dict to define the data types of the columns in the new table.
+    With rollup_columns, rollup tables holding the count, sum, avg, min and max of each numeric column per value of each rollup
+    column are rebuilt with the table, so the sql_toolkit can answer aggregate queries from them (see source/rollups.py).
+    The table is loaded with B-tree indexes on index_columns, trigram indexes on trigram_columns and up to date planner statistics.
+    After the table is reloaded its data version is updated so caches keyed on the table's content are invalidated.
 
     Parameters:
         dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
         database_name (str): Database name in .env file. This value is the prefix for the environment variable (i.e. abcd_USER).
-        table_name (str): Name of the table to be updated in the database. This table will be dropped and recreated with the new 
+        table_name (str): Name of the table to be updated in the database. This table will be replaced by a table with the new
                           data or if it doesn't exist it will be created with the new data.
         new_data (pd.DataFrame): DataFrame containing the new data to be loaded into the database.
         debug_mode (bool): If True, print debug information.
+        load_mode (str): The load mode, either 'swap' or 'delta' (see load_db_table). Default is 'swap'.
+        key_columns (List[str]): The columns which uniquely identify a row. Required for the delta load mode.
+        rollup_columns (List[str]): The columns the rollup tables are grouped by (i.e. ['country', 'continent']). Default is None (no rollups).
+        index_columns (List[str]): The columns given a B-tree index (i.e. ['country', 'continent']). Default is None.
+        trigram_columns (List[str]): The columns given a pg_trgm trigram index for LIKE '%...%' filters (i.e. ['name']). Default is None.
 
     Returns:
         db_credentials(dict): Database credentials used to connect to the database. The keys are: user, password, host, port, database.
@@ -25,7 +40,131 @@ def build_output_sql_agent_database(dtype_dict:dict, database_name:str,table_nam
 
     #reloading the table in the database with the new resort traits data
     if debug_mode:print('updating database table with resort traits data')
-    load_db_table(db_credentials=db_credentials,data=new_data,dtype_dict=dtype_dict,table_name=table_name)
-    
+    load_stats = load_db_table(db_credentials=db_credentials,data=new_data,dtype_dict=dtype_dict,table_name=table_name,
+                               mode=load_mode,key_columns=key_columns,rollup_columns=rollup_columns,
+                               index_columns=index_columns,trigram_columns=trigram_columns)
+    if load_stats is None:
+        return db_credentials
+    if debug_mode:print(f"loaded {load_stats['rows']} rows at {load_stats['rows_per_second']:.0f} rows/sec, "
+                        f"swap downtime {load_stats['swap_downtime_seconds'] * 1000:.1f} ms")
+    if debug_mode and load_stats['rollups']:print(f"rebuilt rollup tables {load_stats['rollups']}")
+    if debug_mode and load_stats['indexes']:print(f"indexed columns {load_stats['indexes']}")
+
+    #updating the table's data version to invalidate cached queries and results
+    version = get_data_version(data=new_data,dtype_dict=dtype_dict)
+    set_table_version(table_name=table_name,version=version)
+    record_table_version(db_credentials=db_credentials,table_name=table_name,version=version)
+
+    return db_credentials
+
+def stream_output_sql_agent_database(dtype_dict:dict,database_name:str,table_name:str,chunks:Iterable[DataFrame],
+                                     debug_mode:bool=False,rollup_columns:List[str]=None,index_columns:List[str]=None,
+                                     trigram_columns:List[str]=None) -> Tuple[dict, Optional[dict]]:
+    """
+    Replace the database table with data which arrives in chunks (see stream_resort_traits_data). Each chunk is copied into the
+    database as soon as it arrives, so memory use is bounded by the chunk size rather than the size of the data. The table is
+    never missing or empty while it is reloaded, its rollup tables are rebuilt with it and its data version is updated once every
+    chunk is loaded.
+
+    Parameters:
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+        database_name (str): Database name in .env file. This value is the prefix for the environment variable (i.e. abcd_USER).
+        table_name (str): Name of the table to be replaced in the database.
+        chunks (Iterable[pd.DataFrame]): The chunks of the new data.
+        debug_mode (bool): If True, print debug information.
+        rollup_columns (List[str]): The columns the rollup tables are grouped by (see build_output_sql_agent_database). Default is None.
+        index_columns (List[str]): The columns given a B-tree index. Default is None.
+        trigram_columns (List[str]): The columns given a pg_trgm trigram index. Default is None.
+
+    Returns:
+        db_credentials(dict): Database credentials used to connect to the database. The keys are: user, password, host, port, database.
+        load_stats (dict): Statistics of the load with the keys: mode, rows, chunks, copy_seconds, rows_per_second, swap_downtime_seconds,
+                           peak_rss_mb, inserted, updated, deleted, rollups, indexes (see stream_db_table). None if the load failed.
+    """
+    if debug_mode:print('getting database credentials')
+    db_credentials = get_db_credentials(database_name=database_name)
+
+    #the data version is built from each chunk as it passes through to the database
+    version_builder = data_version_builder(dtype_dict=dtype_dict)
+    def versioned_chunks() -> Iterator[DataFrame]:
+        for chunk in chunks:
+            version_builder.update(data=chunk)
+            yield chunk
+
+    if debug_mode:print('streaming resort traits data into database table')
+    load_stats = stream_db_table(db_credentials=db_credentials,chunks=versioned_chunks(),dtype_dict=dtype_dict,table_name=table_name,
+                                 rollup_columns=rollup_columns,index_columns=index_columns,trigram_columns=trigram_columns)
+    if load_stats is None:
+        return db_credentials, None
+    if debug_mode:print(f"loaded {load_stats['rows']} rows in {load_stats['chunks']} chunks at {load_stats['rows_per_second']:.0f} rows/sec, "
+                        f"peak rss {load_stats['peak_rss_mb']} MB")
+
+    #updating the table's data version to invalidate cached queries and results
+    version = version_builder.get_version()
+    set_table_version(table_name=table_name,version=version)
+    record_table_version(db_credentials=db_credentials,table_name=table_name,version=version)
+
+    return db_credentials, load_stats
+
+def connect_output_sql_agent_database(database_name:str,table_name:str,debug_mode:bool=False) -> dict:
+    """
+    Connect to the sql_output_agent's already populated database without reloading the table. The table's data version
+    recorded by build_output_sql_agent_database is restored so versioned caches stay valid.
+
+    Parameters:
+        database_name (str): Database name in .env file. This value is the prefix for the environment variable (i.e. abcd_USER).
+        table_name (str): Name of the table in the database.
+        debug_mode (bool): If True, print debug information.
+
+    Returns:
+        db_credentials(dict): Database credentials used to connect to the database. The keys are: user, password, host, port, database.
+    """
+    if debug_mode:print('getting database credentials')
+    db_credentials = get_db_credentials(database_name=database_name)
+
+    if debug_mode:print('reading data version of database table')
+    version = read_table_version(db_credentials=db_credentials,table_name=table_name)
+    if version is not None:
+        set_table_version(table_name=table_name,version=version)
+
     return db_credentials
-    
\ No newline at end of file
+
+def record_table_version(db_credentials:dict,table_name:str,version:str) -> None:
+    """
+    Store a table's data version as the table's comment so processes which attach to the database later can read it.
+
+    Parameters:
+        db_credentials (dict): Dictionary containing the database credentials.
+        table_name (str): Name of the table in the database.
+        version (str): The data version of the table.
+    """
+    try:
+        engine = create_engine(get_db_connection_string(db_credentials))
+        with engine.begin() as connection:
+            connection.execute(text(f'COMMENT ON TABLE "{table_name}" IS \'data_version:{version}\''))
+        engine.dispose()
+    except Exception as e:
+        print(f"Error recording table version: {e}")
+
+def read_table_version(db_credentials:dict,table_name:str) -> str:
+    """
+    Read the data version stored as a table's comment by record_table_version.
+
+    Parameters:
+        db_credentials (dict): Dictionary containing the database credentials.
+        table_name (str): Name of the table in the database.
+
+    Returns:
+        str: The data version of the table or None if it wasn't recorded.
+    """
+    try:
+        engine = create_engine(get_db_connection_string(db_credentials))
+        with engine.connect() as connection:
+            comment = connection.execute(text("SELECT obj_description(to_regclass(:table_name), 'pg_class')"),
+                                         {'table_name': f'"{table_name}"'}).scalar()
+        engine.dispose()
+        if comment is not None and comment.startswith('data_version:'):
+            return comment[len('data_version:'):]
+    except Exception as e:
+        print(f"Error reading table version: {e}")
+    return None
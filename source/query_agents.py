@@ -1,9 +1,21 @@
 from agno.agent import Agent
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
 from .helper_functions import build_sql_query
 import json
+import time
+from queue import SimpleQueue, Empty
+from threading import Thread, Event
+from contextvars import copy_context
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 from agno.agent import RunResponse
 from .agent_output_models import sql_output_agent_response_model
+from .caching import sql_keyword_cache
+from .fast_path_planner import sql_fast_path_planner
+from .entity_resolution import sql_entity_resolver
+from .sql_validation import sql_query_validator
+from .sql_toolkit import sql_toolkit, get_db_error_message
+from .instrumentation import (measure_stage, is_tracing_enabled, start_trace, end_trace, record_attempt, record_cache_hit,
+                              record_agent_metrics)
 
 
 def query_sql_agents(queries:list,
@@ -11,55 +23,403 @@ def query_sql_agents(queries:list,
                      output_agent:Agent,
                      max_number_attempts:int=3,
                      print_response:bool = False,
-                     print_progess:bool=False) -> list:
+                     print_progess:bool=False,
+                     max_workers:int=1,
+                     query_timeout:Optional[float]=None,
+                     keyword_cache:Optional[sql_keyword_cache]=None,
+                     fast_path_planner:Optional[sql_fast_path_planner]=None,
+                     sql_validator:Optional[sql_query_validator]=None,
+                     num_candidates:int=1,
+                     execution_mode:str='agent',
+                     toolkit:Optional[sql_toolkit]=None,
+                     collect_metrics:bool=False,
+                     entity_resolver:Optional[sql_entity_resolver]=None) -> list:
     """
     Function to run a list of queries through the sql_input_agent and sql_output_agent.
 
+    When max_workers is greater than 1 or a query_timeout is set the queries are run concurrently (see run_queries_concurrently).
+    Otherwise they are run one after another.
+
     Parameters:
         input_agent(Agno.Agent): The agent responsible for processing the input queries.
         output_agent(Agno.Agent): The agent responsible for generating the SQL queries and processing the output.
         max_number_attempts (int): The maximum number of attempts to run the agents. Default is 3.
         print_response (bool): Whether to print the queries and responses. Default is False.
         print_progress (bool): Whether to print the messages outlining the progress of the agents. Default is False.
+        max_workers (int): The maximum number of queries run at the same time. Default is 1.
+        query_timeout (float): The maximum number of seconds a single query (including its retries) may run for. Default is None (no timeout).
+        keyword_cache (sql_keyword_cache): A cache of the sql_input_agent's keywords for previously answered questions. Default is None (no cache).
+        fast_path_planner (sql_fast_path_planner): A local planner which builds the SQL keywords for common question shapes without
+                                                   calling the sql_input_agent. Default is None (always use the sql_input_agent).
+        sql_validator (sql_query_validator): Checks each SQL query before it is given to the sql_output_agent. Invalid queries are sent
+                                             back to the sql_input_agent with the error without calling the sql_output_agent.
+                                             Default is None (no validation).
+        num_candidates (int): The number of SQL query candidates generated at the same time on each retry (see run_speculative_attempt).
+                              Default is 1 (retries generate one query at a time).
+        execution_mode (str): How the SQL queries are executed (see run_sql_agent_workflow), either:
+                              - 'agent': The output_agent runs each query with its sql_toolkit and summarises the rows. 
+                              - 'direct': Each query is run with toolkit and output_agent (use the sql_summary_agent) only summarises the rows.
+                              Default is 'agent'.
+        toolkit (sql_toolkit): The toolkit used to run the SQL queries in the 'direct' execution mode. Default is None.
+        collect_metrics (bool): If True, each result has a 'metrics' key with the query's stage timings, attempts, tokens, rows returned,
+                                database queries and cache hits (see source/instrumentation.py). Default is False.
+        entity_resolver (sql_entity_resolver): Resolves the countries, continents and resort names mentioned in each question to the values
+                                               stored in the database, which are added to the sql_input_agent's input as 'entities'.
+                                               Default is None.
         
     Returns:
         results(list(dict)): A list of results from the sql_output_agent where each query result is a list element in the form of the
-                 sql_output_agent_response dictionary.
+                 sql_output_agent_response dictionary. Results are in the same order as the queries.
     """
+    if execution_mode not in ('agent', 'direct'):
+        raise ValueError(f"Invalid execution mode '{execution_mode}', expected 'agent' or 'direct'")
+    if execution_mode == 'direct' and toolkit is None:
+        raise ValueError("A toolkit is required for the 'direct' execution mode")
+
+    if max_workers > 1 or query_timeout is not None:
+        results = run_queries_concurrently(queries=queries,
+                                           input_agent=input_agent,
+                                           output_agent=output_agent,
+                                           max_number_attempts=max_number_attempts,
+                                           max_workers=max_workers,
+                                           query_timeout=query_timeout,
+                                           keyword_cache=keyword_cache,
+                                           fast_path_planner=fast_path_planner,
+                                           sql_validator=sql_validator,
+                                           num_candidates=num_candidates,
+                                           execution_mode=execution_mode,
+                                           toolkit=toolkit,
+                                           collect_metrics=collect_metrics,
+                                           entity_resolver=entity_resolver,
+                                           print_progess=print_progess)
+        if print_response:
+            for sql_output_agent_response in results:
+                print_sql_output_agent_response(sql_output_agent_response)
+        return results
+
     results = []
     for user_query in queries:
-        #running the sql_input_agent and sql_output_agent workflow for user query
-        if print_progess: print(f"Running query: {user_query}")
-        sql_output_agent_response:dict = run_sql_agent_workflow(user_query=user_query,
-                               input_agent=input_agent,
-                               output_agent=output_agent,
-                               print_progess=print_progess)
-
-        # check if the sql_output_agent's response contains an error
-        if sql_output_agent_response['error'] == True:
-            if print_progess: 
-                print(f"Incorrect query: {sql_output_agent_response['sql_query']}") 
-                print("Attempting to generate a new SQL query.")
-            sql_output_agent_response:dict = run_new_attempts(user_query=user_query,
-                                                         previous_sql_queries=[sql_output_agent_response['sql_query']],
-                                                         input_agent=input_agent,
-                                                         output_agent=output_agent,
-                                                         max_number_attempts=max_number_attempts,
-                                                         print_progess=print_progess)
+        sql_output_agent_response:dict = run_query(user_query=user_query,
+                                                   input_agent=input_agent,
+                                                   output_agent=output_agent,
+                                                   max_number_attempts=max_number_attempts,
+                                                   keyword_cache=keyword_cache,
+                                                   fast_path_planner=fast_path_planner,
+                                                   sql_validator=sql_validator,
+                                                   num_candidates=num_candidates,
+                                                   execution_mode=execution_mode,
+                                                   toolkit=toolkit,
+                                                   collect_metrics=collect_metrics,
+                                                   entity_resolver=entity_resolver,
+                                                   print_progess=print_progess)
             
         # add output of sql_output_agent to results
         results.append(sql_output_agent_response)
 
         #print the results of the most recent query
         if print_response:
-            print(f"User Query: {sql_output_agent_response['user_query']}\n")
-            print(f"SQL Query: {sql_output_agent_response['sql_query']}\n")
-            print(f"Response: {sql_output_agent_response['response_text']}\n")
-            print("\n")
+            print_sql_output_agent_response(sql_output_agent_response)
+
+    return results
+
+def print_sql_output_agent_response(sql_output_agent_response:dict) -> None:
+    """
+    Print the user query, SQL query and response text of a sql_output_agent response.
+
+    Parameters:
+        sql_output_agent_response (dict): The response from the sql_output_agent.
+    """
+    print(f"User Query: {sql_output_agent_response['user_query']}\n")
+    print(f"SQL Query: {sql_output_agent_response['sql_query']}\n")
+    print(f"Response: {sql_output_agent_response['response_text']}\n")
+    print("\n")
+
+def run_query(user_query:str,input_agent:Agent,output_agent:Agent,max_number_attempts:int=3,keyword_cache:Optional[sql_keyword_cache]=None,
+              fast_path_planner:Optional[sql_fast_path_planner]=None,sql_validator:Optional[sql_query_validator]=None,
+              num_candidates:int=1,execution_mode:str='agent',toolkit:Optional[sql_toolkit]=None,collect_metrics:bool=False,
+              entity_resolver:Optional[sql_entity_resolver]=None,print_progess:bool=False) -> dict:
+    """
+    Run a single user query through the sql_input_agent and sql_output_agent workflow, retrying with new SQL queries
+    (see run_new_attempts) if the first attempt contains an error.
+
+    The query is traced when collect_metrics is True or a metrics hook is registered (see add_metrics_hook in source/instrumentation.py).
+
+    Parameters:
+        user_query (str): The user's query to be processed by the agents.
+        input_agent(Agno.Agent): The agent responsible for building the SQL queries.
+        output_agent(Agno.Agent): The agent responsible for executing the SQL queries and processing the output.
+        max_number_attempts (int): The maximum number of attempts to run the agents. Default is 3.
+        keyword_cache (sql_keyword_cache): A cache of the sql_input_agent's keywords for previously answered questions. Default is None.
+        fast_path_planner (sql_fast_path_planner): A local planner used instead of the sql_input_agent on the first attempt. Default is None.
+        sql_validator (sql_query_validator): Checks each SQL query before it is given to the sql_output_agent. Default is None.
+        num_candidates (int): The number of SQL query candidates generated at the same time on each retry. Default is 1.
+        execution_mode (str): How the SQL queries are executed, either 'agent' or 'direct' (see run_sql_agent_workflow). Default is 'agent'.
+        toolkit (sql_toolkit): The toolkit used to run the SQL queries in the 'direct' execution mode. Default is None.
+        collect_metrics (bool): If True, the response has a 'metrics' key with the query's metrics. Default is False.
+        entity_resolver (sql_entity_resolver): Resolves the places and resorts mentioned in the question for the sql_input_agent. Default is None.
+        print_progess (bool): Whether to print the messages outlining the progress of the agents. Default is False.
+
+    Returns:
+        sql_output_agent_response (dict): The final response from the sql_output_agent.
+    """
+    #tracing is skipped entirely unless the metrics are used
+    trace = None
+    if is_tracing_enabled(collect_metrics=collect_metrics):
+        trace, trace_token = start_trace(user_query)
+    try:
+        sql_output_agent_response:dict = run_query_attempts(user_query=user_query,
+                                                            input_agent=input_agent,
+                                                            output_agent=output_agent,
+                                                            max_number_attempts=max_number_attempts,
+                                                            keyword_cache=keyword_cache,
+                                                            fast_path_planner=fast_path_planner,
+                                                            sql_validator=sql_validator,
+                                                            num_candidates=num_candidates,
+                                                            execution_mode=execution_mode,
+                                                            toolkit=toolkit,
+                                                            entity_resolver=entity_resolver,
+                                                            print_progess=print_progess)
+    except Exception as e:
+        if trace is not None:
+            end_trace(trace, trace_token, build_error_response(user_query=user_query, response_text=f"Error running query: {e}"))
+        raise
+
+    if trace is not None:
+        metrics:dict = end_trace(trace, trace_token, sql_output_agent_response)
+        if collect_metrics:
+            sql_output_agent_response['metrics'] = metrics
+    return sql_output_agent_response
+
+def run_query_attempts(user_query:str,input_agent:Agent,output_agent:Agent,max_number_attempts:int=3,keyword_cache:Optional[sql_keyword_cache]=None,
+                       fast_path_planner:Optional[sql_fast_path_planner]=None,sql_validator:Optional[sql_query_validator]=None,
+                       num_candidates:int=1,execution_mode:str='agent',toolkit:Optional[sql_toolkit]=None,
+                       entity_resolver:Optional[sql_entity_resolver]=None,print_progess:bool=False) -> dict:
+    """
+    Run the first attempt of the workflow for a user query and, if it contains an error, the retries (see run_new_attempts).
+    The parameters are the same as run_query's.
+
+    Returns:
+        sql_output_agent_response (dict): The final response from the sql_output_agent.
+    """
+    #running the sql_input_agent and sql_output_agent workflow for user query
+    if print_progess: print(f"Running query: {user_query}")
+    sql_output_agent_response:dict = run_sql_agent_workflow(user_query=user_query,
+                           input_agent=input_agent,
+                           output_agent=output_agent,
+                           keyword_cache=keyword_cache,
+                           fast_path_planner=fast_path_planner,
+                           sql_validator=sql_validator,
+                           execution_mode=execution_mode,
+                           toolkit=toolkit,
+                           entity_resolver=entity_resolver,
+                           print_progess=print_progess)
+
+    # check if the sql_output_agent's response contains an error
+    if sql_output_agent_response['error'] == True:
+        if print_progess: 
+            print(f"Incorrect query: {sql_output_agent_response['sql_query']}") 
+            print("Attempting to generate a new SQL query.")
+        sql_output_agent_response:dict = run_new_attempts(user_query=user_query,
+                                                     previous_sql_queries=[sql_output_agent_response['sql_query']],
+                                                     previous_sql_errors=[sql_output_agent_response['response_text']],
+                                                     input_agent=input_agent,
+                                                     output_agent=output_agent,
+                                                     max_number_attempts=max_number_attempts,
+                                                     keyword_cache=keyword_cache,
+                                                     sql_validator=sql_validator,
+                                                     num_candidates=num_candidates,
+                                                     execution_mode=execution_mode,
+                                                     toolkit=toolkit,
+                                                     entity_resolver=entity_resolver,
+                                                     print_progess=print_progess)
+    return sql_output_agent_response
+
+def run_queries_concurrently(queries:list,
+                             input_agent:Agent,
+                             output_agent:Agent,
+                             max_number_attempts:int=3,
+                             max_workers:int=4,
+                             query_timeout:Optional[float]=None,
+                             keyword_cache:Optional[sql_keyword_cache]=None,
+                             fast_path_planner:Optional[sql_fast_path_planner]=None,
+                             sql_validator:Optional[sql_query_validator]=None,
+                             num_candidates:int=1,
+                             execution_mode:str='agent',
+                             toolkit:Optional[sql_toolkit]=None,
+                             collect_metrics:bool=False,
+                             entity_resolver:Optional[sql_entity_resolver]=None,
+                             print_progess:bool=False) -> list:
+    """
+    Run a list of queries through the sql_input_agent and sql_output_agent workflow with at most max_workers queries in flight.
+
+    Each query runs in its own worker thread with its own copy of the agents, because an Agno Agent keeps per-run state and
+    can't run two queries at the same time. Each query keeps the retry behaviour of run_query. A query that runs for longer 
+    than query_timeout is reported as an error straight away so one slow question can't stall the batch. The abandoned worker
+    finishes in the background and its result is discarded, but it keeps its worker slot until it does, so at most max_workers
+    threads (and database connections) are ever in use. If every slot is held by an abandoned worker (i.e. the model or database
+    hangs) no more queries are started until one of them finishes.
 
+    Parameters:
+        queries (list): The user queries to be processed by the agents.
+        input_agent(Agno.Agent): The agent responsible for building the SQL queries.
+        output_agent(Agno.Agent): The agent responsible for executing the SQL queries and processing the output.
+        max_number_attempts (int): The maximum number of attempts to run the agents for each query. Default is 3.
+        max_workers (int): The maximum number of queries run at the same time. Default is 4.
+        query_timeout (float): The maximum number of seconds a single query may run for. Default is None (no timeout).
+        keyword_cache (sql_keyword_cache): A cache of the sql_input_agent's keywords shared by every worker. Default is None.
+        fast_path_planner (sql_fast_path_planner): A local planner shared by every worker. Default is None.
+        sql_validator (sql_query_validator): A SQL query validator shared by every worker. Default is None.
+        num_candidates (int): The number of SQL query candidates generated at the same time on each retry. Default is 1.
+        execution_mode (str): How the SQL queries are executed, either 'agent' or 'direct' (see run_sql_agent_workflow). Default is 'agent'.
+        toolkit (sql_toolkit): The toolkit shared by every worker in the 'direct' execution mode. Default is None.
+        collect_metrics (bool): If True, each result has a 'metrics' key with the query's metrics. Default is False.
+        entity_resolver (sql_entity_resolver): An entity resolver shared by every worker. Default is None.
+        print_progess (bool): Whether to print the messages outlining the progress of the agents. Default is False.
+
+    Returns:
+        results(list(dict)): The sql_output_agent responses in the same order as the queries.
+    """
+    results:list = [None] * len(queries)
+    for index, sql_output_agent_response in iter_queries_concurrently(queries=queries,
+                                                                      input_agent=input_agent,
+                                                                      output_agent=output_agent,
+                                                                      max_number_attempts=max_number_attempts,
+                                                                      max_workers=max_workers,
+                                                                      query_timeout=query_timeout,
+                                                                      keyword_cache=keyword_cache,
+                                                                      fast_path_planner=fast_path_planner,
+                                                                      sql_validator=sql_validator,
+                                                                      num_candidates=num_candidates,
+                                                                      execution_mode=execution_mode,
+                                                                      toolkit=toolkit,
+                                                                      collect_metrics=collect_metrics,
+                                                                      entity_resolver=entity_resolver,
+                                                                      print_progess=print_progess):
+        results[index] = sql_output_agent_response
     return results
 
-def run_sql_agent_workflow(user_query:str,input_agent:Agent,output_agent:Agent,previous_sql_queries=None,print_progess:bool=False):
+def iter_queries_concurrently(queries:Iterable[str],
+                              input_agent:Agent,
+                              output_agent:Agent,
+                              max_number_attempts:int=3,
+                              max_workers:int=4,
+                              query_timeout:Optional[float]=None,
+                              keyword_cache:Optional[sql_keyword_cache]=None,
+                              fast_path_planner:Optional[sql_fast_path_planner]=None,
+                              sql_validator:Optional[sql_query_validator]=None,
+                              num_candidates:int=1,
+                              execution_mode:str='agent',
+                              toolkit:Optional[sql_toolkit]=None,
+                              collect_metrics:bool=False,
+                              entity_resolver:Optional[sql_entity_resolver]=None,
+                              print_progess:bool=False) -> Iterator[Tuple[int, dict]]:
+    """
+    Run queries as run_queries_concurrently does, but yield each result as soon as its query finishes. The queries are read from
+    the iterable only when a worker slot is free, so at most max_workers queries are held in memory however many there are.
+    The parameters are the same as run_queries_concurrently's, and a timed out query's thread keeps its worker slot until it exits
+    (see run_queries_concurrently).
+
+    Yields:
+        Tuple[int, dict]: The index of the query in queries and its sql_output_agent response, in the order the queries finish.
+    """
+    #copies of the agents which aren't being used by a running query
+    idle_agents = SimpleQueue()
+    #index of each running query mapped to its future, start time and user query
+    running:dict = {}
+    #futures of the timed out queries whose threads are still running, they hold a worker slot until they finish
+    abandoned:set = set()
+    waiting_queries = iter(enumerate(queries))
+    queries_exhausted = False
+
+    def run_in_worker(future:Future, user_query:str) -> None:
+        try:
+            worker_input_agent, worker_output_agent = idle_agents.get_nowait()
+        except Empty:
+            worker_input_agent, worker_output_agent = input_agent.deep_copy(), output_agent.deep_copy()
+        try:
+            future.set_result(run_query(user_query=user_query,
+                                        input_agent=worker_input_agent,
+                                        output_agent=worker_output_agent,
+                                        max_number_attempts=max_number_attempts,
+                                        keyword_cache=keyword_cache,
+                                        fast_path_planner=fast_path_planner,
+                                        sql_validator=sql_validator,
+                                        num_candidates=num_candidates,
+                                        execution_mode=execution_mode,
+                                        toolkit=toolkit,
+                                        collect_metrics=collect_metrics,
+                                        entity_resolver=entity_resolver,
+                                        print_progess=print_progess))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            idle_agents.put((worker_input_agent, worker_output_agent))
+
+    while True:
+        abandoned = {future for future in abandoned if not future.done()}
+        #start queries until every worker slot is in use
+        while not queries_exhausted and len(running) + len(abandoned) < max(max_workers, 1):
+            next_query = next(waiting_queries, None)
+            if next_query is None:
+                queries_exhausted = True
+                break
+            index, user_query = next_query
+            future = Future()
+            Thread(target=run_in_worker, args=(future, user_query), daemon=True).start()
+            running[index] = (future, time.monotonic(), user_query)
+        if not running:
+            if queries_exhausted:
+                return
+            #every worker slot is held by an abandoned query, wait for one of them to finish
+            if print_progess: print(f"Waiting for {len(abandoned)} timed out queries to finish before starting more queries")
+            wait(abandoned, return_when=FIRST_COMPLETED)
+            continue
+
+        #wait until a query finishes or the oldest running query reaches its timeout
+        wait_time = None
+        if query_timeout is not None:
+            oldest_start = min(started for _, started, _ in running.values())
+            wait_time = max(oldest_start + query_timeout - time.monotonic(), 0)
+        wait([future for future, _, _ in running.values()] + list(abandoned), timeout=wait_time, return_when=FIRST_COMPLETED)
+
+        for index, (future, started, user_query) in list(running.items()):
+            if future.done():
+                try:
+                    sql_output_agent_response = future.result()
+                except Exception as e:
+                    sql_output_agent_response = build_error_response(user_query=user_query,
+                                                                     response_text=f"Error running query: {e}")
+            elif query_timeout is not None and time.monotonic() - started >= query_timeout:
+                if print_progess: print(f"Query timed out after {query_timeout} seconds: {user_query}")
+                sql_output_agent_response = build_error_response(user_query=user_query,
+                                                                 response_text=f"Query timed out after {query_timeout} seconds.")
+                abandoned.add(future)
+            else:
+                continue
+            del running[index]
+            yield index, sql_output_agent_response
+
+def build_error_response(user_query:str,response_text:str,sql_query:str='') -> dict:
+    """
+    Build a response in the form of the sql_output_agent_response dictionary for a query which failed outside the agents.
+
+    Parameters:
+        user_query (str): The user's natural language question.
+        response_text (str): An explanation of the error.
+        sql_query (str): The SQL query which was being run when the error occurred. Default is an empty string.
+
+    Returns:
+        sql_output_agent_response (dict): The error response with the keys: user_query, sql_query, response_text, error.
+    """
+    return {'user_query':user_query,
+            'sql_query':sql_query,
+            'response_text':response_text,
+            'error':True}
+
+def run_sql_agent_workflow(user_query:str,input_agent:Agent,output_agent:Agent,previous_sql_queries=None,keyword_cache:Optional[sql_keyword_cache]=None,
+                           fast_path_planner:Optional[sql_fast_path_planner]=None,sql_validator:Optional[sql_query_validator]=None,
+                           previous_sql_errors=None,execution_mode:str='agent',toolkit:Optional[sql_toolkit]=None,
+                           entity_resolver:Optional[sql_entity_resolver]=None,print_progess:bool=False):
     """
     A function to run the sql_input_agent and sql_output_agent workflow.
 
@@ -68,6 +428,24 @@ def run_sql_agent_workflow(user_query:str,input_agent:Agent,output_agent:Agent,p
         input_agent(Agno.Agent): The agent responsible for processing the input queries.
         output_agent(Agno.Agent): The agent responsible for generating the SQL queries and processing the output.
         previous_sql_output_agent_response (list[str]): A list of previously atempted SQL queries generated by the sql_input_agent.
+        keyword_cache (sql_keyword_cache): A cache of the sql_input_agent's keywords for previously answered questions. It is only read on
+                                           the first attempt and only SQL queries which ran without an error are added to it. Default is None.
+        fast_path_planner (sql_fast_path_planner): A local planner which builds the keywords for common question shapes. It is only used on
+                                                   the first attempt, questions it can't plan fall through to the cache and the sql_input_agent.
+                                                   Default is None.
+        sql_validator (sql_query_validator): Checks the SQL query before it is given to the sql_output_agent. If the query is invalid
+                                             an error response is returned without calling the sql_output_agent. Default is None.
+        previous_sql_errors (list[str]): The error of each previously attempted SQL query, in the same order as previous_sql_queries.
+        execution_mode (str): How the SQL query is executed, either:
+                              - 'agent': The output_agent is given the SQL query, runs it with its sql_toolkit and summarises the rows.
+                              - 'direct': The SQL query is run with toolkit in Python and the output_agent (use the sql_summary_agent) is
+                                given the rows to summarise in a single model call. Database errors and empty results are reported
+                                without calling the output_agent (see run_direct_execution).
+                              Default is 'agent'.
+        toolkit (sql_toolkit): The toolkit used to run the SQL query in the 'direct' execution mode. Default is None.
+        entity_resolver (sql_entity_resolver): Resolves the places and resorts mentioned in the question. The values stored in the database
+                                               are added to the sql_input_agent's input so it doesn't need to search its knowledge base.
+                                               Default is None.
         print_progess (bool): Whether to print the messages outlining the progress of the agents. Default is False.
 
     Returns:
@@ -79,33 +457,94 @@ def run_sql_agent_workflow(user_query:str,input_agent:Agent,output_agent:Agent,p
         - error: A boolean indicating if an error occurred during the process.
 
     """
-    # building the sql_input_agent's query - if applicable using the previous sql_output_agent's response
-    if print_progess: print(f"Building sql_input_agent's query")
-    #sql_input_agent_query is JSON-formatted python string
-    # keys: 'user_query' and 'sql_queries'
-    sql_input_agent_query:str = build_sql_input_agent_query(user_query=user_query,
-                                                        previous_sql_queries=previous_sql_queries)
+    record_attempt()
 
-    # run the sql_input_agent
-    if print_progess: print(f"Running sql_input_agent.")
-    sql_input_agent_response:RunResponse = input_agent.run(sql_input_agent_query)
+    # plan common question shapes locally - only on the first attempt
+    keywords:dict = None
+    if fast_path_planner is not None and not previous_sql_queries:
+        keywords = fast_path_planner.plan(user_query)
+        if print_progess and keywords is not None: print(f"Using fast path planner instead of sql_input_agent.")
+    used_planned_keywords = keywords is not None
+    if used_planned_keywords: record_cache_hit('fast_path_planner')
 
-    # extracting keywords from the sql_input_agent's response
-    keywords:dict = sql_input_agent_response.content.model_dump()
+    # check the cache for the keywords of a previously answered question - only on the first attempt
+    if keywords is None and keyword_cache is not None and not previous_sql_queries:
+        keywords = keyword_cache.get(user_query)
+        if print_progess and keywords is not None: print(f"Using cached sql_input_agent response.")
+    used_cached_keywords = keywords is not None and not used_planned_keywords
+    if used_cached_keywords: record_cache_hit('keyword_cache')
+
+    if keywords is None:
+        # resolving the places and resorts mentioned in the question to the values stored in the database
+        entities:dict = None
+        if entity_resolver is not None:
+            with measure_stage('entity_resolution'):
+                entities = entity_resolver.resolve(user_query)
+
+        # building the sql_input_agent's query - if applicable using the previous sql_output_agent's response
+        if print_progess: print(f"Building sql_input_agent's query")
+        #sql_input_agent_query is JSON-formatted python string
+        # keys: 'user_query' and 'sql_queries'
+        with measure_stage('prompt_build'):
+            sql_input_agent_query:str = build_sql_input_agent_query(user_query=user_query,
+                                                                previous_sql_queries=previous_sql_queries,
+                                                                previous_sql_errors=previous_sql_errors,
+                                                                entities=entities)
+
+        # run the sql_input_agent
+        if print_progess: print(f"Running sql_input_agent.")
+        with measure_stage('input_agent'):
+            sql_input_agent_response:RunResponse = input_agent.run(sql_input_agent_query)
+        record_agent_metrics(sql_input_agent_response)
+
+        # extracting keywords from the sql_input_agent's response
+        keywords = sql_input_agent_response.content.model_dump()
 
     # build the sql query for the sql_output_agent
-    sql_query:str = user_query + '\n' + build_sql_query(keyword_dict=keywords)
+    with measure_stage('sql_build'):
+        built_sql_query:str = build_sql_query(keyword_dict=keywords)
+    sql_query:str = user_query + '\n' + built_sql_query
 
-    # run the sql_output_agent
-    if print_progess: print(f"Running sql_output_agent.")
-    sql_output_agent_response = output_agent.run(sql_query)
-    
-    # converting sql_output_agent's response into a dictionary
-    sql_output_agent_response:dict = sql_output_agent_response.content.model_dump()
+    # check the sql query locally - an invalid query goes back to the sql_input_agent without calling the sql_output_agent
+    sql_error:str = None
+    if sql_validator is not None:
+        with measure_stage('validation'):
+            sql_error = sql_validator.validate(built_sql_query)
+    if sql_error is not None:
+        if print_progess: print(f"SQL query failed validation: {sql_error}")
+        sql_output_agent_response:dict = build_error_response(user_query=user_query,
+                                                              response_text=f"Invalid SQL query: {sql_error}",
+                                                              sql_query=built_sql_query)
+    elif execution_mode == 'direct':
+        # run the sql query in python and only use the output agent to summarise the rows
+        sql_output_agent_response:dict = run_direct_execution(user_query=user_query,
+                                                              sql_query=built_sql_query,
+                                                              summary_agent=output_agent,
+                                                              toolkit=toolkit,
+                                                              print_progess=print_progess)
+    else:
+        # run the sql_output_agent
+        if print_progess: print(f"Running sql_output_agent.")
+        with measure_stage('output_agent'):
+            sql_output_agent_response = output_agent.run(sql_query)
+        record_agent_metrics(sql_output_agent_response)
+
+        # converting sql_output_agent's response into a dictionary
+        sql_output_agent_response:dict = sql_output_agent_response.content.model_dump()
+
+    # only cache keywords whose sql query answered the question, drop cached keywords which stopped working
+    if keyword_cache is not None and not used_planned_keywords:
+        if sql_output_agent_response['error'] == False:
+            keyword_cache.put(user_query, keywords)
+        elif used_cached_keywords:
+            keyword_cache.invalidate(user_query)
 
     return sql_output_agent_response
 
-def run_new_attempts(user_query:str,previous_sql_queries:list,input_agent:Agent,output_agent:Agent,max_number_attempts:int=3,print_progess:bool=False):
+def run_new_attempts(user_query:str,previous_sql_queries:list,input_agent:Agent,output_agent:Agent,max_number_attempts:int=3,keyword_cache:Optional[sql_keyword_cache]=None,
+                     sql_validator:Optional[sql_query_validator]=None,previous_sql_errors:Optional[list]=None,num_candidates:int=1,
+                     execution_mode:str='agent',toolkit:Optional[sql_toolkit]=None,entity_resolver:Optional[sql_entity_resolver]=None,
+                     print_progess:bool=False):
     """
     Function to run the sql_input_agent and sql_output_agent workflow for a new attempt.This function is used when the sql_output_agent's 
     response contains an error, indicating that the SQL query was not generated correctly. This function uses a while loop to rerun attempts
@@ -118,6 +557,14 @@ def run_new_attempts(user_query:str,previous_sql_queries:list,input_agent:Agent,
         input_agent(Agno.Agent): The agent responsible for building the SQL queries.
         output_agent(Agno.Agent): The agent responsible for executing the SQL queries and processing the output.
         max_number_attempts (int): The maximum number of attempts to run the agents. Default is 3.
+        keyword_cache (sql_keyword_cache): A cache of the sql_input_agent's keywords. A successful new attempt is added to it. Default is None.
+        sql_validator (sql_query_validator): Checks each new SQL query before it is given to the sql_output_agent. Default is None.
+        previous_sql_errors (list[str]): The error of each previously attempted SQL query, in the same order as previous_sql_queries.
+        num_candidates (int): If greater than 1, each attempt generates this many SQL query candidates at the same time and continues with
+                              the first one which runs and returns rows (see run_speculative_attempt). Default is 1.
+        execution_mode (str): How the SQL queries are executed, either 'agent' or 'direct' (see run_sql_agent_workflow). Default is 'agent'.
+        toolkit (sql_toolkit): The toolkit used to run the SQL queries in the 'direct' execution mode. Default is None.
+        entity_resolver (sql_entity_resolver): Resolves the places and resorts mentioned in the question for the sql_input_agent. Default is None.
         print_progess (bool): Whether to print the messages outlining the progress of the agents. Default is False. 
     
     Returns:
@@ -129,14 +576,40 @@ def run_new_attempts(user_query:str,previous_sql_queries:list,input_agent:Agent,
     """
     #defining srtarting variables for recurssion 
     attempts = 1
+    if previous_sql_errors is None:
+        previous_sql_errors = []
 
     #condition preventing infinite loop 
+    candidates_generated = 0
+
     while attempts < max_number_attempts:
-        sql_output_agent_response = run_sql_agent_workflow(user_query=user_query,
-                                                            input_agent=input_agent,
-                                                            output_agent=output_agent,
-                                                            previous_sql_queries=previous_sql_queries,
-                                                            print_progess=print_progess)
+        if num_candidates > 1:
+            sql_output_agent_response = run_speculative_attempt(user_query=user_query,
+                                                                input_agent=input_agent,
+                                                                output_agent=output_agent,
+                                                                previous_sql_queries=previous_sql_queries,
+                                                                previous_sql_errors=previous_sql_errors,
+                                                                num_candidates=num_candidates,
+                                                                keyword_cache=keyword_cache,
+                                                                sql_validator=sql_validator,
+                                                                execution_mode=execution_mode,
+                                                                toolkit=toolkit,
+                                                                entity_resolver=entity_resolver,
+                                                                print_progess=print_progess)
+            candidates_generated += sql_output_agent_response['candidates_generated']
+            sql_output_agent_response['candidates_generated'] = candidates_generated
+        else:
+            sql_output_agent_response = run_sql_agent_workflow(user_query=user_query,
+                                                                input_agent=input_agent,
+                                                                output_agent=output_agent,
+                                                                previous_sql_queries=previous_sql_queries,
+                                                                keyword_cache=keyword_cache,
+                                                                sql_validator=sql_validator,
+                                                                previous_sql_errors=previous_sql_errors,
+                                                                execution_mode=execution_mode,
+                                                                toolkit=toolkit,
+                                                                entity_resolver=entity_resolver,
+                                                                print_progess=print_progess)
         attempts += 1
         # check if the sql_output_agent's response contains an error
         if sql_output_agent_response['error'] == False:
@@ -149,17 +622,233 @@ def run_new_attempts(user_query:str,previous_sql_queries:list,input_agent:Agent,
             print("Attempting to generate a new SQL query.")
         
         # if the sql_output_agent's response contains an error, add the previous sql query the list of incorrect queries
-        previous_sql_queries.append(sql_output_agent_response['sql_query'])
+        # (a failed speculative attempt has already added each of its candidates)
+        if num_candidates <= 1:
+            previous_sql_queries.append(sql_output_agent_response['sql_query'])
+            previous_sql_errors.append(sql_output_agent_response['response_text'])
      
     if exceeds_max_attempts(attempts,max_number_attempts,sql_output_agent_response):
         if print_progess: print(f"Maximum number of attempts reached ({max_number_attempts}).")
-        return {'user_query':user_query,
-                'sql_query':f'Incorrect SQL Query: {sql_output_agent_response['sql_query']}',
-                'response_text':"Unable to generate a valid SQL query after multiple attempts.",
-                'error':True}
+        failed_response = {'user_query':user_query,
+                           'sql_query':f"Incorrect SQL Query: {sql_output_agent_response['sql_query']}",
+                           'response_text':"Unable to generate a valid SQL query after multiple attempts.",
+                           'error':True}
+        if num_candidates > 1:
+            failed_response.update({'candidates_generated': candidates_generated, 'winning_candidate': None})
+        return failed_response
     
     return sql_output_agent_response
 
+def run_speculative_attempt(user_query:str,input_agent:Agent,output_agent:Agent,previous_sql_queries:list,previous_sql_errors:list,
+                            num_candidates:int=3,keyword_cache:Optional[sql_keyword_cache]=None,sql_validator:Optional[sql_query_validator]=None,
+                            execution_mode:str='agent',toolkit:Optional[sql_toolkit]=None,entity_resolver:Optional[sql_entity_resolver]=None,
+                            print_progess:bool=False) -> dict:
+    """
+    Run one attempt of the workflow which asks the sql_input_agent for several different SQL queries at the same time.
+
+    Each candidate is generated by its own copy of the sql_input_agent, validated (if a sql_validator is given) and executed with the
+    sql_output_agent's sql_toolkit in its own worker thread. The first candidate which runs and returns rows wins and only it is given to
+    the sql_output_agent to summarise. The other candidates are abandoned rather than cancelled: a candidate which hasn't called the
+    sql_input_agent yet doesn't call it, and one which has stops before validating or executing its query, but a sql_input_agent call
+    which has already started can't be interrupted so it runs to the end (and its tokens are billed) before its result is discarded.
+    If no candidate returns rows, the first candidate which ran without an error is used. If every candidate fails, each candidate's query
+    and error are added to previous_sql_queries and previous_sql_errors so the next attempt avoids them.
+
+    Parameters:
+        user_query (str): The user's query to be processed by the agents.
+        input_agent(Agno.Agent): The agent responsible for building the SQL queries.
+        output_agent(Agno.Agent): The agent responsible for executing the SQL queries and processing the output.
+        previous_sql_queries (list[str]): A list of previously attempted SQL queries generated by the sql_input_agent.
+        previous_sql_errors (list[str]): The error of each previously attempted SQL query, in the same order as previous_sql_queries.
+        num_candidates (int): The number of SQL query candidates generated at the same time. Default is 3.
+        keyword_cache (sql_keyword_cache): A cache of the sql_input_agent's keywords. The winning candidate is added to it. Default is None.
+        sql_validator (sql_query_validator): Checks each candidate before it is executed. Default is None.
+        execution_mode (str): In the 'direct' execution mode the winning candidate's rows are given straight to the output_agent to
+                              summarise. In the 'agent' mode a winning candidate's rows are given to the output_agent too, so its query
+                              isn't run a second time, and only a candidate without rows is run by the output_agent. Default is 'agent'.
+        toolkit (sql_toolkit): The toolkit used to run the candidates. Default is None (the output_agent's sql_toolkit).
+        entity_resolver (sql_entity_resolver): Resolves the places and resorts mentioned in the question for the sql_input_agent. Default is None.
+        print_progess (bool): Whether to print the messages outlining the progress of the agents. Default is False.
+
+    Returns:
+        sql_output_agent_response (dict): The response from the sql_output_agent (or an error response) with the additional keys:
+          -candidates_generated: The number of SQL query candidates generated by the sql_input_agent.
+          -winning_candidate: The index of the candidate given to the sql_output_agent (starting at 0) or None if every candidate failed.
+    """
+    if toolkit is None:
+        toolkit = get_sql_toolkit(output_agent)
+    record_attempt()
+    #set when a candidate wins so the others stop at their next step, a model call which has started still runs to the end
+    cancelled = Event()
+    entities:dict = None
+    if entity_resolver is not None:
+        with measure_stage('entity_resolution'):
+            entities = entity_resolver.resolve(user_query)
+    with measure_stage('prompt_build'):
+        sql_input_agent_queries = [build_sql_input_agent_query(user_query=user_query,
+                                                               previous_sql_queries=previous_sql_queries,
+                                                               previous_sql_errors=previous_sql_errors,
+                                                               candidate_number=candidate_number,
+                                                               num_candidates=num_candidates,
+                                                               entities=entities)
+                                   for candidate_number in range(num_candidates)]
+
+    def run_candidate(future:Future, sql_input_agent_query:str) -> None:
+        try:
+            #don't start a model call once another candidate has won
+            if cancelled.is_set():
+                future.set_result({'keywords': None, 'sql_query': '', 'error': "Cancelled, another candidate won.", 'rows': []})
+                return
+            with measure_stage('input_agent'):
+                sql_input_agent_response:RunResponse = input_agent.deep_copy().run(sql_input_agent_query)
+            record_agent_metrics(sql_input_agent_response)
+            keywords:dict = sql_input_agent_response.content.model_dump()
+            with measure_stage('sql_build'):
+                sql_query:str = build_sql_query(keyword_dict=keywords)
+            candidate = {'keywords': keywords, 'sql_query': sql_query, 'error': None, 'rows': []}
+            if not cancelled.is_set() and sql_validator is not None:
+                with measure_stage('validation'):
+                    candidate['error'] = sql_validator.validate(sql_query)
+            if not cancelled.is_set() and candidate['error'] is None and toolkit is not None:
+                try:
+                    candidate['rows'] = toolkit.execute_query(sql_query)
+                except Exception as e:
+                    candidate['error'] = f"Error executing SQL query: {get_db_error_message(e)}"
+
+            future.set_result(candidate)
+        except Exception as e:
+            future.set_exception(e)
+
+    if print_progess: print(f"Generating {num_candidates} SQL query candidates.")
+    futures = [Future() for _ in range(num_candidates)]
+    for future, sql_input_agent_query in zip(futures, sql_input_agent_queries):
+        #each candidate runs in a copy of the current context so its stages are added to the query's trace
+        Thread(target=copy_context().run, args=(run_candidate, future, sql_input_agent_query), daemon=True).start()
+
+    #wait for the first candidate which returns rows
+    candidates:dict = {}
+    winning_candidate = None
+    pending = set(futures)
+    while pending and winning_candidate is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = futures.index(future)
+            try:
+                candidates[index] = future.result()
+            except Exception as e:
+                candidates[index] = {'keywords': None, 'sql_query': '', 'error': f"Error generating SQL query: {e}", 'rows': []}
+            if candidates[index]['error'] is None and candidates[index]['rows']:
+                winning_candidate = index if winning_candidate is None else min(winning_candidate, index)
+    cancelled.set()
+
+    #without rows from any candidate, use the first candidate which ran without an error
+    if winning_candidate is None:
+        valid_candidates = [index for index, candidate in candidates.items() if candidate['error'] is None]
+        winning_candidate = min(valid_candidates) if valid_candidates else None
+
+    if winning_candidate is None:
+        for index in sorted(candidates):
+            previous_sql_queries.append(candidates[index]['sql_query'])
+            previous_sql_errors.append(f"Invalid SQL query: {candidates[index]['error']}")
+        sql_output_agent_response = build_error_response(user_query=user_query,
+                                                         response_text=f"Invalid SQL query: {candidates[0]['error']}",
+                                                         sql_query=candidates[0]['sql_query'])
+    else:
+        if print_progess: print(f"Running sql_output_agent with candidate {winning_candidate}.")
+        candidate = candidates[winning_candidate]
+        if execution_mode == 'direct':
+            sql_output_agent_response:dict = run_direct_execution(user_query=user_query,
+                                                                  sql_query=candidate['sql_query'],
+                                                                  summary_agent=output_agent,
+                                                                  toolkit=toolkit,
+                                                                  rows=candidate['rows'],
+                                                                  print_progess=print_progess)
+        elif candidate['rows']:
+            #the candidate's query has already run, its rows are given to the sql_output_agent so it doesn't run the query again
+            sql_output_agent_response:dict = run_direct_execution(user_query=user_query,
+                                                                  sql_query=candidate['sql_query'],
+                                                                  summary_agent=output_agent,
+                                                                  toolkit=toolkit,
+                                                                  rows=candidate['rows'],
+                                                                  print_progess=print_progess)
+        else:
+            with measure_stage('output_agent'):
+                sql_output_agent_response = output_agent.run(user_query + '\n' + candidate['sql_query'])
+            record_agent_metrics(sql_output_agent_response)
+            sql_output_agent_response:dict = sql_output_agent_response.content.model_dump()
+        if sql_output_agent_response['error'] == True:
+            previous_sql_queries.append(sql_output_agent_response['sql_query'])
+            previous_sql_errors.append(sql_output_agent_response['response_text'])
+        elif keyword_cache is not None:
+            keyword_cache.put(user_query, candidate['keywords'])
+
+    sql_output_agent_response['candidates_generated'] = num_candidates
+    sql_output_agent_response['winning_candidate'] = winning_candidate if sql_output_agent_response['error'] == False else None
+    return sql_output_agent_response
+
+def run_direct_execution(user_query:str,sql_query:str,summary_agent:Agent,toolkit:sql_toolkit,rows:Optional[List[dict]]=None,
+                         print_progess:bool=False) -> dict:
+    """
+    Run a SQL query with the toolkit in Python and use a single model call to summarise the rows. Database errors and empty
+    results are detected here and reported without calling the summary_agent.
+
+    Parameters:
+        user_query (str): The user's natural language question.
+        sql_query (str): The SQL query to run.
+        summary_agent(Agno.Agent): The agent which summarises the rows (see build_sql_summary_agent). It doesn't need any tools.
+        toolkit (sql_toolkit): The toolkit used to run the SQL query.
+        rows (List[dict]): The rows of the SQL query if it has already been run. Default is None.
+        print_progess (bool): Whether to print the messages outlining the progress of the agents. Default is False.
+
+    Returns:
+        sql_output_agent_response (dict): The response in the form of the sql_output_agent_response dictionary.
+    """
+    if rows is None:
+        if toolkit is None:
+            return build_error_response(user_query=user_query,
+                                        response_text="No sql_toolkit was given to run the SQL query directly.",
+                                        sql_query=sql_query)
+        if print_progess: print(f"Running SQL query directly.")
+        try:
+            rows = toolkit.execute_query(sql_query)
+        except Exception as e:
+            return build_error_response(user_query=user_query,
+                                        response_text=f"Error executing SQL query: {get_db_error_message(e)}",
+                                        sql_query=sql_query)
+    if not rows:
+        return build_error_response(user_query=user_query,
+                                    response_text="The SQL query returned no rows.",
+                                    sql_query=sql_query)
+
+    # summarise the rows in a single model call, the rows are inlined so the agent doesn't need to call a tool
+    if print_progess: print(f"Running sql_summary_agent.")
+    # large results are summarised so they fit in the toolkit's token budget
+    shaped_rows = toolkit.shape_result(rows) if toolkit is not None else rows
+    summary_agent_query:str = json.dumps({'user_query': user_query, 'sql_query': sql_query, 'rows': shaped_rows}, default=str)
+    with measure_stage('output_agent'):
+        summary_agent_response:RunResponse = summary_agent.run(summary_agent_query)
+    record_agent_metrics(summary_agent_response)
+    sql_output_agent_response:dict = summary_agent_response.content.model_dump()
+    #the query which ran is reported rather than the agent's copy of it
+    sql_output_agent_response['user_query'] = user_query
+    sql_output_agent_response['sql_query'] = sql_query
+    return sql_output_agent_response
+
+def get_sql_toolkit(agent:Agent) -> Optional[sql_toolkit]:
+    """
+    Get the sql_toolkit used by an agent.
+
+    Parameters:
+        agent (Agno.Agent): The agent, usually the sql_output_agent.
+
+    Returns:
+        sql_toolkit: The agent's sql_toolkit or None if it doesn't have one.
+    """
+    for tool in getattr(agent, 'tools', None) or []:
+        if isinstance(tool, sql_toolkit):
+            return tool
+    return None
+
 def exceeds_max_attempts(attempts:int, max_number_attempts:int,sql_output_agent_response:dict) -> bool:
     """
     Check if the number of attempts exceeds the maximum number of attempts. 
@@ -177,7 +866,8 @@ def exceeds_max_attempts(attempts:int, max_number_attempts:int,sql_output_agent_
     """
     return sql_output_agent_response['error'] == True and attempts >= max_number_attempts
 
-def build_sql_input_agent_query(user_query:str,previous_sql_queries:List[str] = None) -> str:
+def build_sql_input_agent_query(user_query:str,previous_sql_queries:List[str] = None,previous_sql_errors:List[str] = None,
+                                candidate_number:Optional[int] = None,num_candidates:Optional[int] = None,entities:Optional[dict] = None) -> str:
     """
     Build the input query for the sql_input_agent. This function takes the user query and the previous response from the sql_input_agent 
     (if available) and builds the input query for the sql_input_agent. It returns a JSON-formatted string.
@@ -185,15 +875,28 @@ def build_sql_input_agent_query(user_query:str,previous_sql_queries:List[str] =
     Parameters:
         user_query (str): The original user query.
         previous_sql_queries (List[str]): A list of previously attempted SQL queries generated by the sql_input_agent.
+        previous_sql_errors (List[str]): The error of each previously attempted SQL query, in the same order as previous_sql_queries.
+        candidate_number (int): The index of the candidate when several SQL queries are generated at the same time. Default is None.
+        num_candidates (int): The number of candidates generated at the same time. Default is None.
+        entities (dict): The column names mapped to the database values mentioned in the question (see sql_entity_resolver). Default is None.
 
     Returns:
         input_query (str): A json-formatted string representing the user query and previous SQL queries. The string has the following fields:
         - user_query: The user's original request in natural language.
         - sql_queries: A list of previous SQL queries that have been attempted and failed. If this list is empty, it's the first attempt.
+        - sql_errors: The reason each previous SQL query failed, in the same order as sql_queries.
+        - candidate: Only when several candidates are generated, the candidate's number in the form 'i of n'.
+        - entities: Only when an entity resolver is used, the column names mapped to the database values mentioned in the question,
+                    with partial and fuzzy matches under its 'candidates' key.
     """
     # Create the base dictionary for the input agent's query
     input_query_dict = {
         'user_query': user_query,
-        'sql_queries': previous_sql_queries if previous_sql_queries is not None else []
+        'sql_queries': previous_sql_queries if previous_sql_queries is not None else [],
+        'sql_errors': previous_sql_errors if previous_sql_errors is not None else []
     }
+    if candidate_number is not None and num_candidates is not None:
+        input_query_dict['candidate'] = f"{candidate_number + 1} of {num_candidates}"
+    if entities is not None:
+        input_query_dict['entities'] = entities
     return json.dumps(input_query_dict)
\ No newline at end of file
@@ -0,0 +1,248 @@
+from collections import deque
+from concurrent.futures import Future
+from threading import Thread
+from typing import Optional
+import asyncio
+import time
+
+from agno.agent import Agent
+
+from .benchmarking import summarise_durations
+from .caching import normalize_question, sql_keyword_cache
+from .entity_resolution import sql_entity_resolver
+from .fast_path_planner import sql_fast_path_planner
+from .query_agents import query_sql_agents, build_error_response
+from .sql_toolkit import sql_toolkit
+from .sql_validation import sql_query_validator
+
+class query_service_overloaded(Exception):
+    """
+    An error raised when a request can't be queued because the service's work queue stayed full for longer than enqueue_timeout,
+    so the caller (i.e. an API handler) can ask the client to retry later.
+    """
+
+class sql_query_service:
+    """
+    An asyncio service which answers questions with query_sql_agents for many concurrent callers (i.e. the requests of an API).
+
+    - Requests are put on a bounded work queue which max_workers workers take them from, each with its own copy of the agents.
+      When the queue is full a request waits for space (backpressure) and is rejected with query_service_overloaded if it waits
+      for longer than enqueue_timeout.
+    - Concurrent requests for the same normalized question (see normalize_question) are coalesced: only the first is queued and
+      every request waiting for it gets a copy of its result.
+    - get_stats reports the queue depth, the share of coalesced requests and the latency of the requests.
+
+    The agents run in worker threads so the event loop is never blocked by a model or database call. A question which runs for longer
+    than query_timeout gets an error response straight away, but its thread keeps one of the max_workers slots until it finishes, so
+    at most max_workers questions are ever running.
+
+    Example:
+        async with sql_query_service(input_agent=sql_agents['sql_input_agent'], output_agent=sql_agents['sql_output_agent']) as service:
+            response = await service.query('How many ski resorts are in Canada?')
+    """
+
+    def __init__(self,input_agent:Agent,output_agent:Agent,max_workers:int=4,max_queue_size:int=100,
+                 enqueue_timeout:Optional[float]=None,query_timeout:Optional[float]=None,max_number_attempts:int=3,
+                 keyword_cache:Optional[sql_keyword_cache]=None,fast_path_planner:Optional[sql_fast_path_planner]=None,
+                 sql_validator:Optional[sql_query_validator]=None,num_candidates:int=1,execution_mode:str='agent',
+                 toolkit:Optional[sql_toolkit]=None,collect_metrics:bool=False,entity_resolver:Optional[sql_entity_resolver]=None,
+                 latency_window:int=1000):
+        """
+        Initializes the sql_query_service.
+
+        Parameters:
+            input_agent(Agno.Agent): The agent responsible for building the SQL queries.
+            output_agent(Agno.Agent): The agent responsible for executing the SQL queries and processing the output.
+            max_workers (int): The maximum number of questions answered at the same time. Default is 4.
+            max_queue_size (int): The maximum number of questions waiting for a worker. Default is 100.
+            enqueue_timeout (float): The maximum number of seconds a request waits for space in a full queue before it is rejected
+                                     with query_service_overloaded. Default is None (wait until there is space).
+            query_timeout (float): The maximum number of seconds a question may run for, after which its requests get an error
+                                   response. Its thread is abandoned and holds its worker slot until it finishes. Default is None (no timeout).
+            latency_window (int): The number of most recent requests whose latency is reported by get_stats. Default is 1,000.
+            The other parameters are the same as query_sql_agents'.
+        """
+        if execution_mode not in ('agent', 'direct'):
+            raise ValueError(f"Invalid execution mode '{execution_mode}', expected 'agent' or 'direct'")
+        if execution_mode == 'direct' and toolkit is None:
+            raise ValueError("A toolkit is required for the 'direct' execution mode")
+        self.input_agent = input_agent
+        self.output_agent = output_agent
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.enqueue_timeout = enqueue_timeout
+        self.query_timeout = query_timeout
+        self.query_options = {'max_number_attempts': max_number_attempts,
+                              'keyword_cache': keyword_cache,
+                              'fast_path_planner': fast_path_planner,
+                              'sql_validator': sql_validator,
+                              'num_candidates': num_candidates,
+                              'execution_mode': execution_mode,
+                              'toolkit': toolkit,
+                              'collect_metrics': collect_metrics,
+                              'entity_resolver': entity_resolver}
+        self.queue:Optional[asyncio.Queue] = None
+        #a slot is held by each running thread, including the abandoned threads of timed out questions
+        self.slots:Optional[asyncio.Semaphore] = None
+        self.abandoned:set = set()
+        self.workers:list = []
+        #normalized question mapped to the future of its running or queued execution
+        self.in_flight:dict = {}
+        self.requests = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.latencies:deque = deque(maxlen=latency_window)
+
+    async def __aenter__(self) -> 'sql_query_service':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.stop()
+
+    async def start(self) -> None:
+        """Create the work queue and start the workers. It must be called from the event loop the service is used on."""
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.slots = asyncio.Semaphore(max(self.max_workers, 1))
+        self.workers = [asyncio.create_task(self.run_worker()) for _ in range(max(self.max_workers, 1))]
+
+    async def stop(self) -> None:
+        """Stop the workers. Requests still queued or running get an error response."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        for future in self.in_flight.values():
+            if not future.done():
+                future.set_result(None)
+        self.in_flight.clear()
+
+    async def query(self,user_query:str) -> dict:
+        """
+        Answer a question, sharing the execution of any identical question which is already queued or running.
+
+        Parameters:
+            user_query (str): The user's natural language question.
+
+        Returns:
+            sql_output_agent_response (dict): The response in the form of the sql_output_agent_response dictionary.
+
+        Raises:
+            query_service_overloaded: If the work queue stayed full for longer than enqueue_timeout.
+        """
+        if not self.workers:
+            raise RuntimeError("The sql_query_service hasn't been started, call start or use it with 'async with'")
+        started = time.perf_counter()
+        self.requests += 1
+        key = normalize_question(user_query)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[key] = future
+            try:
+                await asyncio.wait_for(self.queue.put((key, user_query, future)), timeout=self.enqueue_timeout)
+                self.executions += 1
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                self.in_flight.pop(key, None)
+                error = query_service_overloaded(f"The query queue has been full for {self.enqueue_timeout} seconds, try again later.")
+                #requests which were coalesced onto this one are rejected too, the exception is marked as retrieved in case there are none
+                future.set_exception(error)
+                future.exception()
+                raise error from None
+
+        #shield the shared execution so one caller cancelling its request doesn't cancel it for the others
+        sql_output_agent_response = await asyncio.shield(future)
+        self.latencies.append(time.perf_counter() - started)
+        if sql_output_agent_response is None:
+            return build_error_response(user_query=user_query, response_text="The query service was stopped before the query finished.")
+        return {**sql_output_agent_response, 'user_query': user_query}
+
+    async def run_worker(self) -> None:
+        """Take questions from the work queue and answer them one at a time, fanning each result out to its waiting requests."""
+        input_agent, output_agent = self.input_agent.deep_copy(), self.output_agent.deep_copy()
+        while True:
+            key, user_query, future = await self.queue.get()
+            try:
+                await self.slots.acquire()
+                thread_future = self.run_in_thread(user_query, input_agent, output_agent)
+                thread_future.add_done_callback(self.get_thread_done_callback(asyncio.get_running_loop()))
+                execution = asyncio.wrap_future(thread_future)
+                try:
+                    #shielded so a timeout doesn't cancel the thread's future while the thread is still going to set it
+                    sql_output_agent_response = await asyncio.wait_for(asyncio.shield(execution), timeout=self.query_timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    if not thread_future.done():
+                        self.abandoned.add(thread_future)
+                    #the abandoned thread keeps using its agents until it finishes, so the worker continues with new copies
+                    input_agent, output_agent = self.input_agent.deep_copy(), self.output_agent.deep_copy()
+                    sql_output_agent_response = build_error_response(user_query=user_query,
+                                                                     response_text=f"Query timed out after {self.query_timeout} seconds.")
+                except Exception as e:
+                    sql_output_agent_response = build_error_response(user_query=user_query, response_text=f"Error running query: {e}")
+                if not future.done():
+                    future.set_result(sql_output_agent_response)
+            finally:
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
+                self.queue.task_done()
+
+    def run_in_thread(self,user_query:str,input_agent:Agent,output_agent:Agent) -> Future:
+        """Run query_sql_agents for a question in a daemon thread and return the future of its response."""
+        future = Future()
+        def run() -> None:
+            try:
+                future.set_result(query_sql_agents(queries=[user_query], input_agent=input_agent, output_agent=output_agent,
+                                                   **self.query_options)[0])
+            except Exception as e:
+                future.set_exception(e)
+        Thread(target=run, daemon=True).start()
+        return future
+
+    def get_thread_done_callback(self,loop:asyncio.AbstractEventLoop):
+        """Get the callback run when a question's thread finishes, which frees its worker slot on the event loop."""
+        def release(thread_future:Future) -> None:
+            self.abandoned.discard(thread_future)
+            self.slots.release()
+        def on_thread_done(thread_future:Future) -> None:
+            try:
+                loop.call_soon_threadsafe(release, thread_future)
+            except RuntimeError:
+                #the event loop was closed after the service stopped
+                pass
+        return on_thread_done
+
+    def get_stats(self) -> dict:
+        """
+        Get the load and latency statistics of the service. It must be called from the event loop the service is used on.
+
+        Returns:
+            dict: The service statistics with the keys:
+                - queue_depth: The number of questions waiting for a worker.
+                - in_flight: The number of distinct questions queued or running.
+                - requests: The number of requests.
+                - executions: The number of requests which were queued (the others were coalesced).
+                - coalesced: The number of requests which shared an execution.
+                - coalescing_ratio: The share of requests which were coalesced.
+                - rejected: The number of requests rejected because the queue was full.
+                - timeouts: The number of executions which reached the query_timeout.
+                - abandoned: The number of timed out executions whose threads are still running and holding a worker slot.
+                - latency: The count, total_s, mean_ms, p50_ms, p95_ms and max_ms of the latency of the latest requests.
+        """
+        return {'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+                'in_flight': len(self.in_flight),
+                'requests': self.requests,
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'coalescing_ratio': self.coalesced / self.requests if self.requests else 0.0,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'abandoned': len(self.abandoned),
+                'latency': summarise_durations(list(self.latencies))}
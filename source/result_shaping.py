@@ -0,0 +1,92 @@
+from decimal import Decimal
+from typing import List, Union
+import json
+
+from pandas import DataFrame, to_numeric
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+
+#average number of characters per token of JSON encoded query results, used to estimate their size without a tokenizer
+chars_per_token = 4
+
+def estimate_tokens(value) -> int:
+    """
+    Estimate the number of tokens a value takes up in a model's context once it is JSON encoded.
+
+    Parameters:
+        value: The value given to the model (i.e. the rows of a query result).
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return len(json.dumps(value, default=str)) // chars_per_token + 1
+
+def shape_query_result(rows:List[dict],max_rows:int=200,max_tokens:int=4000,top_k:int=5) -> Union[List[dict],dict]:
+    """
+    Keep a query result within a row and token budget before it is given to a model.
+
+    A result within the budget is returned unchanged. A larger result is replaced by a compact summary so the model's context
+    isn't filled with thousands of rows. The summary has the keys:
+    - truncated: Always True, flags that the rows were not all returned.
+    - row_count: The number of rows returned by the query.
+    - columns: The column names of the result.
+    - summary: For each numeric column its count, min, max and mean, for each other column its number of distinct values and
+               its top_k most common values with their counts.
+    - sample_row_count: The number of rows in sample.
+    - sample: The first rows of the result in a columnar encoding (column name mapped to a list of values), as many as fit in the budget.
+
+    Parameters:
+        rows (List[dict]): The rows of the query result.
+        max_rows (int): The maximum number of rows returned unchanged. Default is 200.
+        max_tokens (int): The maximum estimated number of tokens of the returned result. Default is 4,000.
+        top_k (int): The number of most common values summarised for each non-numeric column. Default is 5.
+
+    Returns:
+        Union[List[dict],dict]: The rows if they are within the budget, otherwise the compact summary.
+    """
+    if len(rows) <= max_rows and estimate_tokens(rows) <= max_tokens:
+        return rows
+
+    data = DataFrame(rows)
+    compact_result = {'truncated': True,
+                      'row_count': len(data),
+                      'columns': list(data.columns),
+                      'summary': summarise_columns(data=data, top_k=top_k)}
+
+    #halve the sample until the whole result fits in the budget
+    sample_size = min(len(data), max_rows)
+    while True:
+        sample = {column: data[column].iloc[:sample_size].tolist() for column in data.columns}
+        compact_result.update({'sample_row_count': sample_size, 'sample': sample})
+        if sample_size == 0 or estimate_tokens(compact_result) <= max_tokens:
+            return compact_result
+        sample_size //= 2
+
+def summarise_columns(data:DataFrame,top_k:int=5) -> dict:
+    """
+    Compute summary statistics of each column of a query result.
+
+    Parameters:
+        data (pd.DataFrame): The query result.
+        top_k (int): The number of most common values summarised for each non-numeric column. Default is 5.
+
+    Returns:
+        dict: The column names mapped to their statistics (count, min, max and mean for numeric columns, distinct and top
+              values for other columns).
+    """
+    summary = {}
+    for column in data.columns:
+        values = data[column].dropna()
+        #postgres returns NUMERIC values (i.e. the result of AVG) as Decimal objects
+        if len(values) and values.map(lambda value: isinstance(value, Decimal)).all():
+            values = to_numeric(values)
+        if is_numeric_dtype(values) and not is_bool_dtype(values):
+            summary[column] = {'count': int(values.count()),
+                               'min': values.min().item() if len(values) else None,
+                               'max': values.max().item() if len(values) else None,
+                               'mean': round(float(values.mean()), 4) if len(values) else None}
+        else:
+            value_counts = values.astype(str).value_counts()
+            summary[column] = {'count': int(values.count()),
+                               'distinct': int(len(value_counts)),
+                               'top': {value: int(count) for value, count in value_counts.head(top_k).items()}}
+    return summary
@@ -0,0 +1,270 @@
+from threading import Lock
+from typing import List, Optional
+import re
+
+from sqlalchemy import FLOAT, INTEGER
+
+from .sql_validation import sql_keywords, sql_type_names, string_literal_pattern, token_pattern
+
+#aggregates stored in the rollup tables for each numeric column
+rollup_aggregates = ['count', 'sum', 'avg', 'min', 'max']
+
+#an aggregate of a single column (or COUNT(*)) which can be answered from the rollup tables
+aggregate_call_pattern = re.compile(r'\b(count|sum|avg|min|max)\s*\(\s*(\*|"?[A-Za-z_][A-Za-z0-9_]*"?)\s*\)', re.IGNORECASE)
+
+#splits a query built by build_sql_query into its clauses
+clause_pattern = re.compile(r'^\s*SELECT\s+(?P<SELECT>.+?)\s+FROM\s+(?P<FROM>.+?)(?:\s+WHERE\s+(?P<WHERE>.+?))?(?:\s+GROUP BY\s+(?P<GROUPBY>.+?))?'
+                            r'(?:\s+HAVING\s+(?P<HAVING>.+?))?(?:\s+ORDER BY\s+(?P<ORDERBY>.+?))?(?:\s+LIMIT\s+(?P<LIMIT>\d+))?\s*;?\s*$',
+                            re.IGNORECASE | re.DOTALL)
+
+def get_numeric_columns(dtype_dict:dict) -> List[str]:
+    """
+    Get the numeric columns of a table which are aggregated in its rollup tables.
+
+    Parameters:
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+
+    Returns:
+        List[str]: The FLOAT and INTEGER columns.
+    """
+    return [column for column, dtype in dtype_dict.items() if dtype in (FLOAT, INTEGER)]
+
+def get_rollup_table_name(table_name:str,group_column:str) -> str:
+    """Get the name of a table's rollup table grouped by a column (i.e. ski_resorts_by_country)."""
+    return f"{table_name}_by_{group_column}"
+
+def build_rollup_query(table_name:str,group_column:str,numeric_columns:List[str]) -> str:
+    """
+    Build the query which computes a rollup table: the number of rows and the count, sum, avg, min and max of each numeric column
+    for each value of the group column.
+
+    Parameters:
+        table_name (str): Name of the base table.
+        group_column (str): The column the rollup is grouped by.
+        numeric_columns (List[str]): The numeric columns which are aggregated.
+
+    Returns:
+        str: The SELECT statement of the rollup table.
+    """
+    aggregates = ', '.join(f'{aggregate.upper()}("{column}") AS "{column}_{aggregate}"'
+                           for column in numeric_columns for aggregate in rollup_aggregates)
+    return f'SELECT "{group_column}", COUNT(*) AS row_count, {aggregates} FROM "{table_name}" GROUP BY "{group_column}"'
+
+def refresh_rollup_tables(cursor,table_name:str,dtype_dict:dict,group_columns:List[str]) -> dict:
+    """
+    Rebuild the rollup tables of a table from its current rows. This runs in the transaction which reloads the table, so queries
+    never see rollups which don't match the table.
+
+    Parameters:
+        cursor (psycopg2.extensions.cursor): A cursor of an open database connection.
+        table_name (str): Name of the base table.
+        dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+        group_columns (List[str]): The columns a rollup table is built for.
+
+    Returns:
+        dict: The rollup table names mapped to their number of rows.
+    """
+    numeric_columns = get_numeric_columns(dtype_dict)
+    rollup_rows = {}
+    for group_column in group_columns:
+        rollup_table_name = get_rollup_table_name(table_name, group_column)
+        cursor.execute(f'DROP TABLE IF EXISTS "{rollup_table_name}"')
+        cursor.execute(f'CREATE TABLE "{rollup_table_name}" AS {build_rollup_query(table_name, group_column, numeric_columns)}')
+        rollup_rows[rollup_table_name] = cursor.rowcount
+    return rollup_rows
+
+class sql_rollup_rewriter:
+    """
+    Rewrites aggregate queries on the base table so they read the much smaller rollup tables built by refresh_rollup_tables.
+
+    A query is rewritten when:
+    - It only reads the base table.
+    - Its WHERE and GROUP BY clauses only reference one of the rollup's group columns (i.e. WHERE country = 'canada' or
+      GROUP BY continent), or it has neither.
+    - Its SELECT, HAVING and ORDER BY clauses only use that group column, aliases and COUNT(*) or the COUNT, SUM, AVG, MIN and
+      MAX of numeric columns.
+    The aggregates are then recomputed from the rollup rows (i.e. AVG(x) becomes SUM(x_sum) / SUM(x_count)), so the result is the
+    same as the base table's. Any other query is left unchanged.
+    """
+
+    def __init__(self,table_name:str,dtype_dict:dict,group_columns:List[str]):
+        """
+        Initializes the sql_rollup_rewriter.
+
+        Parameters:
+            table_name (str): Name of the base table.
+            dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+            group_columns (List[str]): The columns the rollup tables are grouped by.
+        """
+        self.table_name = table_name
+        self.group_columns = list(group_columns)
+        self.numeric_columns = {column.lower(): column for column in get_numeric_columns(dtype_dict)}
+        self.lock = Lock()
+        self.queries = 0
+        self.rewritten = 0
+        self.fallbacks = 0
+
+    def rewrite(self,sql_query:str) -> Optional[str]:
+        """
+        Rewrite an aggregate query to read a rollup table.
+
+        Parameters:
+            sql_query (str): The SQL query on the base table.
+
+        Returns:
+            str: The rewritten query or None if the query can't be answered from the rollup tables.
+        """
+        rewritten_query = self.build_rewrite(sql_query)
+        with self.lock:
+            self.queries += 1
+            if rewritten_query is not None:
+                self.rewritten += 1
+        return rewritten_query
+
+    def build_rewrite(self,sql_query:str) -> Optional[str]:
+        """Build the rewritten query, see rewrite."""
+        match = clause_pattern.match(sql_query)
+        if match is None:
+            return None
+        clauses = {name: value.strip() for name, value in match.groupdict().items() if value is not None}
+        if clauses['FROM'].strip('"').lower() != self.table_name.lower():
+            return None
+        if not aggregate_call_pattern.search(clauses['SELECT']):
+            return None
+
+        #the WHERE and GROUP BY clauses choose the rollup table
+        group_column = None
+        for clause_name in ('WHERE', 'GROUPBY'):
+            if clause_name not in clauses:
+                continue
+            referenced_columns = self.get_identifiers(clauses[clause_name]) - {'and', 'or', 'not', 'in', 'is', 'null', 'like', 'ilike',
+                                                                               'between', 'true', 'false'}
+            if len(referenced_columns) != 1:
+                return None
+            column = referenced_columns.pop()
+            if column not in [group_column.lower() for group_column in self.group_columns]:
+                return None
+            if group_column is not None and column != group_column.lower():
+                return None
+            group_column = next(name for name in self.group_columns if name.lower() == column)
+        if 'GROUPBY' in clauses and clauses['GROUPBY'].strip('"').lower() != group_column.lower():
+            return None
+        if group_column is None:
+            group_column = self.group_columns[-1]
+
+        #aliases defined in the SELECT clause can be used in HAVING and ORDER BY
+        aliases = {alias.lower() for alias in re.findall(r'\bAS\s+"?([A-Za-z_][A-Za-z0-9_]*)"?', clauses['SELECT'], re.IGNORECASE)}
+        allowed_identifiers = {group_column.lower()} | aliases | sql_keywords | sql_type_names
+        for clause_name in ('SELECT', 'HAVING', 'ORDERBY'):
+            if clause_name not in clauses:
+                continue
+            if not self.aggregates_are_supported(clauses[clause_name]):
+                return None
+            remainder = aggregate_call_pattern.sub(' ', clauses[clause_name])
+            #functions (i.e. ROUND) are allowed around the aggregates, but not other aggregates or window functions
+            functions = {token[:-1].strip().lower() for token in token_pattern.findall(string_literal_pattern.sub("''", remainder))
+                         if token.strip().endswith('(')}
+            if functions & {'count', 'sum', 'avg', 'min', 'max', 'over', 'distinct'}:
+                return None
+            if 'GROUPBY' not in clauses and group_column.lower() in self.get_identifiers(remainder):
+                return None
+            if not self.get_identifiers(remainder) <= allowed_identifiers:
+                return None
+
+        select_items = [self.rewrite_select_item(item) for item in split_top_level(clauses['SELECT'])]
+        rewritten_query = f'SELECT {", ".join(select_items)} FROM "{get_rollup_table_name(self.table_name, group_column)}"'
+        if 'WHERE' in clauses:
+            rewritten_query += f" WHERE {clauses['WHERE']}"
+        if 'GROUPBY' in clauses:
+            rewritten_query += f" GROUP BY {clauses['GROUPBY']}"
+        if 'HAVING' in clauses:
+            rewritten_query += f" HAVING {self.rewrite_aggregates(clauses['HAVING'])}"
+        if 'ORDERBY' in clauses:
+            rewritten_query += f" ORDER BY {self.rewrite_aggregates(clauses['ORDERBY'])}"
+        if 'LIMIT' in clauses:
+            rewritten_query += f" LIMIT {clauses['LIMIT']}"
+        return rewritten_query + ';'
+
+    def get_identifiers(self,clause:str) -> set:
+        """Get the lower case identifiers of a clause, ignoring string literals, numbers and function names."""
+        tokens = token_pattern.findall(string_literal_pattern.sub("''", clause).replace('"', ''))
+        return {token.strip().lower() for token in tokens if not token.strip().endswith('(') and not token.startswith('::')}
+
+    def aggregates_are_supported(self,clause:str) -> bool:
+        """Check every aggregate of a clause is COUNT(*) or an aggregate of a numeric column."""
+        for function, argument in aggregate_call_pattern.findall(clause):
+            if argument == '*':
+                if function.lower() != 'count':
+                    return False
+            elif argument.strip('"').lower() not in self.numeric_columns:
+                return False
+        return True
+
+    def rewrite_aggregates(self,clause:str) -> str:
+        """Replace each aggregate of a clause with the expression which recomputes it from the rollup rows."""
+        def rollup_expression(match:re.Match) -> str:
+            function, argument = match.group(1).lower(), match.group(2)
+            #counts of no rows are 0, not NULL
+            if argument == '*':
+                return 'CAST(COALESCE(SUM(row_count), 0) AS BIGINT)'
+            column = self.numeric_columns[argument.strip('"').lower()]
+            if function == 'count':
+                return f'CAST(COALESCE(SUM("{column}_count"), 0) AS BIGINT)'
+            if function == 'sum':
+                return f'SUM("{column}_sum")'
+            if function == 'avg':
+                return f'SUM("{column}_sum") / CAST(NULLIF(SUM("{column}_count"), 0) AS NUMERIC)'
+            return f'{function.upper()}("{column}_{function}")'
+        return aggregate_call_pattern.sub(rollup_expression, clause)
+
+    def rewrite_select_item(self,item:str) -> str:
+        """Rewrite a SELECT item, keeping the column name the base table query would return."""
+        match = aggregate_call_pattern.fullmatch(item.strip())
+        if match is not None:
+            #postgres names an unaliased aggregate after its function
+            return f'{self.rewrite_aggregates(item)} AS {match.group(1).lower()}'
+        return self.rewrite_aggregates(item)
+
+    def record_fallback(self) -> None:
+        """Count a rewritten query which failed (i.e. the rollup tables don't exist yet) and was run on the base table instead."""
+        with self.lock:
+            self.fallbacks += 1
+
+    def get_stats(self) -> dict:
+        """
+        Get the share of queries answered from the rollup tables.
+
+        Returns:
+            dict: The rewriter statistics with the keys: queries, rewritten, rewrite_rate, fallbacks.
+        """
+        with self.lock:
+            return {'queries': self.queries,
+                    'rewritten': self.rewritten,
+                    'rewrite_rate': self.rewritten / self.queries if self.queries else 0.0,
+                    'fallbacks': self.fallbacks}
+
+def split_top_level(clause:str) -> List[str]:
+    """
+    Split a clause on the commas which aren't inside parentheses or string literals.
+
+    Parameters:
+        clause (str): The clause (i.e. a SELECT list).
+
+    Returns:
+        List[str]: The items of the clause.
+    """
+    items, depth, in_string, current = [], 0, False, ''
+    for char in clause:
+        if char == "'":
+            in_string = not in_string
+        elif not in_string and char == '(':
+            depth += 1
+        elif not in_string and char == ')':
+            depth -= 1
+        elif not in_string and depth == 0 and char == ',':
+            items.append(current.strip())
+            current = ''
+            continue
+        current += char
+    items.append(current.strip())
+    return items
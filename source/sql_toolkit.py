@@ -1,21 +1,95 @@
-from typing import List,Optional
+from typing import List,Optional,Union
+import time
 
-from sqlalchemy.orm import sessionmaker
 from pandas import DataFrame
 
 from agno.tools import Toolkit
 
-from sqlalchemy import text, create_engine, Engine, Result
+from sqlalchemy import text, Engine, Result, Connection
+from .db_engine import get_pooled_engine, checkout_connection, get_pool_stats, dispose_pooled_engine
+from .caching import sql_result_cache
+from .result_shaping import shape_query_result
+from .instrumentation import measure_stage, record_cache_hit, record_db_query
+from .rollups import sql_rollup_rewriter
+from .indexing import sql_index_advisor
+from .embedded_engine import duckdb_engine
+
+def get_db_error_message(error:Exception) -> str:
+    """
+    Get the database's own message from an error raised while running a SQL query, without the SQLAlchemy wrapper and the
+    echoed statement, so it can be given to the sql_input_agent.
+
+    Parameters:
+        error (Exception): The error raised while running the SQL query.
+
+    Returns:
+        str: The first line of the database's error message.
+    """
+    error = getattr(error, 'orig', None) or error
+    return str(error).strip().split('\n')[0]
+
+class sql_query_error(Exception):
+    """
+    An error raised when a SQL query is aborted, with the reason in a form the retry logic and the agents can act on.
+
+    It includes:
+    - error_type: The reason the query was aborted, one of: timeout, row_cap, read_only, database.
+    - message: A description of the error and how the SQL query could be changed to avoid it.
+    - sql_query: The SQL query which was aborted.
+    """
+    #postgres error codes of a cancelled statement and of a write in a read-only transaction
+    error_types_by_pgcode = {'57014': 'timeout', '25006': 'read_only'}
+
+    def __init__(self, error_type: str, message: str, sql_query: str = ''):
+        super().__init__(message)
+        self.error_type = error_type
+        self.message = message
+        self.sql_query = sql_query
+
+    @classmethod
+    def from_db_error(cls, error: Exception, sql_query: str, statement_timeout: Optional[float] = None,
+                      error_type: Optional[str] = None) -> 'sql_query_error':
+        """Build a sql_query_error from an error raised by the database, its error_type is taken from the postgres error code if not given."""
+        error_type = error_type or cls.error_types_by_pgcode.get(getattr(getattr(error, 'orig', None), 'pgcode', None), 'database')
+        message = get_db_error_message(error)
+        if error_type == 'timeout':
+            message = (f"The SQL query was cancelled after the {statement_timeout} second statement timeout. Filter the rows with "
+                       f"WHERE, aggregate them or add a LIMIT so the query runs faster.")
+        elif error_type == 'read_only':
+            message = f"The SQL query tried to modify the database, only SELECT queries are allowed. ({message})"
+        return cls(error_type=error_type, message=message, sql_query=sql_query)
+
+    def to_dict(self) -> dict:
+        """Get the error as a dictionary with the keys: error, error_type, message."""
+        return {'error': True, 'error_type': self.error_type, 'message': self.message}
 
 class sql_toolkit(Toolkit):
     """
     A toolkit for interacting with a SQL databases.
     """
 
-    def __init__(self, db_user: str, db_password: str, db_host: str,db_port: str,db_name: str,dtype_dict: dict,table_name: str,data: Optional[DataFrame] = None):
+    def __init__(self, db_user: str, db_password: str, db_host: str,db_port: str,db_name: str,dtype_dict: dict,table_name: str,data: Optional[DataFrame] = None,
+                 pool_size: int = 5, max_overflow: int = 10, pool_pre_ping: bool = True, pool_recycle: int = 1800,
+                 result_cache: Optional[sql_result_cache] = None, max_result_rows: int = 200, max_result_tokens: int = 4000,
+                 fetch_size: int = 1000, max_rows: int = 10_000, statement_timeout: Optional[float] = 10.0, read_only: bool = True,
+                 connection_string: Optional[str] = None, rollup_rewriter: Optional[sql_rollup_rewriter] = None,
+                 index_advisor: Optional[sql_index_advisor] = None, backend: str = 'sqlalchemy'):
         """
         Initializes the SQLToolkit.
 
+        The toolkit owns one pooled engine for the lifetime of the process. The engine is created on the first query and shared
+        by every call and thread, so connections are reused rather than reopened for each SQL execution.
+
+        Each query runs in its own transaction and its rows are streamed from a server-side cursor fetch_size rows at a time. A query
+        is aborted with a sql_query_error if it returns more than max_rows rows or (on Postgres) runs for longer than statement_timeout,
+        so a runaway query can't hold a pooled connection or fill the worker's memory. With read_only the transaction can't modify
+        the database.
+
+        With the 'duckdb' backend the queries run on an embedded, in-process DuckDB copy of data instead (see source/embedded_engine.py),
+        with the same results, row cap, timeout, read-only check and errors but no database server. It suits read-only analytical
+        queries on a dataset which fits in memory and local testing without a database container. The rollup_rewriter and
+        index_advisor only apply to the 'sqlalchemy' backend.
+
         Parameters:
             db_user (str): Database username.
             db_password (str): Database password.
@@ -25,7 +99,30 @@ class sql_toolkit(Toolkit):
             table_name (str): Table name in the database.
             dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
             data (pd.DataFrame): Data to be used for updating the database.
+            pool_size (int): The number of connections kept open in the connection pool. Default is 5.
+            max_overflow (int): The number of connections allowed above pool_size when the pool is exhausted. Default is 10.
+            pool_pre_ping (bool): If True, test each pooled connection for liveness before it is used. Default is True.
+            pool_recycle (int): The number of seconds after which a pooled connection is replaced. Default is 1800.
+            result_cache (sql_result_cache): A cache of query results keyed on the SQL query and the table's data version. Default is None.
+            max_result_rows (int): The maximum number of rows given to the agent, larger results are summarised. Default is 200.
+            max_result_tokens (int): The maximum estimated number of tokens of a result given to the agent. Default is 4,000.
+            fetch_size (int): The number of rows fetched from the server-side cursor at a time. Default is 1,000.
+            max_rows (int): The maximum number of rows a query may return before it is aborted. Default is 10,000.
+            statement_timeout (float): The maximum number of seconds a query may run for on Postgres. Default is 10. None disables the timeout.
+            read_only (bool): If True, run queries in read-only transactions on Postgres. Default is True.
+            connection_string (str): A SQLAlchemy connection string used instead of the Postgres connection string built from the
+                                     credentials (i.e. a local SQLite file used by the benchmarks). Default is None.
+            rollup_rewriter (sql_rollup_rewriter): Rewrites aggregate queries by country or continent to read the rollup tables built
+                                                   with the table (see source/rollups.py). Default is None.
+            index_advisor (sql_index_advisor): Records the shape and duration of each query run on the table to recommend indexes
+                                               (see source/indexing.py). Default is None.
+            backend (str): Where the queries run, either 'sqlalchemy' (the database of the credentials or connection_string) or 'duckdb'
+                           (an in-process DuckDB copy of data, which is then required). Default is 'sqlalchemy'.
         """
+        if backend not in ('sqlalchemy', 'duckdb'):
+            raise ValueError(f"Invalid backend '{backend}', expected 'sqlalchemy' or 'duckdb'")
+        if backend == 'duckdb' and data is None:
+            raise ValueError("The data is required for the 'duckdb' backend")
         super().__init__(name="ski_resort_sql_tools",tools=[self.query_database])
         
         # Set default values for class attributes using environment variables
@@ -37,34 +134,126 @@ class sql_toolkit(Toolkit):
         self.table_name = table_name
         self.dtype_dict = dtype_dict
         self.data = data
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_pre_ping = pool_pre_ping
+        self.pool_recycle = pool_recycle
+        self.result_cache = result_cache
+        self.max_result_rows = max_result_rows
+        self.max_result_tokens = max_result_tokens
+        self.fetch_size = fetch_size
+        self.max_rows = max_rows
+        self.statement_timeout = statement_timeout
+        self.read_only = read_only
+        self.connection_string = connection_string
+        self.rollup_rewriter = rollup_rewriter
+        self.index_advisor = index_advisor
+        self.backend = backend
+        self.engine: Optional[Engine] = None
+        self.embedded_engine: Optional[duckdb_engine] = duckdb_engine(data=data, table_name=table_name) if backend == 'duckdb' else None
+
+    def __deepcopy__(self, memo):
+        """
+        Return the toolkit itself when an agent is copied (i.e. Agent.deep_copy) so every copy shares the toolkit's
+        pooled engine and data instead of duplicating them.
+        """
+        return self
 
     def get_db_engine(self)-> Engine:
-        """Helper method to get a new SQLAlchemy engine."""
+        """Helper method to get the toolkit's pooled SQLAlchemy engine, creating it on first use."""
         try:
-            connection_string = f"postgresql+psycopg2://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
-            return create_engine(connection_string)
+            if self.engine is None:
+                connection_string = self.connection_string or f"postgresql+psycopg2://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
+                self.engine = get_pooled_engine(connection_string=connection_string,
+                                                pool_size=self.pool_size,
+                                                max_overflow=self.max_overflow,
+                                                pool_pre_ping=self.pool_pre_ping,
+                                                pool_recycle=self.pool_recycle)
+            return self.engine
         except Exception as e:
             print(f"Error creating database engine: {e}")
 
-    def parse_sql_response(self, result: Result) -> List[dict]:
+    def get_pool_stats(self) -> dict:
         """
-        Helper method to parse the SQL response into a list of dictionaries.
+        Get the usage statistics of the toolkit's connection pool.
+
+        Returns:
+            dict: The pool statistics (checked out connections, waits, connect time, ...) or an empty dictionary if no
+                  query has been run yet.
+        """
+        if self.engine is None:
+            return {}
+        return get_pool_stats(self.engine)
+
+    def close(self) -> None:
+        """Close every pooled connection held by the toolkit. The pool is recreated if another query is run."""
+        if self.engine is not None:
+            dispose_pooled_engine(self.engine)
+            self.engine = None
+        if self.embedded_engine is not None:
+            self.embedded_engine.close()
+
+    def parse_sql_response(self, result: Result, query: str = '') -> List[dict]:
+        """
+        Helper method to parse the SQL response into a list of dictionaries. The rows are fetched fetch_size at a time and the
+        query is aborted once it returns more than max_rows rows.
         
         Parameters:
             result (sqlalchemy.engine.Result): The SQL response to parse.
+            query (str): The SQL query which produced the response. Default is an empty string.
         Returns:
             List[dict]: The parsed SQL response as a list of dictionaries."""
-        try:
-            rows_as_dicts = []
-            for row in result:
-                rows_as_dicts.append(row._asdict())
-            return rows_as_dicts
-        except Exception as e:
-            print(f"Error parsing SQL response: {e}")
-            return []
+        rows_as_dicts = []
+        while True:
+            rows = result.fetchmany(self.fetch_size)
+            if not rows:
+                return rows_as_dicts
+            rows_as_dicts.extend(row._asdict() for row in rows)
+            if len(rows_as_dicts) > self.max_rows:
+                raise sql_query_error(error_type='row_cap',
+                                      message=f"The SQL query returned more than {self.max_rows} rows. Filter the rows with WHERE, "
+                                              f"aggregate them or add a LIMIT.",
+                                      sql_query=query)
+
+    def configure_transaction(self, connection: Connection) -> None:
+        """
+        Make the connection's current transaction read-only and set its statement timeout. These only apply to Postgres and last
+        until the transaction ends, so the pooled connection is returned with its default settings.
+
+        Parameters:
+            connection (Connection): A connection with an open transaction.
+        """
+        if connection.dialect.name != 'postgresql':
+            return
+        if self.read_only:
+            connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+        if self.statement_timeout is not None:
+            connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(self.statement_timeout * 1000)}")
     
     
-    def query_database(self, query: str) -> List[dict]:
+    def explain_query(self, query: str) -> Optional[str]:
+        """
+        Ask Postgres to plan a SQL query with EXPLAIN without running it. This isn't exposed to the agent as a tool, it is used
+        to check a query before it is given to the sql_output_agent.
+
+        Parameters:
+            query (str): The SQL query to check.
+
+        Returns:
+            str: The database's error message if the query can't be planned or None if it can.
+        """
+        try:
+            if self.embedded_engine is not None:
+                self.embedded_engine.explain(query)
+                return None
+            engine = self.get_db_engine()
+            with checkout_connection(engine) as connection:
+                connection.execute(text(f"EXPLAIN {query.strip().rstrip(';')}"))
+            return None
+        except Exception as e:
+            return get_db_error_message(e)
+
+    def query_database(self, query: str) -> Union[List[dict],dict]:
         """
         Execute a SQL query on a database.
 
@@ -72,30 +261,143 @@ class sql_toolkit(Toolkit):
             query (str): The SQL query to execute in the form of a multi-line string. This query is generated by the AI agent.
 
         Returns:
-            List[dict]: The result of the query as a list of dictionaries.
+            List[dict]: The result of the query as a list of dictionaries. If the result is too large it is summarised instead, as a
+                        dictionary with 'truncated' set to True, the row_count, per column statistics and a sample of the rows.
+                        If the query was aborted a dictionary with 'error' set to True, the error_type and a message is returned.
         """
         try:
-            engine = self.get_db_engine()
+            return self.shape_result(self.execute_query(query))
+        except sql_query_error as e:
+            return e.to_dict()
+        except Exception as e:
+            return []
 
-            #creating a sql session with sql engine 
-            Session = sessionmaker(bind=engine)
-            session = Session()
+    def shape_result(self, rows: List[dict]) -> Union[List[dict],dict]:
+        """
+        Keep a query result within the toolkit's row and token budget before it is given to an agent (see shape_query_result).
 
-            #execute query 
-            result = session.execute(text(query))
+        Parameters:
+            rows (List[dict]): The rows of the query result.
 
-            #write result into a list of dictionaries
-            rows_as_dict:list = self.parse_sql_response(result)
+        Returns:
+            Union[List[dict],dict]: The rows if they are within the budget, otherwise a compact summary flagged as truncated.
+        """
+        return shape_query_result(rows=rows, max_rows=self.max_result_rows, max_tokens=self.max_result_tokens)
 
-            return rows_as_dict
-        
+    def execute_query(self, query: str) -> List[dict]:
+        """
+        Execute a SQL query on the database and raise any error. Unlike query_database this isn't exposed to the agent as a
+        tool, it is used by the workflow to run SQL queries directly.
+
+        Parameters:
+            query (str): The SQL query to execute.
+
+        Returns:
+            List[dict]: The result of the query as a list of dictionaries.
+
+        Raises:
+            sql_query_error: If the query fails, times out, returns more than max_rows rows or tries to modify the database.
+        """
+        #return the cached result if the same query ran since the table was last reloaded, the version is read once so a reload
+        #while the query runs can't store its result under the new version
+        table_version = self.result_cache.get_table_version() if self.result_cache is not None else None
+        if self.result_cache is not None:
+            cached_rows = self.result_cache.get(query, table_version=table_version)
+            if cached_rows is not None:
+                record_cache_hit('result_cache')
+                record_db_query(rows_returned=len(cached_rows))
+                return cached_rows
+
+        #aggregate queries are answered from the rollup tables, the table itself is queried if the rollups can't be read
+        rollup_query = self.rollup_rewriter.rewrite(query) if self.rollup_rewriter is not None and self.embedded_engine is None else None
+        rows_as_dict = None
+        if rollup_query is not None:
+            try:
+                rows_as_dict = self.run_query(rollup_query)
+                record_cache_hit('rollup')
+            except sql_query_error as e:
+                if e.error_type != 'database':
+                    raise
+                self.rollup_rewriter.record_fallback()
+        if rows_as_dict is None:
+            query_start = time.perf_counter()
+            try:
+                rows_as_dict = self.run_query(query)
+            finally:
+                #failed queries are recorded too, a timeout is the shape most in need of an index
+                if self.index_advisor is not None and self.embedded_engine is None:
+                    self.index_advisor.record(query, seconds=time.perf_counter() - query_start)
+        record_db_query(rows_returned=len(rows_as_dict))
+
+        if self.result_cache is not None:
+            self.result_cache.put(query, rows_as_dict, table_version=table_version)
+
+        return rows_as_dict
+
+    def run_query(self, query: str) -> List[dict]:
+        """
+        Run a SQL query on the database in its own transaction (see execute_query).
+
+        Parameters:
+            query (str): The SQL query to run.
+
+        Returns:
+            List[dict]: The result of the query as a list of dictionaries.
+
+        Raises:
+            sql_query_error: If the query fails, times out, returns more than max_rows rows or tries to modify the database.
+        """
+        if self.embedded_engine is not None:
+            return self.run_embedded_query(query)
+
+        engine = self.get_db_engine()
+
+        try:
+            #borrow a connection from the pool, it is returned to the pool when the block exits
+            with measure_stage('db_execution'), checkout_connection(engine) as connection, connection.begin():
+                self.configure_transaction(connection)
+
+                #execute query with a server-side cursor so rows are only fetched as they are parsed
+                result = connection.execution_options(stream_results=True, max_row_buffer=self.fetch_size).execute(text(query))
+
+                #write result into a list of dictionaries
+                return self.parse_sql_response(result, query=query)
+        except sql_query_error:
+            raise
         except Exception as e:
-            return []
-    
-        finally:
-            if 'session' in locals():session.close()
-            if 'engine' in locals():engine.dispose()
+            raise sql_query_error.from_db_error(error=e, sql_query=query, statement_timeout=self.statement_timeout) from e
 
+    def run_embedded_query(self, query: str) -> List[dict]:
+        """
+        Run a SQL query on the embedded DuckDB copy of the data (see run_query), raising the same errors as the database would.
 
+        Parameters:
+            query (str): The SQL query to run.
 
+        Returns:
+            List[dict]: The result of the query as a list of dictionaries.
 
+        Raises:
+            sql_query_error: If the query fails, times out, returns more than max_rows rows or isn't a SELECT query.
+        """
+        try:
+            with measure_stage('db_execution'):
+                if self.read_only and not self.embedded_engine.is_read_only(query):
+                    raise sql_query_error(error_type='read_only',
+                                          message="The SQL query tried to modify the database, only SELECT queries are allowed.",
+                                          sql_query=query)
+                rows_as_dict = self.embedded_engine.execute(query, fetch_size=self.fetch_size, max_rows=self.max_rows,
+                                                            timeout=self.statement_timeout)
+        except sql_query_error:
+            raise
+        except self.embedded_engine.duckdb.InterruptException as e:
+            raise sql_query_error.from_db_error(error=e, sql_query=query, statement_timeout=self.statement_timeout,
+                                                error_type='timeout') from e
+        except Exception as e:
+            raise sql_query_error.from_db_error(error=e, sql_query=query, statement_timeout=self.statement_timeout) from e
+        if len(rows_as_dict) > self.max_rows:
+            raise sql_query_error(error_type='row_cap',
+                                  message=f"The SQL query returned more than {self.max_rows} rows. Filter the rows with WHERE, "
+                                          f"aggregate them or add a LIMIT.",
+                                  sql_query=query)
+        return rows_as_dict
@@ -0,0 +1,195 @@
+from threading import Lock
+from typing import List, Optional
+import re
+
+#words which can appear in the SQL queries built from the sql_input_agent's keywords without being a column
+sql_keywords = {'select', 'distinct', 'from', 'where', 'and', 'or', 'not', 'in', 'like', 'ilike', 'is', 'null', 'between',
+                'group', 'by', 'having', 'order', 'asc', 'desc', 'nulls', 'first', 'last', 'limit', 'offset', 'as', 'case',
+                'when', 'then', 'else', 'end', 'true', 'false', 'all', 'any', 'some', 'exists', 'cast', 'filter', 'over',
+                'partition', 'rows', 'range', 'unbounded', 'preceding', 'following', 'current', 'row', 'union',
+                'intersect', 'except', 'fetch', 'next', 'only', 'similar', 'to', 'escape', 'interval', 'with', 'ties',
+                'percent', 'within', 'lateral', 'current_date', 'current_time', 'current_timestamp', 'localtime', 'localtimestamp'}
+
+#type names used in casts (i.e. CAST(x AS numeric) or x::numeric)
+sql_type_names = {'int', 'integer', 'bigint', 'smallint', 'numeric', 'decimal', 'real', 'float', 'double', 'precision',
+                  'text', 'varchar', 'char', 'character', 'varying', 'boolean', 'bool', 'date', 'timestamp'}
+
+#statements which modify the database, only SELECT statements are run by the sql_output_agent
+sql_modifying_keywords = {'insert', 'update', 'delete', 'drop', 'alter', 'create', 'truncate', 'grant', 'revoke', 'copy',
+                          'comment', 'vacuum', 'merge', 'call', 'do', 'set', 'reset', 'lock'}
+
+string_literal_pattern = re.compile(r"'(?:[^']|'')*'")
+quoted_identifier_pattern = re.compile(r'"((?:[^"]|"")*)"')
+#the field and FROM of EXTRACT(field FROM source) (i.e. EXTRACT(year FROM ...)) which aren't a column or the query's FROM clause
+extract_field_pattern = re.compile(r'\bextract\s*\(\s*"?\w+"?\s+from\b', re.IGNORECASE)
+#the select list of the query and an alias given without AS at the end of one of its items (i.e. AVG(lift_count) avg_lifts)
+select_list_pattern = re.compile(r'^select\s+(.*?)(?:\s+from\b|$)', re.IGNORECASE | re.DOTALL)
+implicit_alias_pattern = re.compile(r'[\w)\'"]\s+([A-Za-z_][A-Za-z0-9_]*)\s*$')
+token_pattern = re.compile(r'::\s*[A-Za-z_][A-Za-z0-9_]*|(?<![0-9])[A-Za-z_][A-Za-z0-9_]*(?:\s*\.\s*[A-Za-z_][A-Za-z0-9_]*)?\s*\(?')
+
+class sql_query_validator:
+    """
+    Checks a SQL query locally before it is given to the sql_output_agent, so a query which can't run is sent back to the
+    sql_input_agent without paying for a sql_output_agent call.
+
+    It checks that:
+    - The query is a single SELECT statement.
+    - The FROM clause only references the database table.
+    - Every identifier is a column of the table, an alias defined in the query, a SQL keyword or a function.
+    - (optional) Postgres can plan the query, by running EXPLAIN through the sql_toolkit's pooled connection.
+    """
+
+    def __init__(self,dtype_dict:dict,table_name:str,columns:Optional[List[str]]=None,toolkit=None,use_explain:bool=False):
+        """
+        Initializes the sql_query_validator.
+
+        Parameters:
+            dtype_dict (dict): Dictionary mapping column names to SQLAlchemy types.
+            table_name (str): Name of the table in the database.
+            columns (List[str]): Columns of the table which aren't in dtype_dict (i.e. the columns of the data loaded into the table). Default is None.
+            toolkit (sql_toolkit): The sql_output_agent's toolkit, used to run EXPLAIN. Default is None.
+            use_explain (bool): If True, run EXPLAIN on queries which pass the local checks. Requires a toolkit. Default is False.
+        """
+        self.table_name = table_name
+        self.columns = set(dtype_dict) | set(columns or [])
+        self.toolkit = toolkit
+        self.use_explain = use_explain and toolkit is not None
+        self.lock = Lock()
+        self.queries = 0
+        self.rejected = 0
+        self.rejected_by_explain = 0
+
+    def validate(self,sql_query:str) -> Optional[str]:
+        """
+        Validate a SQL query.
+
+        Parameters:
+            sql_query (str): The SQL query built from the sql_input_agent's keywords.
+
+        Returns:
+            str: A message describing why the query is invalid or None if the query is valid.
+        """
+        error = self.check_statement(sql_query)
+        used_explain = False
+        if error is None and self.use_explain:
+            used_explain = True
+            error = self.toolkit.explain_query(sql_query)
+        with self.lock:
+            self.queries += 1
+            if error is not None:
+                self.rejected += 1
+                if used_explain: self.rejected_by_explain += 1
+        return error
+
+    def check_statement(self,sql_query:str) -> Optional[str]:
+        """
+        Check the statement, table and identifiers of a SQL query without connecting to the database.
+
+        Parameters:
+            sql_query (str): The SQL query to check.
+
+        Returns:
+            str: A message describing why the query is invalid or None if the query passes the checks.
+        """
+        #remove string literals so their contents aren't read as identifiers
+        statement = string_literal_pattern.sub("''", sql_query).strip()
+        if statement.count("'") % 2 != 0:
+            return "The query contains an unterminated string literal."
+        statement = statement.rstrip(';').strip()
+        if ';' in statement:
+            return "The query must be a single SQL statement."
+        if statement.count('(') != statement.count(')'):
+            return "The query contains unbalanced parentheses."
+
+        #drop the field of EXTRACT(field FROM ...) so neither it nor its FROM is read as a column or the table
+        statement = extract_field_pattern.sub('EXTRACT(', statement)
+
+        #quoted identifiers are checked as written and then treated like unquoted identifiers
+        for quoted_identifier in quoted_identifier_pattern.findall(statement):
+            if quoted_identifier not in self.columns and quoted_identifier != self.table_name:
+                return f"Unknown column \"{quoted_identifier}\". The columns of {self.table_name} are: {', '.join(sorted(self.columns))}."
+        statement = quoted_identifier_pattern.sub(lambda match: match.group(1), statement)
+
+        tokens = [token.strip() for token in token_pattern.findall(statement)]
+        words = [token.lower() for token in tokens]
+        if not words or words[0] != 'select':
+            return "The query must be a SELECT statement."
+        for word in words:
+            if word in sql_modifying_keywords:
+                return f"The query must only read data, '{word.upper()}' isn't allowed."
+
+        #aliases defined with AS can be referenced elsewhere in the query (i.e. in ORDER BY), the table can also be given an alias
+        aliases = {words[index + 1] for index, word in enumerate(words[:-1]) if word == 'as'}
+        aliases |= get_implicit_aliases(statement)
+        table_aliases = set()
+        for index, word in enumerate(words):
+            if word in ('from', 'join'):
+                alias_index = index + 3 if words[index + 2:index + 3] == ['as'] else index + 2
+                if alias_index < len(words) and words[alias_index] not in sql_keywords:
+                    table_aliases.add(words[alias_index])
+        table_names = {self.table_name.lower()} | table_aliases
+        columns = {column.lower() for column in self.columns}
+
+        for index, word in enumerate(words):
+            previous_word = words[index - 1] if index > 0 else ''
+            if word.startswith('::') or word.endswith('('):
+                continue
+            if previous_word in ('from', 'join') and word != 'select':
+                if word != self.table_name.lower():
+                    return f"Unknown table '{tokens[index]}'. The only table is {self.table_name}."
+                continue
+            if '.' in word:
+                table, word = [part.strip() for part in word.split('.')]
+                if table not in table_names:
+                    return f"Unknown table '{table}'. The only table is {self.table_name}."
+            if word in sql_keywords or word in sql_type_names or word in aliases or word in columns:
+                continue
+            if word in table_names:
+                continue
+            return f"Unknown column '{tokens[index]}'. The columns of {self.table_name} are: {', '.join(sorted(self.columns))}."
+        return None
+
+    def get_stats(self) -> dict:
+        """
+        Get the number of queries which were validated and rejected.
+
+        Returns:
+            dict: The validator statistics with the keys: queries, rejected, rejected_by_explain.
+        """
+        with self.lock:
+            return {'queries': self.queries,
+                    'rejected': self.rejected,
+                    'rejected_by_explain': self.rejected_by_explain}
+
+def get_implicit_aliases(statement:str) -> set:
+    """
+    Get the aliases given to select list items without AS (i.e. SELECT AVG(lift_count) avg_lifts FROM ...).
+
+    Parameters:
+        statement (str): The SQL query, with its string literals and quoted identifiers removed.
+
+    Returns:
+        set: The lowercase aliases.
+    """
+    select_list = select_list_pattern.match(statement)
+    if select_list is None:
+        return set()
+    #split the select list on the commas which aren't inside a function call
+    items, depth, item_start = [], 0, 0
+    text = select_list.group(1)
+    for index, char in enumerate(text):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            items.append(text[item_start:index])
+            item_start = index + 1
+    items.append(text[item_start:])
+
+    aliases = set()
+    for item in items:
+        alias = implicit_alias_pattern.search(item.strip())
+        if alias is not None and alias.group(1).lower() not in sql_keywords and alias.group(1).lower() not in sql_type_names:
+            aliases.add(alias.group(1).lower())
+    return aliases
@@ -0,0 +1,28 @@
+import json
+
+from source.batch_runner import read_answered_ids
+
+def write_results(path, lines):
+    path.write_bytes(''.join(lines).encode())
+
+def test_missing_output_file(tmp_path):
+    assert read_answered_ids(tmp_path / 'results.jsonl') == set()
+
+def test_bad_lines_are_skipped_and_partial_last_line_is_removed(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    write_results(path, [json.dumps({'id': '1', 'error': False}) + '\n',
+                         'not json\n',
+                         json.dumps({'error': False}) + '\n',
+                         json.dumps({'id': '2', 'error': False}) + '\n',
+                         '{"id": "3", "err'])
+    assert read_answered_ids(path) == {'1', '2'}
+    assert path.read_text().endswith(json.dumps({'id': '2', 'error': False}) + '\n')
+    assert path.read_text().count('\n') == 4
+
+def test_errors_are_only_retried_with_retry_errors(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    write_results(path, [json.dumps({'id': '1', 'error': True}) + '\n',
+                         json.dumps({'id': '2', 'error': True}) + '\n',
+                         json.dumps({'id': '2', 'error': False}) + '\n'])
+    assert read_answered_ids(path) == {'1', '2'}
+    assert read_answered_ids(path, retry_errors=True) == {'2'}
@@ -0,0 +1,41 @@
+import gc
+
+from source import caching
+from source.caching import sql_keyword_cache, sql_result_cache, set_table_version
+
+def test_result_cache_is_keyed_on_the_table_version():
+    cache = sql_result_cache(table_name='cache_test_versions')
+    set_table_version('cache_test_versions', 'v1')
+    cache.put('SELECT 1', [{'x': 1}])
+    assert cache.get('select 1;') == [{'x': 1}]
+    set_table_version('cache_test_versions', 'v2')
+    assert cache.get('SELECT 1') is None
+
+def test_result_of_a_reloaded_table_is_not_stored_under_the_new_version():
+    cache = sql_result_cache(table_name='cache_test_reload')
+    set_table_version('cache_test_reload', 'v1')
+    table_version = cache.get_table_version()
+    assert cache.get('SELECT 1', table_version=table_version) is None
+    #the table is reloaded while the query runs
+    set_table_version('cache_test_reload', 'v2')
+    cache.put('SELECT 1', [{'x': 1}], table_version=table_version)
+    assert cache.get('SELECT 1') is None
+    assert cache.get_stats()['entries'] == 0
+
+def test_listeners_do_not_keep_caches_alive():
+    gc.collect()
+    set_table_version('cache_test_listeners', 'v0')
+    listeners = len(caching._table_version_listeners)
+    for version in range(5):
+        sql_keyword_cache(table_name='cache_test_listeners', dtype_dict={})
+        sql_result_cache(table_name='cache_test_listeners')
+        gc.collect()
+        set_table_version('cache_test_listeners', f"v{version + 1}")
+    assert len(caching._table_version_listeners) <= listeners
+
+def test_live_caches_are_cleared_when_the_table_changes():
+    cache = sql_keyword_cache(table_name='cache_test_clear', dtype_dict={}, ttl_seconds=None)
+    set_table_version('cache_test_clear', 'v1')
+    cache.put('How many resorts?', {'SELECT': 'COUNT(*)'})
+    set_table_version('cache_test_clear', 'v2')
+    assert cache.get_stats()['size'] == 0
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from source.sql_toolkit import sql_toolkit
+
+pytest.importorskip('duckdb')
+
+dtype_dict = {'name': None, 'country': None, 'lift_count': None}
+
+@pytest.fixture
+def toolkit():
+    data = pd.DataFrame({'name': ['coppermountain', 'whistlerblackcomb'], 'country': ['unitedstates', 'canada'], 'lift_count': [23, 37]})
+    return sql_toolkit(db_user='', db_password='', db_host='', db_port='', db_name='', dtype_dict=dtype_dict, table_name='ski_resorts',
+                       data=data, backend='duckdb')
+
+def test_query_reads_the_table(toolkit):
+    assert toolkit.query_database("SELECT name FROM ski_resorts WHERE country = 'canada'") == [{'name': 'whistlerblackcomb'}]
+
+@pytest.mark.parametrize('query', ["SELECT * FROM read_csv('/etc/hostname', header=false)",
+                                   "SELECT * FROM read_text('/etc/hostname')",
+                                   "SELECT * FROM 'https://example.com/resorts.csv'"])
+def test_file_and_url_table_functions_are_rejected(toolkit, query):
+    result = toolkit.query_database(query)
+    assert isinstance(result, dict) and result['error'] and result['error_type'] == 'database'
+
+def test_external_access_cannot_be_enabled_again(toolkit):
+    result = toolkit.query_database("SET enable_external_access = true")
+    assert isinstance(result, dict) and result['error_type'] == 'read_only'
+    toolkit.read_only = False
+    assert toolkit.query_database("SET enable_external_access = true")['error_type'] == 'database'
+
+def test_modifying_queries_are_rejected(toolkit):
+    assert toolkit.query_database("DELETE FROM ski_resorts")['error_type'] == 'read_only'
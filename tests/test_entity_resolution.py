@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from source.entity_resolution import sql_entity_resolver
+
+@pytest.fixture
+def resolver():
+    data = pd.DataFrame({'name': ['whistlerblackcomb', 'coppermountain', 'coppervale', 'copenhill', 'passopenice', 'bogonroverchallet',
+                                  'elcolorado', 'sarvesalta', 'lakecityskihill'],
+                         'country': ['canada', 'unitedstates', 'australia', 'denmark', 'italy', 'poland', 'colombia', 'sweden',
+                                     'unitedstates'],
+                         'continent': ['northamerica', 'northamerica', 'oceania', 'europe', 'europe', 'europe', 'southamerica',
+                                       'europe', 'northamerica']})
+    return sql_entity_resolver(data)
+
+def test_exact_and_alias_values(resolver):
+    assert resolver.resolve('How many resorts are in the US?') == {'country': ['unitedstates']}
+    assert resolver.resolve('Resorts in North America') == {'continent': ['northamerica']}
+
+def test_partial_names_are_candidates(resolver):
+    assert resolver.resolve('How many lifts does Copper have?') == {'candidates': {'name': ['coppermountain', 'coppervale']}}
+    assert resolver.resolve('Is Whistler open?') == {'candidates': {'name': ['whistlerblackcomb']}}
+
+@pytest.mark.parametrize('question', ['Resorts with a vertical over 1000 m', 'The biggest resort in Colorado',
+                                      'Resorts near Salt Lake City', 'Which resorts are open?'])
+def test_common_words_are_not_partial_names(resolver, question):
+    assert resolver.resolve(question) == {}
+
+def test_fuzzy_matches_are_candidates(resolver):
+    assert resolver.resolve('Resorts in Swedn') == {'candidates': {'country': ['sweden']}}
@@ -0,0 +1,28 @@
+import pytest
+
+from source.sql_validation import sql_query_validator
+
+dtype_dict = {'name': None, 'country': None, 'continent': None, 'lift_count': None, 'max_elevation_m': None}
+
+@pytest.fixture
+def validator():
+    return sql_query_validator(dtype_dict=dtype_dict, table_name='ski_resorts')
+
+@pytest.mark.parametrize('query', ["SELECT name FROM ski_resorts WHERE country = 'canada' ORDER BY lift_count DESC LIMIT 5",
+                                   "SELECT AVG(lift_count) AS avg_lifts FROM ski_resorts ORDER BY avg_lifts",
+                                   "SELECT AVG(lift_count) avg_lifts FROM ski_resorts WHERE country = 'canada'",
+                                   "SELECT country, COUNT(*) resorts FROM ski_resorts GROUP BY country ORDER BY resorts DESC",
+                                   "SELECT lift_count * 2 doubled, name FROM ski_resorts ORDER BY doubled",
+                                   "SELECT r.name FROM ski_resorts r WHERE r.lift_count > 10",
+                                   "SELECT CAST(lift_count AS numeric) FROM ski_resorts",
+                                   "SELECT EXTRACT(year FROM current_date) FROM ski_resorts"])
+def test_valid_queries(validator, query):
+    assert validator.validate(query) is None
+
+@pytest.mark.parametrize('query, error', [("SELECT avg_lifts FROM ski_resorts", "Unknown column 'avg_lifts'"),
+                                          ("SELECT AVG(lift_count) avg_lifts FROM ski_resorts WHERE lifts > 2", "Unknown column 'lifts'"),
+                                          ("SELECT name FROM resorts", "Unknown table 'resorts'"),
+                                          ("DELETE FROM ski_resorts", "The query must be a SELECT statement."),
+                                          ("SELECT name FROM ski_resorts; DROP TABLE ski_resorts", "The query must be a single SQL statement.")])
+def test_invalid_queries(validator, query, error):
+    assert error in validator.validate(query)